@@ -1,3 +1,5 @@
+import re
+
 def get_javascript():
     return """/**
 * This file is part of AdGuard's Block YouTube Ads (https://github.com/AdguardTeam/BlockYouTubeAdsShortcut).
@@ -375,4 +377,26 @@ def get_javascript():
       finish(ex.toString());
     }
   })();
-})();"""
\ No newline at end of file
+})();"""
+
+# Helper function to get the script as a document-start user script. It runs
+# before the parser has created <head>, so its elements go to <html> until then.
+# Its hiddenCSS table is left to the cosmetic filters (get_cosmetic_filters)
+def get_user_script():
+    script = get_javascript().replace("document.head", "(document.head || document.documentElement)")
+    return script.replace("hideElements(window.location.hostname);", "")
+
+# Helper function to get the script's hiddenCSS table as element hiding rules
+# ("www.youtube.com##selector"), one per line
+def get_cosmetic_filters():
+    table = get_javascript().split("const hiddenCSS = {", 1)[1].split("const hideElements", 1)[0]
+    lines = []
+    host = None
+    # Host names are the string literals followed by ":", selectors the others
+    for double, single, template, colon in re.findall(r'(?:"([^"]*)"|\'([^\']*)\'|`([^`]*)`)(\s*:)?', table):
+        text = double or single or template
+        if colon:
+            host = text
+        elif host:
+            lines.append(f"{host}##{text}")
+    return "\n".join(lines)
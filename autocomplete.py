@@ -0,0 +1,192 @@
+## Weaver [Version 1.0]
+## (c) Twilight Incorporated. All rights reserved.
+
+import bisect
+import heapq
+import itertools
+import math
+import re
+import time
+
+# Frecency halves every HALF_LIFE seconds without visits
+FRECENCY_HALF_LIFE = 14 * 86400
+# A bookmark counts like this many visits
+BOOKMARK_WEIGHT = 4.0
+# Queries matching more URLs than this (over all matching keys) are answered
+# by walking the entries in frecency order instead of ranking every match
+RANGE_SCAN_LIMIT = 1024
+# Entries walked at most in that case
+RANK_SCAN_LIMIT = 50000
+
+# History URLs indexed at most, the ones with the best frecency are kept
+MAX_ENTRIES = 100000
+
+# Splits URL paths and titles into searchable words
+_TOKEN_SEPARATORS = re.compile(r"[\s/?&=#:;,._\-+|()\[\]\"']+")
+
+# Helper function to turn a URL or typed text into the form keys are
+# stored in: lower case, without scheme and leading "www."
+def normalize(text):
+    text = text.strip().lower()
+    for prefix in ("https://", "http://", "www."):
+        if text.startswith(prefix):
+            text = text[len(prefix):]
+    return text
+
+class _Entry:
+    __slots__ = ("url", "title", "rank", "bookmarked", "keys")
+
+    def __init__(self, url, title):
+        self.url = url
+        self.title = title
+        # log2(frecency) + time / FRECENCY_HALF_LIFE: decay shifts every
+        # entry equally, so ranks stay comparable without recomputing them
+        self.rank = -math.inf
+        self.bookmarked = False
+        self.keys = ()
+
+class AutocompleteIndex:
+    """
+    Prefix index over history and bookmarks for the URL entry:
+      - every URL is indexed by itself (without scheme and "www.") and by the
+        words of its host, path and title
+      - matches are ranked by frecency, which is updated incrementally per visit
+      - rows are (url, title, visit_count, last_visit) like the urls table,
+        only the MAX_ENTRIES best of them are indexed
+    """
+    def __init__(self, rows=()):
+        self._entries = {}
+        # Sorted index keys, and the URLs of each key
+        self._keys = []
+        self._postings = {}
+        # Entries ordered by rank, as (-rank, url)
+        self._ranked = []
+        # URLs of the entries currently bookmarked
+        self._bookmarked = set()
+
+        ranked_rows = ((math.log2(max(visit_count, 1)) + last_visit / FRECENCY_HALF_LIFE, url, title)
+                       for url, title, visit_count, last_visit in rows)
+        for rank, url, title in heapq.nlargest(MAX_ENTRIES, ranked_rows):
+            entry = self._get_entry(url, title, sort=False)
+            entry.rank = rank
+        self._keys.sort()
+        self._ranked = sorted((-entry.rank, entry.url) for entry in self._entries.values())
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add_visit(self, url, title, timestamp=None, weight=1.0):
+        timestamp = time.time() if timestamp is None else timestamp
+        entry = self._get_entry(url, title)
+        if title and title != entry.title:
+            self._remove_keys(entry)
+            entry.title = title
+            self._add_keys(entry, sort=True)
+        # Decay the old score to now, then add this visit
+        decayed = 2 ** (entry.rank - timestamp / FRECENCY_HALF_LIFE) if entry.rank > -math.inf else 0.0
+        self._set_rank(entry, math.log2(decayed + weight) + timestamp / FRECENCY_HALF_LIFE)
+
+    def add_bookmark(self, url, title):
+        entry = self._get_entry(url, title)
+        if not entry.bookmarked:
+            entry.bookmarked = True
+            self._bookmarked.add(url)
+            self.add_visit(url, title, weight=BOOKMARK_WEIGHT)
+
+    def set_bookmarks(self, bookmarks):
+        # bookmarks are all current (url, title) pairs, entries that are not
+        # among them any more are no longer bookmarked (and count again if
+        # bookmarked again)
+        urls = set()
+        for url, title in bookmarks:
+            urls.add(url)
+            self.add_bookmark(url, title)
+        for url in self._bookmarked - urls:
+            entry = self._entries.get(url)
+            if entry:
+                entry.bookmarked = False
+        self._bookmarked = urls
+
+    def remove(self, url):
+        entry = self._entries.pop(url, None)
+        self._bookmarked.discard(url)
+        if entry:
+            self._remove_keys(entry)
+            self._remove_ranked(entry)
+
+    def search(self, query, limit=8):
+        # Returns up to limit (url, title) pairs, best first
+        query = normalize(query)
+        if not query:
+            return []
+
+        start = bisect.bisect_left(self._keys, query)
+        end = bisect.bisect_left(self._keys, query + "\uffff")
+        urls = set()
+        matched = end - start <= RANGE_SCAN_LIMIT
+        for key in self._keys[start:end] if matched else ():
+            postings = self._postings[key]
+            if len(urls) + len(postings) > RANGE_SCAN_LIMIT:
+                matched = False
+                break
+            urls.update(postings)
+        if matched:
+            best = heapq.nlargest(limit, (self._entries[url] for url in urls), key=lambda entry: entry.rank)
+        else:
+            # Short queries match a large part of the index, but also most
+            # of the best ranked entries, so walk those in order
+            best = []
+            for _, url in itertools.islice(self._ranked, RANK_SCAN_LIMIT):
+                entry = self._entries[url]
+                if any(key.startswith(query) for key in entry.keys):
+                    best.append(entry)
+                    if len(best) == limit:
+                        break
+        return [(entry.url, entry.title) for entry in best]
+
+    def top(self, limit):
+        # URLs of the best ranked entries, best first
+        return [url for _, url in itertools.islice(self._ranked, limit)]
+
+    def _get_entry(self, url, title, sort=True):
+        entry = self._entries.get(url)
+        if entry is None:
+            entry = _Entry(url, title or "")
+            self._entries[url] = entry
+            self._add_keys(entry, sort)
+        return entry
+
+    def _add_keys(self, entry, sort):
+        normalized = normalize(entry.url)
+        words = _TOKEN_SEPARATORS.split(normalized) + _TOKEN_SEPARATORS.split(entry.title.lower())
+        entry.keys = tuple({normalized, *(word for word in words if len(word) > 1)})
+        for key in entry.keys:
+            postings = self._postings.get(key)
+            if postings is None:
+                postings = self._postings[key] = set()
+                if sort:
+                    bisect.insort(self._keys, key)
+                else:
+                    self._keys.append(key)
+            postings.add(entry.url)
+
+    def _remove_keys(self, entry):
+        for key in entry.keys:
+            postings = self._postings[key]
+            postings.discard(entry.url)
+            if not postings:
+                del self._postings[key]
+                del self._keys[bisect.bisect_left(self._keys, key)]
+        entry.keys = ()
+
+    def _set_rank(self, entry, rank):
+        self._remove_ranked(entry)
+        entry.rank = rank
+        bisect.insort(self._ranked, (-rank, entry.url))
+
+    def _remove_ranked(self, entry):
+        if entry.rank == -math.inf:
+            return
+        index = bisect.bisect_left(self._ranked, (-entry.rank, entry.url))
+        if index < len(self._ranked) and self._ranked[index] == (-entry.rank, entry.url):
+            del self._ranked[index]
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+## Weaver [Version 1.0]
+## (c) Twilight Incorporated. All rights reserved.
+
+# Replays typed queries, one keystroke at a time, against an
+# AutocompleteIndex built from a synthetic large profile.
+#
+#   python3 benchmarks/bench_autocomplete.py [--urls N] [--visits N] [--queries N]
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from autocomplete import AutocompleteIndex
+from synthetic import generate_typed_queries, generate_urls, percentile
+
+def main():
+    parser = argparse.ArgumentParser(description="URL entry autocomplete benchmark")
+    parser.add_argument("--urls", type=int, default=300000)
+    parser.add_argument("--visits", type=int, default=1000000)
+    parser.add_argument("--queries", type=int, default=2000)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    rows = generate_urls(args.urls, args.visits)
+    print(f"Generated {len(rows)} URLs / {args.visits} visits in {time.perf_counter() - start:.1f}s")
+
+    start = time.perf_counter()
+    index = AutocompleteIndex(rows)
+    print(f"Built index in {time.perf_counter() - start:.2f}s")
+
+    keystrokes = generate_typed_queries(rows, args.queries)
+    timings = []
+    for query in keystrokes:
+        start = time.perf_counter()
+        index.search(query)
+        timings.append((time.perf_counter() - start) * 1000)
+
+    visits = []
+    for url, title, _, _ in rows[:5000]:
+        start = time.perf_counter()
+        index.add_visit(url, title)
+        visits.append((time.perf_counter() - start) * 1000)
+
+    print(f"{len(keystrokes)} keystrokes: p50 {percentile(timings, 50):.3f} ms, "
+          f"p99 {percentile(timings, 99):.3f} ms, max {max(timings):.3f} ms")
+    print(f"{len(visits)} visits: p50 {percentile(visits, 50):.3f} ms, p99 {percentile(visits, 99):.3f} ms")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+## Weaver [Version 1.0]
+## (c) Twilight Incorporated. All rights reserved.
+
+# Compares favicons.decode_favicon with the old Pillow path (decode, re-encode
+# to PNG, decode again with GdkPixbuf.Pixbuf.new_from_stream_at_scale), on
+# PNG icons like the ones favicons.db stores.
+#
+#   python3 benchmarks/bench_favicon_decode.py [--iterations N]
+#
+# Needs PyGObject (Gtk 4) and Pillow.
+
+import argparse
+import os
+import sys
+import time
+from io import BytesIO
+
+import gi
+gi.require_version('Gdk', '4.0')
+gi.require_version('GdkPixbuf', '2.0')
+from gi.repository import Gio, GdkPixbuf
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from favicons import FAVICON_SIZE, decode_favicon
+
+# Helper function to build the sample icons every path decodes
+def make_samples():
+    image = Image.new("RGBA", (256, 256))
+    for x in range(256):
+        for y in range(256):
+            image.putpixel((x, y), (x, y, (x + y) % 256, 255))
+
+    samples = {}
+    for size in (16, 32, 180):
+        with BytesIO() as png:
+            image.resize((size, size)).save(png, format="PNG")
+            samples[f"png {size}px"] = png.getvalue()
+    return samples
+
+# The decode path set_favicon_for_tab used before
+def decode_with_pillow(data):
+    image = Image.open(BytesIO(data))
+    with BytesIO() as png_image:
+        image.save(png_image, format="PNG")
+        png_image.seek(0)
+        return GdkPixbuf.Pixbuf.new_from_stream_at_scale(
+            Gio.MemoryInputStream.new_from_data(png_image.read()),
+            FAVICON_SIZE, FAVICON_SIZE, True
+        )
+
+def measure(func, data, iterations):
+    func(data)  # Warm up loaders
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func(data)
+    return (time.perf_counter() - start) / iterations * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description="Favicon decode micro-benchmark")
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"{'sample':<16}{'pillow (us)':>14}{'direct (us)':>14}{'speedup':>10}")
+    for name, data in make_samples().items():
+        old = measure(decode_with_pillow, data, args.iterations)
+        new = measure(decode_favicon, data, args.iterations)
+        print(f"{name:<16}{old:14.1f}{new:14.1f}{old / new:9.1f}x")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+## Weaver [Version 1.0]
+## (c) Twilight Incorporated. All rights reserved.
+
+# Measures the request filter engine: parsing a filter list, saving and
+# loading its cache, memory use and match throughput over a request corpus.
+#
+#   python3 benchmarks/bench_filterengine.py [--filters easylist.txt ...] [--corpus requests.tsv]
+#
+# A corpus has one "url<TAB>page url<TAB>type" line per recorded request.
+# Without --filters / --corpus a synthetic list and corpus are generated.
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from filterengine import FilterEngine
+from synthetic import generate_filter_list, generate_requests, generate_urls, percentile
+
+def read_corpus(path):
+    requests = []
+    with open(path) as f:
+        for line in f:
+            fields = line.rstrip("\n").split("\t")
+            if fields[0]:
+                requests.append((fields[0], fields[1] if len(fields) > 1 else None, fields[2] if len(fields) > 2 else "other"))
+    return requests
+
+def main():
+    parser = argparse.ArgumentParser(description="Request filter engine benchmark")
+    parser.add_argument("--filters", nargs="*", default=[])
+    parser.add_argument("--corpus")
+    parser.add_argument("--rules", type=int, default=100000, help="size of the synthetic filter list")
+    parser.add_argument("--requests", type=int, default=100000, help="size of the synthetic corpus")
+    args = parser.parse_args()
+
+    if args.filters:
+        texts = []
+        for path in args.filters:
+            with open(path, encoding="utf-8", errors="replace") as f:
+                texts.append(f.read())
+    else:
+        texts = [generate_filter_list(args.rules)]
+    requests = read_corpus(args.corpus) if args.corpus else generate_requests(generate_urls(20000, 40000), texts[0], args.requests)
+
+    start = time.perf_counter()
+    engine = FilterEngine.from_lists(texts)
+    print(f"Parsed {len(engine)} filters in {time.perf_counter() - start:.2f}s")
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "engine.bin")
+        start = time.perf_counter()
+        engine.save(path, "bench")
+        save_time = time.perf_counter() - start
+        start = time.perf_counter()
+        engine = FilterEngine.load(path, "bench")
+        load_time = time.perf_counter() - start
+        print(f"Cache: {os.path.getsize(path) / 1024 / 1024:.1f} MiB, saved in {save_time * 1000:.0f} ms, "
+              f"loaded in {load_time * 1000:.0f} ms")
+
+        # Memory of the engine as the browser holds it, loaded from the cache
+        del engine
+        tracemalloc.start()
+        engine = FilterEngine.load(path, "bench")
+        print(f"Memory: {tracemalloc.get_traced_memory()[0] / 1024 / 1024:.1f} MiB")
+        tracemalloc.stop()
+
+    # The first pass compiles the regular expressions it needs
+    for passes in ("cold", "warm"):
+        timings = []
+        blocked = 0
+        for url, page, resource_type in requests:
+            start = time.perf_counter()
+            blocked += engine.should_block(url, page, resource_type)
+            timings.append((time.perf_counter() - start) * 1e6)
+        print(f"{passes}: {len(requests)} requests, {blocked} blocked, {len(requests) / (sum(timings) / 1e6):.0f} matches/s, "
+              f"p50 {percentile(timings, 50):.1f} us, p99 {percentile(timings, 99):.1f} us")
+
+if __name__ == '__main__':
+    main()
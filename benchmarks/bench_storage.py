@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+## Weaver [Version 1.0]
+## (c) Twilight Incorporated. All rights reserved.
+
+# Measures the history and bookmark databases on synthetic profiles, without
+# the browser: migrating an old profile, inserting visits, the recent
+# history menu and sidebar pages, search, bookmark membership and clearing
+# history. Results are written as JSON, --compare prints the change against
+# the JSON of an earlier run (exit status 1 when a p50 regressed).
+#
+#   python3 benchmarks/bench_storage.py [--profiles 10k,100k,1M] [--output bench_storage.json]
+#                                      [--compare OLD.json] [--threshold 1.2]
+
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from storage import VISIT_BATCH_SIZE, BookmarkDatabase, HistoryDatabase
+from synthetic import generate_typed_queries, generate_urls, percentile
+
+# Profile name -> visits, each profile has a third as many URLs
+PROFILES = {"10k": 10000, "100k": 100000, "1M": 1000000}
+BOOKMARKS = 10000
+# Rows asked for by the recent history menu and a sidebar page
+RECENT_LIMIT = 15
+PAGE_LIMIT = 100
+
+# Helper function to get the commit being measured, if run from a checkout
+def current_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+# Helper function to summarize the run times (seconds) of one operation,
+# items is how many rows or visits the runs handled in total
+def summarize(timings, items=None):
+    total = sum(timings)
+    result = {"runs": len(timings), "total_s": round(total, 4),
+              "p50_ms": round(percentile(timings, 50) * 1000, 4), "p99_ms": round(percentile(timings, 99) * 1000, 4)}
+    result["per_s"] = round((items or len(timings)) / total, 1) if total else None
+    return result
+
+# Helper function to call func once per argument tuple and time every call
+def time_calls(func, calls):
+    timings = []
+    for args in calls:
+        start = time.perf_counter()
+        func(*args)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+# Helper function to write rows into the flat history table of profiles
+# from before schema version 1, one row per visit with local time strings
+def write_old_profile(db_path, rows, seed=5):
+    rng = random.Random(seed)
+    conn = sqlite3.connect(db_path)
+    with conn:
+        conn.execute("CREATE TABLE history (id INTEGER PRIMARY KEY, url TEXT, title TEXT, timestamp TEXT)")
+        conn.executemany("INSERT INTO history (url, title, timestamp) VALUES (?, ?, ?)", (
+            (url, title, time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(last_visit - (index and rng.randint(60, 30 * 86400)))))
+            for url, title, visit_count, last_visit in rows for index in range(visit_count)))
+    conn.close()
+
+def run_profile(name, n_visits, directory, n_queries):
+    rows = generate_urls(n_visits // 3, n_visits)
+    rng = random.Random(6)
+    history_db = os.path.join(directory, f"history-{name}.db")
+    write_old_profile(history_db, rows)
+    operations = {}
+
+    # Opening an old profile migrates it to the current schema
+    start = time.perf_counter()
+    history = HistoryDatabase(history_db)
+    operations["migrate"] = summarize([time.perf_counter() - start], n_visits)
+
+    # Batches as the storage worker commits them: half new URLs, half revisits
+    now = int(time.time())
+    batches = [[(f"https://bench{batch}.example.org/{index}" if index % 2 else rng.choice(rows)[0], "Benchmark page", now)
+                for index in range(VISIT_BATCH_SIZE)] for batch in range(100)]
+    operations["insert"] = summarize(time_calls(history.add_visits, ((batch,) for batch in batches)),
+                                     len(batches) * VISIT_BATCH_SIZE)
+
+    operations["recent"] = summarize(time_calls(history.recent, [(RECENT_LIMIT,)] * 500))
+
+    # The sidebar scrolling through the whole history, a page at a time
+    timings = []
+    after = None
+    for _ in range(min(500, len(rows) // PAGE_LIMIT)):
+        start = time.perf_counter()
+        page = history.page(after, 0, PAGE_LIMIT)
+        timings.append(time.perf_counter() - start)
+        after = (page[-1][3], page[-1][0])
+    operations["page"] = summarize(timings, len(timings) * PAGE_LIMIT)
+
+    queries = generate_typed_queries(rows, n_queries)[:n_queries]
+    operations["search"] = summarize(time_calls(history.search, ((query, PAGE_LIMIT) for query in queries)))
+
+    bookmarks = BookmarkDatabase(os.path.join(directory, f"bookmarks-{name}.db"))
+    bookmarked = rng.sample(rows, min(BOOKMARKS, len(rows)))
+    operations["bookmark-insert"] = summarize(time_calls(bookmarks.add, ((url, title) for url, title, _, _ in bookmarked)))
+    # Half of the URLs asked about are bookmarked
+    lookups = [(rng.choice(bookmarked if index % 2 else rows)[0],) for index in range(5000)]
+    operations["membership"] = summarize(time_calls(bookmarks.contains, lookups))
+    bookmarks.close()
+
+    # "Clear the last day", then the day before, ... and one site at a time
+    days = [(now - day * 86400,) for day in range(1, 21)]
+    operations["delete-range"] = summarize(time_calls(history.clear, days))
+    hosts = rng.sample(sorted({url.split("/")[2] for url, _, _, _ in rows}), 20)
+    operations["delete-domain"] = summarize(time_calls(lambda host: history.clear(domain=host), ((host,) for host in hosts)))
+    history.close()
+
+    return {"urls": len(rows), "visits": n_visits, "bookmarks": len(bookmarked),
+            "history_db_bytes": os.path.getsize(history_db), "operations": operations}
+
+# Helper function to print the p50 change of every operation measured by
+# both runs, returns the regressions beyond threshold
+def compare(old, new, threshold):
+    regressions = []
+    print(f"\nAgainst {old.get('commit') or 'the old run'}:")
+    for name, profile in new["profiles"].items():
+        for operation, result in profile["operations"].items():
+            old_result = old.get("profiles", {}).get(name, {}).get("operations", {}).get(operation)
+            if not old_result or not old_result["p50_ms"]:
+                continue
+            ratio = result["p50_ms"] / old_result["p50_ms"]
+            marker = " REGRESSION" if ratio > threshold else ""
+            print(f"  {name:>5} {operation:<16}{old_result['p50_ms']:10.3f} ms -> {result['p50_ms']:10.3f} ms  {ratio:5.2f}x{marker}")
+            if marker:
+                regressions.append((name, operation))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="History and bookmark storage benchmark")
+    parser.add_argument("--profiles", default=",".join(PROFILES), help=f"comma separated, out of {', '.join(PROFILES)}")
+    parser.add_argument("--queries", type=int, default=500, help="search keystrokes per profile")
+    parser.add_argument("--output", default="bench_storage.json")
+    parser.add_argument("--compare", help="JSON of an earlier run")
+    parser.add_argument("--threshold", type=float, default=1.2, help="p50 ratio counted as a regression")
+    args = parser.parse_args()
+
+    results = {"benchmark": "storage", "commit": current_commit(), "date": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+               "python": platform.python_version(), "sqlite": sqlite3.sqlite_version, "profiles": {}}
+    with tempfile.TemporaryDirectory() as directory:
+        for name in args.profiles.split(","):
+            start = time.perf_counter()
+            results["profiles"][name] = profile = run_profile(name, PROFILES[name], directory, args.queries)
+            print(f"{name}: {profile['urls']} URLs / {profile['visits']} visits, "
+                  f"{profile['history_db_bytes'] / 1024 / 1024:.1f} MiB, {time.perf_counter() - start:.1f}s")
+            for operation, result in profile["operations"].items():
+                print(f"  {operation:<16}p50 {result['p50_ms']:9.3f} ms, p99 {result['p99_ms']:9.3f} ms, {result['per_s']:>12}/s")
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Wrote {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            if compare(json.load(f), results, args.threshold):
+                return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
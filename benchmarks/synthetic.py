@@ -0,0 +1,101 @@
+## Weaver [Version 1.0]
+## (c) Twilight Incorporated. All rights reserved.
+
+# Synthetic profile data shared by the benchmarks. Everything is generated
+# from a seed, so runs on different commits see the same profile.
+
+import random
+import time
+
+SYLLABLES = ["ka", "lo", "mi", "ne", "ru", "ta", "shi", "ven", "dor", "pla", "gre", "bit",
+             "hub", "net", "zon", "ix", "qu", "fla", "tro", "sen", "wi", "ki", "pe", "dia"]
+TLDS = ["com", "org", "net", "io", "dev", "de", "co.uk"]
+
+# Helper function to make up a pronounceable word
+def make_word(rng, syllables=(2, 4)):
+    return "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(*syllables)))
+
+# Helper function to generate history rows like the urls table:
+# (url, title, visit_count, last_visit). Hosts and visit counts follow a
+# long-tailed distribution, like real browsing
+def generate_urls(n_urls, n_visits, seed=1):
+    rng = random.Random(seed)
+    n_hosts = max(1, n_urls // 30)
+    hosts = [f"{rng.choice(['www.', '', '', 'docs.', 'm.'])}{make_word(rng)}.{rng.choice(TLDS)}" for _ in range(n_hosts)]
+    now = int(time.time())
+
+    urls = {}
+    while len(urls) < n_urls:
+        host = hosts[min(int(rng.paretovariate(1.2)) - 1, n_hosts - 1)]
+        path = "/".join(make_word(rng, (1, 3)) for _ in range(rng.randint(0, 3)))
+        url = f"https://{host}/{path}"
+        if url not in urls:
+            title = " ".join(make_word(rng).capitalize() for _ in range(rng.randint(1, 6)))
+            urls[url] = [title, 0, now - rng.randint(0, 365 * 86400)]
+
+    # Spread the visits with a long tail over the URLs
+    url_list = list(urls)
+    for _ in range(max(n_visits - n_urls, 0)):
+        urls[url_list[min(int(rng.paretovariate(0.8)) - 1, n_urls - 1)]][1] += 1
+    return [(url, title, visit_count + 1, last_visit) for url, (title, visit_count, last_visit) in urls.items()]
+
+# Helper function to pick the texts a user would type, one keystroke at a
+# time: prefixes of visited hosts and of title words
+def generate_typed_queries(rows, n_queries, seed=2):
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(n_queries):
+        url, title, _, _ = rng.choice(rows)
+        if rng.random() < 0.7:
+            text = url.split("://", 1)[1].removeprefix("www.")[:rng.randint(3, 20)]
+        else:
+            text = rng.choice(title.split()).lower()
+        queries.extend(text[:length] for length in range(1, len(text) + 1))
+    return queries
+
+# Helper function to get the p-th percentile of a list of numbers
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+# Helper function to generate a filter list shaped like EasyList: mostly
+# blocked ad/tracker hosts, then path fragments, options and exceptions
+def generate_filter_list(n_filters, seed=3):
+    rng = random.Random(seed)
+    lines = ["[Adblock Plus 2.0]", "! Title: Synthetic filters"]
+    for index in range(n_filters):
+        kind = rng.random()
+        host = f"{make_word(rng)}.{rng.choice(TLDS)}"
+        if kind < 0.55:
+            lines.append(f"||{host}^" + rng.choice(["", "", "$third-party", "$script,third-party", "$image"]))
+        elif kind < 0.8:
+            # Ad servers' path words are not the ones of the sites' own pages
+            word = "".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(4, 9)))
+            fragment = (rng.choice(["/", "-", "_", "."]) + word + rng.choice(["/", "_", "-", "."])
+                        + rng.choice(["ad", "ads", "banner", "track", "pixel"]) + rng.choice(["", "/", ".js", "*"]))
+            # Like in real lists, "/.../" would be a regular expression
+            lines.append(fragment + "*" if fragment.startswith("/") and fragment.endswith("/") else fragment)
+        elif kind < 0.88:
+            lines.append(f"||{host}/{make_word(rng)}/*$domain={make_word(rng)}.{rng.choice(TLDS)}|~{make_word(rng)}.com")
+        elif kind < 0.95:
+            lines.append(f"@@||{host}/{make_word(rng, (1, 2))}.js$script")
+        elif kind < 0.998:
+            lines.append(f"{make_word(rng)}.{rng.choice(TLDS)}##.ad-{make_word(rng, (1, 2))}")
+        else:
+            lines.append(f"/^https?:\\/\\/{make_word(rng, (1, 2))}[0-9]+\\./$third-party")
+    return "\n".join(lines)
+
+# Helper function to generate requests (url, page url, type) as a page load
+# would make them: mostly from the page's own host, some to filtered hosts
+def generate_requests(rows, filter_list, n_requests, seed=4):
+    rng = random.Random(seed)
+    blocked_hosts = [line[2:].split("^")[0] for line in filter_list.splitlines() if line.startswith("||")]
+    types = ["script", "image", "image", "image", "stylesheet", "xmlhttprequest", "font", "subdocument"]
+    requests = []
+    for _ in range(n_requests):
+        page = rng.choice(rows)[0]
+        host = page.split("/")[2] if rng.random() < 0.7 else rng.choice(blocked_hosts)
+        path = "/".join(make_word(rng, (1, 3)) for _ in range(rng.randint(1, 4)))
+        requests.append((f"https://{host}/{path}.{rng.choice(['js', 'png', 'css', 'json'])}?v={rng.randint(1, 999)}",
+                         page, rng.choice(types)))
+    return requests
@@ -0,0 +1,439 @@
+## Weaver [Version 1.0]
+## (c) Twilight Incorporated. All rights reserved.
+
+import os
+import threading
+from collections import OrderedDict
+from urllib.parse import urlsplit
+from gi.repository import GLib, WebKit
+from filterengine import FilterEngine
+from cosmeticfilters import CosmeticFilterIndex, hiding_style_sheet
+
+# Filter lists (EasyList, uBlock Origin style) are read from this directory
+# of the profile, every *.txt file in it is one list
+FILTERS_DIRECTORY = "filters"
+# Compiled filters are kept here by WebKit.UserContentFilterStore
+COMPILED_FILTERS_DIRECTORY = "content-filters"
+# All lists compile into a single filter, so exception rules of one list
+# also apply to the blocking rules of the others
+FILTER_IDENTIFIER = "weaver-content-blocker"
+# Cache of the FilterEngine built from the lists, next to the compiled filter
+FILTER_ENGINE_CACHE = "filter-engine.bin"
+# Bumped whenever convert_filter_list() changes, so old compilations are redone
+CONVERTER_VERSION = 3
+# WebKit refuses to compile content blockers with more rules than this
+MAX_RULES = 150000
+
+# Hosts whose element hiding style sheet stays in the user content manager,
+# others are rebuilt when visited again. Hosts open in a tab always keep
+# theirs, removing a sheet shows the hidden elements again
+COSMETIC_CACHED_HOSTS = 64
+
+# Pages the YouTube ad-blocking script is injected into
+YOUTUBE_URL_PATTERNS = ["https://www.youtube.com/*", "https://m.youtube.com/*", "https://music.youtube.com/*"]
+
+# WebKit resource types of the network filter options
+RESOURCE_TYPES = {
+    "script": ["script"],
+    "image": ["image"],
+    "stylesheet": ["style-sheet"],
+    "font": ["font"],
+    "media": ["media"],
+    "popup": ["popup"],
+    "subdocument": ["document"],
+    "document": ["document"],
+    "xmlhttprequest": ["raw"],
+    "websocket": ["raw"],
+    "object": ["media"],
+    "other": ["raw"],
+    "ping": ["raw"],
+}
+ALL_RESOURCE_TYPES = sorted({t for types in RESOURCE_TYPES.values() for t in types})
+
+# Options that change what a rule does in ways a content blocker can not do
+# (rewriting requests, CSP, ...), such rules are skipped rather than turned
+# into plain blocking rules
+UNSUPPORTED_OPTIONS = {"csp", "redirect", "redirect-rule", "removeparam", "rewrite", "replace", "badfilter",
+                       "generichide", "elemhide", "specifichide", "genericblock", "header", "permissions",
+                       "urltransform", "empty", "mp4", "inline-script", "inline-font", "webrtc", "cookie"}
+
+# Characters with a meaning in WebKit's url-filter regular expressions
+_REGEX_SPECIALS = set(".+?()[]{}\\$|")
+
+# Helper function to turn a network filter pattern into a WebKit url-filter
+# regular expression. WebKit only supports a subset of regular expressions
+# (no alternation), so "^" is approximated by a single separator character
+def pattern_to_url_filter(pattern):
+    prefix = suffix = ""
+    if pattern.startswith("||"):
+        # Any scheme, the domain itself or any of its subdomains
+        prefix = r"^[^:]+:(//)?([^/]+\.)?"
+        pattern = pattern[2:]
+    elif pattern.startswith("|"):
+        prefix = "^"
+        pattern = pattern[1:]
+    if pattern.endswith("|"):
+        suffix = "$"
+        pattern = pattern[:-1]
+
+    body = []
+    for char in pattern:
+        if char == "*":
+            body.append(".*")
+        elif char == "^":
+            body.append("[^a-zA-Z0-9_.%-]")
+        elif char in _REGEX_SPECIALS:
+            body.append("\\" + char)
+        else:
+            body.append(char)
+    body = "".join(body)
+    if not prefix:
+        # Leading and trailing wildcards are implied
+        while body.startswith(".*"):
+            body = body[2:]
+    if not suffix:
+        while body.endswith(".*") and not body.endswith("\\.*"):
+            body = body[:-2]
+    return prefix + (body or ".*") + suffix
+
+# Helper function to convert one network filter line into WebKit content
+# blocker rules, none when it can not be expressed as them
+def convert_filter(line):
+    exception = line.startswith("@@")
+    if exception:
+        line = line[2:]
+
+    pattern, options = line, []
+    if "$" in line:
+        pattern, _, option_text = line.rpartition("$")
+        options = [option.strip().lower() for option in option_text.split(",") if option.strip()]
+    if pattern.startswith("/") and pattern.endswith("/") and len(pattern) > 1:
+        # Regular expression filters use syntax WebKit does not support
+        return []
+    if not pattern.isascii():
+        return []
+
+    trigger = {"url-filter": pattern_to_url_filter(pattern)}
+    if_domains, unless_domains = [], []
+    resource_types, excluded_types = set(), set()
+    whole_document = subdocument = False
+    for option in options:
+        name, _, value = option.partition("=")
+        negated = name.startswith("~")
+        name = name.lstrip("~")
+        if name in UNSUPPORTED_OPTIONS:
+            return []
+        if name == "third-party" or name == "3p":
+            trigger["load-type"] = ["first-party" if negated else "third-party"]
+        elif name == "first-party" or name == "1p":
+            trigger["load-type"] = ["third-party" if negated else "first-party"]
+        elif name == "domain":
+            for domain in value.split("|"):
+                if domain.startswith("~"):
+                    unless_domains.append("*" + domain[1:])
+                elif domain:
+                    if_domains.append("*" + domain)
+        elif name == "match-case":
+            trigger["url-filter-is-case-sensitive"] = True
+        elif name in RESOURCE_TYPES:
+            if name == "document" and exception and not negated:
+                whole_document = True
+            elif negated:
+                excluded_types.update(RESOURCE_TYPES[name])
+            elif name == "subdocument":
+                subdocument = True
+            else:
+                resource_types.update(RESOURCE_TYPES[name])
+        elif name not in ("important", "all"):
+            # Unknown option, better not to guess what it means
+            return []
+
+    if whole_document:
+        # "@@||example.com^$document" turns blocking off on that site
+        domain = pattern.lstrip("|").rstrip("^|/")
+        if not domain or "*" in domain or "/" in domain:
+            return []
+        return [{"trigger": {"url-filter": ".*", "if-domain": ["*" + domain.lower()]},
+                 "action": {"type": "ignore-previous-rules"}}]
+
+    if excluded_types:
+        if resource_types or subdocument:
+            resource_types -= excluded_types
+            subdocument = subdocument and "document" not in excluded_types
+        else:
+            resource_types = set(ALL_RESOURCE_TYPES) - excluded_types
+        if not resource_types and not subdocument:
+            return []
+    # A trigger takes if-domain or unless-domain, not both. Subdomains
+    # excluded from a blocking rule are let through again by a rule of their
+    # own, an exception for only part of its domains would unblock too much
+    if if_domains:
+        trigger["if-domain"] = if_domains
+        if unless_domains and exception:
+            return []
+    elif unless_domains:
+        trigger["unless-domain"] = unless_domains
+    action = {"type": "ignore-previous-rules" if exception else "block"}
+    rules = []
+    # Frames are documents loaded in a child frame. load-context applies to
+    # the whole trigger, so they get a rule of their own and the other types
+    # still match in the main frame too
+    if subdocument and "document" not in resource_types:
+        rules.append({"trigger": dict(trigger, **{"resource-type": ["document"], "load-context": ["child-frame"]}),
+                      "action": action})
+    if resource_types:
+        rules.append({"trigger": dict(trigger, **{"resource-type": sorted(resource_types)}), "action": action})
+    elif not subdocument:
+        rules.append({"trigger": trigger, "action": action})
+    if if_domains and unless_domains:
+        rules += [{"trigger": dict(rule["trigger"], **{"if-domain": unless_domains}),
+                   "action": {"type": "ignore-previous-rules"}} for rule in rules]
+    return rules
+
+# Helper function to convert filter list text into WebKit content blocker
+# rules. Exceptions only override the rules before them, so they come last.
+# Blocking rules letting some of their subdomains through again come first,
+# so that doesn't unblock what other rules block there
+def convert_filter_list(text):
+    scoped, blocking, exceptions = [], [], []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith(("!", "[")):
+            continue
+        # Element hiding and scriptlet rules are not network filters
+        if "##" in line or "#@#" in line or "#?#" in line or "#$#" in line or "#%#" in line:
+            continue
+        rules = convert_filter(line)
+        if len({rule["action"]["type"] for rule in rules}) > 1:
+            scoped.extend(rules)
+            continue
+        for rule in rules:
+            if rule["action"]["type"] == "block":
+                blocking.append(rule)
+            else:
+                exceptions.append(rule)
+    return scoped, blocking, exceptions
+
+class ContentBlocker:
+    """
+    Network-level blocking with the profile's filter lists:
+      - lists are converted to WebKit content blocker JSON and compiled once
+        into a WebKit.UserContentFilterStore in the profile
+      - they are only converted again when the lists (or the converter) change
+      - the compiled filter is added to the user content manager every tab shares,
+        so blocked requests never leave the network process
+      - YouTube's ads, served from youtube.com itself, are removed by a user
+        script injected at document start
+      - the same lists also load into a FilterEngine, which answers requests
+        WebKit does not ask the content blocker about (like popups)
+      - element hiding rules become user style sheets: generic ones once for
+        all sites, domain specific ones per host as it is navigated to
+    """
+    def __init__(self, profile_directory):
+        self.filters_directory = os.path.join(profile_directory, FILTERS_DIRECTORY)
+        os.makedirs(self.filters_directory, exist_ok=True)
+        compiled_directory = os.path.join(profile_directory, COMPILED_FILTERS_DIRECTORY)
+        os.makedirs(compiled_directory, exist_ok=True)
+        self._hash_path = os.path.join(compiled_directory, FILTER_IDENTIFIER + ".sha256")
+        self._engine_path = os.path.join(compiled_directory, FILTER_ENGINE_CACHE)
+        # None until the lists are loaded
+        self.engine = None
+        self.blocked_count = 0
+
+        self.user_content_manager = WebKit.UserContentManager()
+        self._add_youtube_script()
+        self._store = WebKit.UserContentFilterStore.new(compiled_directory)
+        self._filter = None
+        self._cosmetic_filters = None
+        self._generic_style_sheets = []
+        # host -> its UserStyleSheet (None when nothing is hidden there), least recently used first
+        self._host_style_sheets = OrderedDict()
+
+    def load(self):
+        # Reads and hashes the lists off the main thread, then loads or
+        # compiles the filter. Call once the window is shown, requests are
+        # let through until then
+        threading.Thread(target=self._read_lists, name="weaver-content-blocker", daemon=True).start()
+
+    def should_block(self, url, source_url=None, resource_type="other"):
+        if self.engine is None or not self.engine.should_block(url, source_url, resource_type):
+            return False
+        self.blocked_count += 1
+        return True
+
+    def _add_youtube_script(self):
+        # Registered once, WebKit injects it into matching pages (and frames)
+        # before any of their own scripts run, including in-app navigations
+        import adblockeryt
+        self.user_content_manager.add_script(WebKit.UserScript.new(
+            adblockeryt.get_user_script(), WebKit.UserContentInjectedFrames.ALL_FRAMES,
+            WebKit.UserScriptInjectionTime.START, YOUTUBE_URL_PATTERNS, None))
+
+    def apply_cosmetic_filters(self, url, open_urls=()):
+        # Adds the style sheet hiding host specific elements before the page
+        # at url is shown, building it on the first visit to its host.
+        # open_urls are the pages of the open tabs, whose sheets are kept
+        host = urlsplit(url).hostname if url and url.startswith(("http://", "https://")) else None
+        if not host or self._cosmetic_filters is None:
+            return
+        if host in self._host_style_sheets:
+            self._host_style_sheets.move_to_end(host)
+            return
+
+        selectors = self._cosmetic_filters.host_selectors(host)
+        style_sheet = None
+        if selectors:
+            style_sheet = WebKit.UserStyleSheet.new(
+                hiding_style_sheet(selectors), WebKit.UserContentInjectedFrames.ALL_FRAMES,
+                WebKit.UserStyleLevel.USER, [f"http://{host}/*", f"https://{host}/*"], None)
+            self.user_content_manager.add_style_sheet(style_sheet)
+        self._host_style_sheets[host] = style_sheet
+        excess = len(self._host_style_sheets) - COSMETIC_CACHED_HOSTS
+        if excess <= 0:
+            return
+        open_hosts = {urlsplit(open_url).hostname for open_url in open_urls if open_url}
+        open_hosts.add(host)
+        evicted = [cached for cached in self._host_style_sheets if cached not in open_hosts][:excess]
+        for cached in evicted:
+            style_sheet = self._host_style_sheets.pop(cached)
+            if style_sheet:
+                self.user_content_manager.remove_style_sheet(style_sheet)
+
+    # Worker thread
+
+    def _read_lists(self):
+        # Only needed here, kept out of the startup imports
+        import glob
+        import hashlib
+        import adblockeryt
+        digest = hashlib.sha256(f"converter {CONVERTER_VERSION}\n".encode())
+        texts = []
+        for path in sorted(glob.glob(os.path.join(self.filters_directory, "*.txt"))):
+            try:
+                with open(path, "rb") as f:
+                    data = f.read()
+            except OSError as e:
+                print(f"Failed to read filter list {path}: {e}")
+                continue
+            digest.update(os.path.basename(path).encode() + b"\0" + data + b"\0")
+            texts.append(data.decode("utf-8", errors="replace"))
+        list_hash = digest.hexdigest()
+
+        try:
+            with open(self._hash_path) as f:
+                compiled_hash = f.read().strip()
+        except OSError:
+            compiled_hash = None
+
+        if texts:
+            self._load_engine(texts, list_hash)
+
+        cosmetic_filters = CosmeticFilterIndex()
+        cosmetic_filters.add_list(adblockeryt.get_cosmetic_filters())
+        for text in texts:
+            cosmetic_filters.add_list(text)
+        GLib.idle_add(self._set_cosmetic_filters, cosmetic_filters)
+
+        if not texts:
+            GLib.idle_add(self._remove_filter)
+        elif list_hash == compiled_hash:
+            GLib.idle_add(self._load_compiled, texts, list_hash)
+        else:
+            self._convert(texts, list_hash)
+
+    def _load_engine(self, texts, list_hash):
+        engine = FilterEngine.load(self._engine_path, list_hash)
+        if engine is None:
+            engine = FilterEngine.from_lists(texts)
+            try:
+                engine.save(self._engine_path, list_hash)
+            except OSError as e:
+                print(f"Failed to save the filter engine cache: {e}")
+        GLib.idle_add(self._set_engine, engine)
+
+    def _convert(self, texts, list_hash):
+        scoped, blocking, exceptions = [], [], []
+        for text in texts:
+            list_scoped, list_blocking, list_exceptions = convert_filter_list(text)
+            scoped.extend(list_scoped)
+            blocking.extend(list_blocking)
+            exceptions.extend(list_exceptions)
+        blocking = scoped + blocking
+        rules = blocking[:MAX_RULES - min(len(exceptions), MAX_RULES)] + exceptions[:MAX_RULES]
+        if len(blocking) + len(exceptions) > MAX_RULES:
+            print(f"Content blocker: {len(blocking) + len(exceptions)} rules, only the first {MAX_RULES} are used")
+        import json
+        source = GLib.Bytes.new(json.dumps(rules, separators=(",", ":")).encode())
+        GLib.idle_add(self._compile, source, list_hash, len(rules))
+
+    # Main thread
+
+    def _load_compiled(self, texts, list_hash):
+        self._store.load(FILTER_IDENTIFIER, None, self._on_loaded, (texts, list_hash))
+        return GLib.SOURCE_REMOVE
+
+    def _on_loaded(self, store, result, data):
+        try:
+            self._set_filter(store.load_finish(result))
+        except GLib.Error:
+            # Hash without a compiled filter (deleted or from another WebKit
+            # version), compile it again
+            texts, list_hash = data
+            threading.Thread(target=self._convert, args=(texts, list_hash), daemon=True).start()
+
+    def _compile(self, source, list_hash, n_rules):
+        self._store.save(FILTER_IDENTIFIER, source, None, self._on_compiled, (list_hash, n_rules))
+        return GLib.SOURCE_REMOVE
+
+    def _on_compiled(self, store, result, data):
+        list_hash, n_rules = data
+        try:
+            content_filter = store.save_finish(result)
+        except GLib.Error as e:
+            print(f"Failed to compile content blocker rules: {e.message}")
+            return
+        with open(self._hash_path, "w") as f:
+            f.write(list_hash)
+        print(f"Compiled {n_rules} content blocker rules")
+        self._set_filter(content_filter)
+
+    def _set_filter(self, content_filter):
+        if self._filter:
+            self.user_content_manager.remove_filter(self._filter)
+        self._filter = content_filter
+        self.user_content_manager.add_filter(content_filter)
+
+    def _set_cosmetic_filters(self, cosmetic_filters):
+        for style_sheet in self._generic_style_sheets + list(self._host_style_sheets.values()):
+            if style_sheet:
+                self.user_content_manager.remove_style_sheet(style_sheet)
+        self._host_style_sheets.clear()
+        self._cosmetic_filters = cosmetic_filters
+
+        # One sheet per set of domains excepting generic rules, with those
+        # domains on its block list
+        self._generic_style_sheets = []
+        for domains, selectors in cosmetic_filters.generic_groups().items():
+            block_list = [f"{scheme}://{prefix}{domain}/*" for domain in sorted(domains)
+                          for scheme in ("http", "https") for prefix in ("", "*.")]
+            style_sheet = WebKit.UserStyleSheet.new(
+                hiding_style_sheet(selectors), WebKit.UserContentInjectedFrames.ALL_FRAMES,
+                WebKit.UserStyleLevel.USER, None, block_list or None)
+            self.user_content_manager.add_style_sheet(style_sheet)
+            self._generic_style_sheets.append(style_sheet)
+        return GLib.SOURCE_REMOVE
+
+    def _set_engine(self, engine):
+        self.engine = engine
+        return GLib.SOURCE_REMOVE
+
+    def _remove_filter(self):
+        # No lists (any more), drop the filter and its compilation
+        self.engine = None
+        if self._filter:
+            self.user_content_manager.remove_filter(self._filter)
+            self._filter = None
+        if os.path.exists(self._hash_path):
+            os.remove(self._hash_path)
+            self._store.remove(FILTER_IDENTIFIER, None, None, None)
+        return GLib.SOURCE_REMOVE
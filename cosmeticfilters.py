@@ -0,0 +1,105 @@
+## Weaver [Version 1.0]
+## (c) Twilight Incorporated. All rights reserved.
+
+from filterengine import host_suffixes
+
+# Extended (procedural) selectors of uBlock Origin and Adblock Plus, which
+# are not CSS and would make WebKit drop the whole rule
+PROCEDURAL_SELECTORS = (":-abp-", ":has-text(", ":xpath(", ":upward(", ":remove(", ":style(", ":matches-css",
+                        ":matches-attr(", ":matches-path(", ":min-text-length(", ":watch-attr(", ":others(",
+                        ":if(", ":if-not(", ":nth-ancestor(", ":contains(", ":remove-attr(", ":remove-class(")
+
+# Helper function to parse an element hiding rule ("example.com,~a.example.com##.ad",
+# "##.ad", "example.com#@#.ad") into (domains, excluded domains, selector,
+# is exception), or None for other lines and selectors CSS can not express
+def parse_cosmetic_filter(line):
+    line = line.strip()
+    if line.startswith("!"):
+        return None
+    exception = "#@#" in line
+    domains, separator, selector = line.partition("#@#" if exception else "##")
+    if not separator or not selector or selector.startswith(("+js(", "^")):
+        return None
+    if "{" in selector or "}" in selector or any(procedural in selector for procedural in PROCEDURAL_SELECTORS):
+        return None
+
+    included, excluded = [], []
+    for domain in domains.lower().split(","):
+        domain = domain.strip()
+        # "example.*" entities need a public suffix list, leave them out
+        if not domain or domain.endswith(".*"):
+            if domain:
+                return None
+            continue
+        if domain.startswith("~"):
+            excluded.append(domain[1:])
+        else:
+            included.append(domain)
+    return included, excluded, selector, exception
+
+class CosmeticFilterIndex:
+    """
+    Element hiding rules of the filter lists, indexed by domain:
+      - rules for specific domains are found by looking up each suffix of a
+        host name, so a lookup costs the same however long the lists are
+      - generic rules apply everywhere but the domains excepting them, and are
+        grouped by those domains for as few style sheets as possible
+    """
+    def __init__(self):
+        # domain -> selectors hidden on it (and its subdomains)
+        self._selectors = {}
+        # domain -> selectors not hidden on it, despite other rules
+        self._exceptions = {}
+        # Generic selectors, and the domains excepting each of them ("" for all)
+        self._generic = set()
+        self._generic_exceptions = {}
+
+    def add_list(self, text):
+        for line in text.splitlines():
+            if "#" in line:
+                self.add(line)
+
+    def add(self, line):
+        parsed = parse_cosmetic_filter(line)
+        if parsed is None:
+            return
+        included, excluded, selector, exception = parsed
+        if exception:
+            for domain in included or [""]:
+                self._generic_exceptions.setdefault(selector, set()).add(domain)
+                if domain:
+                    self._exceptions.setdefault(domain, set()).add(selector)
+            return
+        if included:
+            for domain in included:
+                self._selectors.setdefault(domain, set()).add(selector)
+            for domain in excluded:
+                self._exceptions.setdefault(domain, set()).add(selector)
+        else:
+            self._generic.add(selector)
+            for domain in excluded:
+                self._generic_exceptions.setdefault(selector, set()).add(domain)
+
+    def host_selectors(self, host):
+        # Domain specific selectors to hide on host, sorted so equal sets
+        # give equal style sheets
+        selectors, excepted = set(), set()
+        for suffix in host_suffixes(host.lower()):
+            selectors.update(self._selectors.get(suffix, ()))
+            excepted.update(self._exceptions.get(suffix, ()))
+        return sorted(selectors - excepted)
+
+    def generic_groups(self):
+        # Returns {frozenset of excepting domains: sorted selectors}
+        groups = {}
+        for selector in self._generic:
+            domains = self._generic_exceptions.get(selector, set())
+            if "" in domains:
+                continue
+            groups.setdefault(frozenset(domains), []).append(selector)
+        return {domains: sorted(selectors) for domains, selectors in groups.items()}
+
+# Helper function to turn selectors into a style sheet hiding them. Every
+# selector gets its own rule, an invalid one would otherwise void the others
+def hiding_style_sheet(selectors):
+    return "\n".join(f"{selector} {{ display: none !important; }}" for selector in selectors)
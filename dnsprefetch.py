@@ -0,0 +1,119 @@
+## Weaver [Version 1.0]
+## (c) Twilight Incorporated. All rights reserved.
+
+import json
+import os
+import time
+from urllib.parse import urlsplit
+
+# Tuning statistics, accumulated over runs in the profile
+STATS_FILE = "dns-prefetch-stats.json"
+# A prefetched host counts as a hit if navigated to within this many seconds,
+# which is also about how long resolvers keep answers cached
+PREFETCH_TTL = 60
+# Hosts prefetched at most at startup, from the best frecency origins
+STARTUP_PREFETCH_HOSTS = 8
+# Hosts prefetched at most when a menu listing URLs opens
+MENU_PREFETCH_HOSTS = 15
+# What a DNS lookup typically costs, so a prefetch made earlier than this
+# saves the whole lookup and one made later saves the time it had
+TYPICAL_LOOKUP_SECONDS = 0.1
+
+# Helper function to get the host of a web URL, or None
+def url_host(url):
+    if not url or not url.startswith(("http://", "https://")):
+        return None
+    return urlsplit(url).hostname
+
+class DnsPredictor:
+    """
+    Resolves hosts the user is likely to open next, through the network
+    session's DNS prefetch:
+      - sources are the first URL entry suggestion, the autocomplete row
+        hovered or selected, the URLs of a menu being opened and the best
+        frecency origins at startup
+      - a host is prefetched once per PREFETCH_TTL, whatever asks for it
+      - navigations are matched against recent prefetches, hits, misses and
+        unused prefetches per source and the estimated time saved are saved
+        to the profile by save_stats()
+    WebKit has no preconnect API, so connections are not warmed beyond DNS.
+    """
+    def __init__(self, network_session, profile_directory):
+        self._network_session = network_session
+        self._stats_path = os.path.join(profile_directory, STATS_FILE)
+        # host -> (time.monotonic() of the prefetch, source), oldest first
+        self._prefetched = {}
+        self.stats = {"navigations": 0, "misses": 0, "sources": {}}
+
+    def prefetch_url(self, url, source):
+        host = url_host(url)
+        if not host:
+            return
+        now = time.monotonic()
+        self._expire(now)
+        if host in self._prefetched:
+            return
+        self._network_session.prefetch_dns(host)
+        self._prefetched[host] = (now, source)
+        self._source_stats(source)["prefetches"] += 1
+
+    def prefetch_urls(self, urls, source, limit):
+        hosts = set()
+        for url in urls:
+            host = url_host(url)
+            if host and host not in hosts:
+                hosts.add(host)
+                self.prefetch_url(url, source)
+                if len(hosts) == limit:
+                    break
+
+    def on_navigation(self, url):
+        # Call as a main frame load starts
+        host = url_host(url)
+        if not host:
+            return
+        now = time.monotonic()
+        self._expire(now)
+        self.stats["navigations"] += 1
+        prefetched = self._prefetched.pop(host, None)
+        if prefetched is None:
+            self.stats["misses"] += 1
+            return
+        prefetch_time, source = prefetched
+        source_stats = self._source_stats(source)
+        source_stats["hits"] += 1
+        source_stats["lead_seconds"] += now - prefetch_time
+        source_stats["saved_seconds"] += min(now - prefetch_time, TYPICAL_LOOKUP_SECONDS)
+
+    def save_stats(self):
+        # Adds this run's statistics to the ones saved in the profile
+        self._expire(time.monotonic() + PREFETCH_TTL)
+        try:
+            with open(self._stats_path) as file:
+                saved = json.load(file)
+        except (OSError, ValueError):
+            saved = {"navigations": 0, "misses": 0, "sources": {}}
+        saved["navigations"] += self.stats["navigations"]
+        saved["misses"] += self.stats["misses"]
+        for source, counts in self.stats["sources"].items():
+            saved_counts = saved["sources"].setdefault(source, dict.fromkeys(counts, 0))
+            for key, value in counts.items():
+                saved_counts[key] = saved_counts.get(key, 0) + value
+        try:
+            with open(self._stats_path, "w") as file:
+                json.dump(saved, file, indent=2)
+            self.stats = {"navigations": 0, "misses": 0, "sources": {}}
+        except OSError as e:
+            print(f"Failed to save the DNS prefetch statistics: {e}")
+
+    def _source_stats(self, source):
+        return self.stats["sources"].setdefault(
+            source, {"prefetches": 0, "hits": 0, "unused": 0, "lead_seconds": 0.0, "saved_seconds": 0.0})
+
+    def _expire(self, now):
+        # Prefetches older than PREFETCH_TTL were not used in time
+        for host, (prefetch_time, source) in list(self._prefetched.items()):
+            if now - prefetch_time < PREFETCH_TTL:
+                break
+            del self._prefetched[host]
+            self._source_stats(source)["unused"] += 1
@@ -0,0 +1,127 @@
+## Weaver [Version 1.0]
+## (c) Twilight Incorporated. All rights reserved.
+
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+from gi.repository import Gdk, GdkPixbuf, GLib
+from storage import FaviconCache
+
+# Size (in pixels) icons are decoded at, 16px at 2x scale
+FAVICON_SIZE = 32
+
+# Helper function to extract the base URL (protocol + domain) from a full URL
+def get_base_url(url):
+    parsed_url = urlparse(url)
+    return f"{parsed_url.scheme}://{parsed_url.netloc}"
+
+# Helper function to tell whether two textures hold the same image, much
+# cheaper than encoding either of them
+def same_image(texture, other):
+    if texture.get_width() != other.get_width() or texture.get_height() != other.get_height():
+        return False
+    pixels, _ = Gdk.TextureDownloader.new(texture).download_bytes()
+    other_pixels, _ = Gdk.TextureDownloader.new(other).download_bytes()
+    return pixels.get_data() == other_pixels.get_data()
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# Helper function to decode favicons.db data (the PNG encoded textures
+# WebKit hands over) into a texture of about size pixels, scaling at most once
+def decode_favicon(data, size=FAVICON_SIZE):
+    raw = memoryview(data)
+    gbytes = GLib.Bytes.new(data)
+
+    if raw[:8] == PNG_SIGNATURE and struct.unpack_from(">II", raw, 16) == (size, size):
+        # Already the right size, GTK decodes it without a Pixbuf
+        return Gdk.Texture.new_from_bytes(gbytes)
+
+    loader = GdkPixbuf.PixbufLoader()
+    # Scale while decoding, keeping the aspect ratio
+    loader.connect("size-prepared", lambda loader, width, height: loader.set_size(
+        max(1, width * size // max(width, height)), max(1, height * size // max(width, height))))
+    loader.write_bytes(gbytes)
+    loader.close()
+    pixbuf = loader.get_pixbuf()
+
+    memory_format = Gdk.MemoryFormat.R8G8B8A8 if pixbuf.get_has_alpha() else Gdk.MemoryFormat.R8G8B8
+    # The texture wraps the Pixbuf's pixels without copying them
+    return Gdk.MemoryTexture.new(pixbuf.get_width(), pixbuf.get_height(), memory_format,
+                                 pixbuf.read_pixel_bytes(), pixbuf.get_rowstride())
+
+class FaviconService:
+    """
+    Favicons come from WebKit, which discovers them during the real page load:
+      - a WebView's notify::favicon sets its tab's icon and updates the FaviconCache
+      - get_favicon() answers from memory, then favicons.db, then WebKit's favicon
+        database, and never touches the network
+    """
+    def __init__(self, network_session, profile_directory):
+        self.cache = FaviconCache(profile_directory)
+        # Favicons are only stored (and notified) once enabled on the data manager
+        data_manager = network_session.get_website_data_manager()
+        data_manager.set_favicons_enabled(True)
+        self._database = data_manager.get_favicon_database()
+        # A single thread keeps favicons.db off the main thread
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="weaver-favicon")
+
+    def on_favicon_changed(self, tab_page, webview):
+        texture = webview.get_favicon()
+        url = webview.get_uri()
+        if texture is None or not url or not url.startswith(("http://", "https://")):
+            return
+        tab_page.set_icon(texture)
+
+        origin = get_base_url(url)
+        # Every page of a site notifies its icon, only store it when it changed
+        cached = self.cache.get_memory(origin)
+        if cached is texture:
+            return
+        self.cache.put_memory(origin, texture)
+        if cached is not None and same_image(cached, texture):
+            return
+        data = texture.save_to_png_bytes().get_data()
+        self._executor.submit(self.cache.put, origin, data)
+
+    def get_favicon(self, url, callback):
+        # Calls callback(texture or None) on the main thread
+        origin = get_base_url(url)
+        cached = self.cache.get_memory(origin)
+        if cached:
+            callback(cached)
+            return
+        self._executor.submit(self._read_cached, url, origin, callback)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        self.cache.close()
+
+    # Worker thread
+
+    def _read_cached(self, url, origin, callback):
+        data = self.cache.get(origin)
+        texture = None
+        if data:
+            try:
+                texture = decode_favicon(data)
+            except (GLib.Error, ValueError, struct.error):
+                pass
+        GLib.idle_add(self._deliver_cached, url, origin, texture, callback)
+
+    # Main thread
+
+    def _deliver_cached(self, url, origin, texture, callback):
+        if texture:
+            self.cache.put_memory(origin, texture)
+            callback(texture)
+        else:
+            # Not cached by us, WebKit may still know the page
+            self._database.get_favicon(url, None, self._on_database_favicon, callback)
+        return GLib.SOURCE_REMOVE
+
+    def _on_database_favicon(self, database, result, callback):
+        try:
+            texture = database.get_favicon_finish(result)
+        except GLib.Error:
+            texture = None
+        callback(texture)
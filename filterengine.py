@@ -0,0 +1,386 @@
+## Weaver [Version 1.0]
+## (c) Twilight Incorporated. All rights reserved.
+
+import marshal
+import os
+import re
+
+# Written at the start of cache files, bumped whenever their layout or the
+# parser changes so old caches are rebuilt
+CACHE_MAGIC = b"WVFE"
+CACHE_VERSION = 2
+
+# Filter flags
+EXCEPTION = 1 << 0
+IMPORTANT = 1 << 1
+MATCH_CASE = 1 << 2
+FIRST_PARTY = 1 << 3
+THIRD_PARTY = 1 << 4
+
+# Request types of the filter options, one bit each
+RESOURCE_TYPES = ["other", "script", "image", "stylesheet", "object", "xmlhttprequest", "subdocument",
+                  "ping", "websocket", "media", "font", "popup", "document"]
+RESOURCE_TYPE_BITS = {name: 1 << index for index, name in enumerate(RESOURCE_TYPES)}
+RESOURCE_TYPE_BITS["xhr"] = RESOURCE_TYPE_BITS["xmlhttprequest"]
+RESOURCE_TYPE_BITS["frame"] = RESOURCE_TYPE_BITS["subdocument"]
+RESOURCE_TYPE_BITS["css"] = RESOURCE_TYPE_BITS["stylesheet"]
+# Filters without type options apply to everything but pages and popups
+DEFAULT_TYPES = (1 << len(RESOURCE_TYPES)) - 1 & ~RESOURCE_TYPE_BITS["popup"] & ~RESOURCE_TYPE_BITS["document"]
+
+# Options that make a filter do something other than block, those filters
+# are left out rather than blocking too much
+UNSUPPORTED_OPTIONS = {"csp", "redirect", "redirect-rule", "removeparam", "rewrite", "replace", "badfilter",
+                       "generichide", "elemhide", "specifichide", "genericblock", "header", "permissions",
+                       "urltransform", "empty", "mp4", "inline-script", "inline-font", "webrtc", "cookie"}
+
+# Tokens so common in URLs that indexing a filter under them does not narrow
+# anything down, any other token of the filter is preferred
+BAD_TOKENS = {"http", "https", "www", "com", "net", "org", "js", "html", "php", "jpg", "png", "gif", "css"}
+
+# Index key of filters without a usable token, checked for every request
+NO_TOKEN = ""
+
+_TOKEN = re.compile(r"[a-z0-9%]{2,}")
+# Host of a lower case URL, much cheaper than urlsplit() per request
+_HOST = re.compile(r"^[a-z][a-z0-9+.-]*://(?:[^@/?#]*@)?(\[[^\]]*\]|[^:/?#]*)")
+# Characters allowed around a token in a filter for it to be a whole URL token
+_TOKEN_CHARS = set("abcdefghijklmnopqrstuvwxyz0123456789%")
+
+# Helper function to get the registrable part of a host name, which decides
+# what counts as third-party. Without a public suffix list, two-letter country
+# domains with a generic second level (co.uk, com.au) are special-cased
+def base_domain(host):
+    labels = host.split(".")
+    if len(labels) > 2 and len(labels[-1]) == 2 and labels[-2] in ("co", "com", "net", "org", "gov", "ac", "edu", "ne", "or"):
+        return ".".join(labels[-3:])
+    return ".".join(labels[-2:])
+
+# Helper function to get the host of a lower case URL
+def url_host(url):
+    match = _HOST.match(url)
+    return match.group(1) if match else ""
+
+# Helper function to list a host name and its parent domains
+# ("a.b.com" -> "a.b.com", "b.com", "com")
+def host_suffixes(host):
+    suffixes = [host]
+    index = host.find(".")
+    while index != -1:
+        suffixes.append(host[index + 1:])
+        index = host.find(".", index + 1)
+    return suffixes
+
+# Helper function to turn a filter pattern into a Python regular expression
+def pattern_to_regex(pattern):
+    if pattern.startswith("/") and pattern.endswith("/") and len(pattern) > 2:
+        return pattern[1:-1]
+    prefix = suffix = ""
+    if pattern.startswith("||"):
+        prefix = r"^[a-z][a-z0-9+.-]*://(?:[^/?#]*\.)?"
+        pattern = pattern[2:]
+    elif pattern.startswith("|"):
+        prefix = "^"
+        pattern = pattern[1:]
+    if pattern.endswith("|"):
+        suffix = "$"
+        pattern = pattern[:-1]
+    body = []
+    for char in pattern:
+        if char == "*":
+            body.append(".*")
+        elif char == "^":
+            body.append(r"(?:[^\w.%-]|$)")
+        else:
+            body.append(re.escape(char))
+    return prefix + "".join(body) + suffix
+
+# Helper function to list the tokens of a filter pattern a URL token can be
+# looked up with: whole words that no wildcard or unanchored end can extend
+def pattern_tokens(pattern):
+    if pattern.startswith("/") and pattern.endswith("/") and len(pattern) > 2:
+        return []
+    left_anchored = pattern.startswith("|")
+    pattern = pattern.lstrip("|")
+    right_anchored = pattern.endswith("|")
+    pattern = pattern.rstrip("|").lower()
+    tokens = []
+    for match in _TOKEN.finditer(pattern):
+        start, end = match.span()
+        before = pattern[start - 1] if start > 0 else ("|" if left_anchored else "*")
+        after = pattern[end] if end < len(pattern) else ("|" if right_anchored else "*")
+        if before != "*" and after != "*" and before not in _TOKEN_CHARS and after not in _TOKEN_CHARS:
+            tokens.append(match.group())
+    return tokens
+
+class NetworkFilter:
+    """One parsed network filter, see parse_filter."""
+    __slots__ = ("text", "pattern", "flags", "types", "include_domains", "exclude_domains")
+
+    def __init__(self, text, pattern, flags, types, include_domains, exclude_domains):
+        self.text = text
+        self.pattern = pattern
+        self.flags = flags
+        self.types = types
+        self.include_domains = include_domains
+        self.exclude_domains = exclude_domains
+
+# Helper function to parse one line of a filter list into a NetworkFilter,
+# or None for comments, element hiding rules and unsupported filters
+def parse_filter(line):
+    line = line.strip()
+    if not line or line.startswith(("!", "[")):
+        return None
+    if "##" in line or "#@#" in line or "#?#" in line or "#$#" in line or "#%#" in line:
+        return None
+
+    text = line
+    flags = 0
+    if line.startswith("@@"):
+        flags |= EXCEPTION
+        line = line[2:]
+
+    pattern, options = line, []
+    # "$" also appears in regular expression filters, only take it as the
+    # option separator after the closing "/"
+    dollar = line.rfind("$")
+    if dollar != -1 and not (line.startswith("/") and line.endswith("/")):
+        pattern = line[:dollar]
+        options = [option.strip() for option in line[dollar + 1:].split(",") if option.strip()]
+
+    types = 0
+    excluded_types = 0
+    include_domains, exclude_domains = [], []
+    for option in options:
+        name, _, value = option.partition("=")
+        name = name.lower()
+        negated = name.startswith("~")
+        name = name.lstrip("~")
+        if name in UNSUPPORTED_OPTIONS:
+            return None
+        if name in ("third-party", "3p"):
+            flags |= FIRST_PARTY if negated else THIRD_PARTY
+        elif name in ("first-party", "1p"):
+            flags |= THIRD_PARTY if negated else FIRST_PARTY
+        elif name == "domain":
+            for domain in value.lower().split("|"):
+                if domain.startswith("~"):
+                    exclude_domains.append(domain[1:])
+                elif domain:
+                    include_domains.append(domain)
+        elif name == "match-case":
+            flags |= MATCH_CASE
+        elif name == "important":
+            flags |= IMPORTANT
+        elif name == "all":
+            types |= (1 << len(RESOURCE_TYPES)) - 1
+        elif name in RESOURCE_TYPE_BITS:
+            if negated:
+                excluded_types |= RESOURCE_TYPE_BITS[name]
+            else:
+                types |= RESOURCE_TYPE_BITS[name]
+        else:
+            return None
+    if excluded_types:
+        types = (types or DEFAULT_TYPES) & ~excluded_types
+        if not types:
+            return None
+    if pattern in ("", "*") and not include_domains and not types:
+        # Would match every request
+        return None
+    if not flags & MATCH_CASE and not (pattern.startswith("/") and pattern.endswith("/")):
+        pattern = pattern.lower()
+    return NetworkFilter(text, pattern, flags, types or DEFAULT_TYPES, include_domains, exclude_domains)
+
+class FilterEngine:
+    """
+    Answers "is this request blocked on this page" for large filter lists:
+      - every filter is indexed under its least common whole-word token, so a
+        URL is only checked against the filters sharing one of its tokens
+      - $important filters have a small index of their own, checked first
+        since they win over exceptions
+      - flags, request types and domains are small integers (bit sets and
+        interned domain ids), checked before any regular expression runs
+      - regular expressions are compiled on first use, and the whole index
+        is saved to and loaded from a marshal cache without parsing anything
+    """
+    def __init__(self, patterns, flags, types, include_domains, exclude_domains, domains,
+                 important_index, block_index, exception_index):
+        # Parallel per-filter lists, indexed by filter number
+        self._patterns = patterns
+        self._flags = flags
+        self._types = types
+        self._include_domains = include_domains
+        self._exclude_domains = exclude_domains
+        # Interned domains of the domain= options
+        self._domains = domains
+        self._domain_ids = {domain: index for index, domain in enumerate(domains)}
+        # token -> filter numbers, separately for important blocking, other
+        # blocking and exception filters
+        self._important_index = important_index
+        self._block_index = block_index
+        self._exception_index = exception_index
+        self._regexes = [None] * len(patterns)
+        # Combined regular expression of each index's filters without a token
+        self._prefilters = {}
+
+    def __len__(self):
+        return len(self._patterns)
+
+    @classmethod
+    def from_lists(cls, texts):
+        parsed = [f for text in texts for f in map(parse_filter, text.splitlines()) if f is not None]
+
+        # Count how many filters each token could index, then put every
+        # filter under its rarest token
+        counts = {}
+        candidates = []
+        for network_filter in parsed:
+            tokens = pattern_tokens(network_filter.pattern.lower())
+            candidates.append(tokens)
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+
+        domains, domain_ids = [], {}
+        def intern(names):
+            ids = []
+            for name in names:
+                if name not in domain_ids:
+                    domain_ids[name] = len(domains)
+                    domains.append(name)
+                ids.append(domain_ids[name])
+            return tuple(ids)
+
+        patterns, flags, types, include_domains, exclude_domains = [], [], [], [], []
+        important_index, block_index, exception_index = {}, {}, {}
+        for network_filter, tokens in zip(parsed, candidates):
+            number = len(patterns)
+            patterns.append(network_filter.pattern)
+            flags.append(network_filter.flags)
+            types.append(network_filter.types)
+            include_domains.append(intern(network_filter.include_domains))
+            exclude_domains.append(intern(network_filter.exclude_domains))
+            token = min(tokens, key=lambda token: (token in BAD_TOKENS, counts[token]), default=NO_TOKEN)
+            if network_filter.flags & EXCEPTION:
+                index = exception_index
+            elif network_filter.flags & IMPORTANT:
+                index = important_index
+            else:
+                index = block_index
+            index.setdefault(token, []).append(number)
+        return cls(patterns, flags, types, include_domains, exclude_domains, domains,
+                   important_index, block_index, exception_index)
+
+    @classmethod
+    def load(cls, path, source_hash):
+        # Returns the engine cached at path for lists with this hash, or None
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            if not data.startswith(CACHE_MAGIC):
+                return None
+            # Much faster than marshal.load() on the file
+            version, cached_hash, state = marshal.loads(memoryview(data)[len(CACHE_MAGIC):])
+        except (OSError, EOFError, ValueError, TypeError):
+            return None
+        if version != CACHE_VERSION or cached_hash != source_hash:
+            return None
+        return cls(*state)
+
+    def save(self, path, source_hash):
+        state = (self._patterns, self._flags, self._types, self._include_domains, self._exclude_domains,
+                 self._domains, self._important_index, self._block_index, self._exception_index)
+        # Written next to the old cache and renamed over it, so a crash never
+        # leaves half a cache behind
+        temporary_path = path + ".tmp"
+        with open(temporary_path, "wb") as f:
+            f.write(CACHE_MAGIC)
+            marshal.dump((CACHE_VERSION, source_hash, state), f)
+        os.replace(temporary_path, path)
+
+    def match(self, url, source_url=None, resource_type="other"):
+        # Returns (blocked, number of the deciding filter), the number being
+        # None when no filter applies
+        url_lower = url.lower()
+        request_host = url_host(url_lower)
+        source_host = url_host(source_url.lower()) if source_url else ""
+        context = (
+            RESOURCE_TYPE_BITS.get(resource_type, RESOURCE_TYPE_BITS["other"]),
+            # Without a page, requests count as first-party
+            THIRD_PARTY if source_host and base_domain(source_host) != base_domain(request_host) else FIRST_PARTY,
+            [self._domain_ids[suffix] for suffix in host_suffixes(source_host or request_host) if suffix in self._domain_ids],
+        )
+        # In URL order, so the deciding filter is the same on every run
+        tokens = list(dict.fromkeys(_TOKEN.findall(url_lower)))
+        tokens.append(NO_TOKEN)
+
+        # Exceptions do not apply to $important filters
+        important = self._find(self._important_index, tokens, url, url_lower, context)
+        if important is not None:
+            return True, important
+        blocking = self._find(self._block_index, tokens, url, url_lower, context)
+        if blocking is None:
+            return False, None
+        exception = self._find(self._exception_index, tokens, url, url_lower, context)
+        if exception is not None:
+            return False, exception
+        return True, blocking
+
+    def should_block(self, url, source_url=None, resource_type="other"):
+        return self.match(url, source_url, resource_type)[0]
+
+    def filter_pattern(self, number):
+        return self._patterns[number]
+
+    def _find(self, index, tokens, url, url_lower, context):
+        # The first matching filter of index, or None
+        resource_type, party, domain_ids = context
+        for token in tokens:
+            numbers = index.get(token)
+            if not numbers:
+                continue
+            if token == NO_TOKEN and not self._prefilter(index, url):
+                continue
+            for number in numbers:
+                if not self._types[number] & resource_type:
+                    continue
+                flags = self._flags[number]
+                if flags & (FIRST_PARTY | THIRD_PARTY) and not flags & party:
+                    continue
+                include = self._include_domains[number]
+                if include and not any(domain_id in include for domain_id in domain_ids):
+                    continue
+                exclude = self._exclude_domains[number]
+                if exclude and any(domain_id in exclude for domain_id in domain_ids):
+                    continue
+                if self._regex(number).search(url if flags & MATCH_CASE else url_lower):
+                    return number
+        return None
+
+    def _prefilter(self, index, url):
+        # Filters without a token would be checked one by one for every
+        # request, a single search of all of them at once rules most out
+        prefilter = self._prefilters.get(id(index), False)
+        if prefilter is False:
+            sources = [f"(?:{pattern_to_regex(self._patterns[number])})" for number in index[NO_TOKEN]]
+            try:
+                prefilter = re.compile("|".join(sources), re.IGNORECASE)
+            except re.error:
+                # Some pattern does not combine (back references, inline
+                # flags), check them one by one
+                prefilter = None
+            self._prefilters[id(index)] = prefilter
+        return prefilter is None or prefilter.search(url) is not None
+
+    def _regex(self, number):
+        regex = self._regexes[number]
+        if regex is None:
+            pattern = self._patterns[number]
+            # Other patterns are already lower case, like the URL they are matched against
+            is_regex = pattern.startswith("/") and pattern.endswith("/") and not self._flags[number] & MATCH_CASE
+            try:
+                regex = re.compile(pattern_to_regex(pattern), re.IGNORECASE if is_regex else 0)
+            except re.error:
+                # Never matches
+                regex = re.compile(r"(?!)")
+            self._regexes[number] = regex
+        return regex
@@ -0,0 +1,169 @@
+## Weaver [Version 1.0]
+## (c) Twilight Incorporated. All rights reserved.
+
+from collections import OrderedDict
+from datetime import datetime
+from gi.repository import Gtk, Gio, GObject, Pango
+
+# Rows fetched from the database at a time
+HISTORY_PAGE_SIZE = 200
+# Pages kept in memory, older ones are fetched again when scrolled back to
+HISTORY_CACHED_PAGES = 50
+
+class HistoryEntry(GObject.Object):
+    """A single row of the history list, filled in once its page arrives."""
+    url = GObject.Property(type=str, default="")
+    title = GObject.Property(type=str, default="")
+    last_visit = GObject.Property(type=GObject.TYPE_INT64, default=0)
+
+    def __init__(self):
+        super().__init__()
+        self.id = None
+        self.loaded = False
+
+    def fill(self, row):
+        self.id, url, title, last_visit = row
+        self.loaded = True
+        self.props.url = url
+        self.props.title = title or url
+        self.props.last_visit = last_visit
+
+class HistoryListModel(GObject.Object, Gio.ListModel):
+    """
+    A Gio.ListModel over the whole history that only loads the pages the
+    list view actually asks for. Items are handed out as placeholders and
+    filled in when the storage worker returns their page.
+    """
+    def __init__(self, storage):
+        super().__init__()
+        self._storage = storage
+        self._n_items = 0
+        self._pages = OrderedDict()
+        # Bumped on reload so pages requested before it are dropped
+        self._generation = 0
+
+    def reload(self):
+        self._generation += 1
+        generation = self._generation
+        self._storage.count_history(lambda n_items: self._on_count_loaded(generation, n_items))
+
+    def _on_count_loaded(self, generation, n_items):
+        if generation != self._generation:
+            return
+        removed = self._n_items
+        self._n_items = n_items or 0
+        self._pages.clear()
+        self.items_changed(0, removed, self._n_items)
+
+    def do_get_item_type(self):
+        return HistoryEntry
+
+    def do_get_n_items(self):
+        return self._n_items
+
+    def do_get_item(self, position):
+        if position >= self._n_items:
+            return None
+        page, index = divmod(position, HISTORY_PAGE_SIZE)
+        if page in self._pages:
+            self._pages.move_to_end(page)
+        else:
+            self._load_page(page)
+        entries = self._pages[page]
+        return entries[index] if index < len(entries) else None
+
+    def _load_page(self, page):
+        start = page * HISTORY_PAGE_SIZE
+        entries = [HistoryEntry() for _ in range(min(HISTORY_PAGE_SIZE, self._n_items - start))]
+        self._pages[page] = entries
+        while len(self._pages) > HISTORY_CACHED_PAGES:
+            self._pages.popitem(last=False)
+
+        # Continue from the previous page's last row when it is known,
+        # which is the common case while scrolling
+        after = None
+        previous = self._pages.get(page - 1)
+        if previous and previous[-1].loaded:
+            after = (previous[-1].props.last_visit, previous[-1].id)
+
+        generation = self._generation
+        self._storage.get_history_page(after, start, len(entries),
+                                       lambda rows: self._on_page_loaded(generation, entries, rows))
+
+    def _on_page_loaded(self, generation, entries, rows):
+        if generation != self._generation:
+            return
+        for entry, row in zip(entries, rows or ()):
+            entry.fill(row)
+
+class HistorySidebar(Gtk.Box):
+    """
+    Sidebar listing the whole history, backed by a HistoryListModel:
+      - only visible rows get widgets (Gtk.ListView)
+      - clicking a row calls on_activate(url)
+    """
+    def __init__(self, storage, on_activate, on_close):
+        super().__init__(orientation=Gtk.Orientation.VERTICAL)
+        self.set_size_request(320, -1)
+        self._on_activate = on_activate
+
+        hb = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=6, margin_top=6, margin_bottom=6, margin_start=12, margin_end=6)
+        title = Gtk.Label(label="History", halign=Gtk.Align.START, hexpand=True)
+        title.get_style_context().add_class("heading")
+        hb.append(title)
+        close_button = Gtk.Button()
+        close_button.set_icon_name("window-close-symbolic")
+        close_button.get_style_context().add_class("flat")
+        close_button.connect("clicked", lambda button: on_close())
+        hb.append(close_button)
+        self.append(hb)
+
+        self.model = HistoryListModel(storage)
+        factory = Gtk.SignalListItemFactory()
+        factory.connect("setup", self.on_setup_item)
+        factory.connect("bind", self.on_bind_item)
+        factory.connect("unbind", self.on_unbind_item)
+
+        self.list_view = Gtk.ListView(model=Gtk.NoSelection(model=self.model), factory=factory)
+        self.list_view.set_single_click_activate(True)
+        self.list_view.connect("activate", self.on_row_activated)
+
+        scrolled_window = Gtk.ScrolledWindow(vexpand=True)
+        scrolled_window.set_policy(Gtk.PolicyType.NEVER, Gtk.PolicyType.AUTOMATIC)
+        scrolled_window.set_child(self.list_view)
+        self.append(scrolled_window)
+
+    def reload(self):
+        self.model.reload()
+
+    def on_setup_item(self, factory, list_item):
+        box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, margin_top=6, margin_bottom=6, margin_start=12, margin_end=12)
+        title = Gtk.Label(halign=Gtk.Align.START, ellipsize=Pango.EllipsizeMode.END)
+        url = Gtk.Label(halign=Gtk.Align.START, ellipsize=Pango.EllipsizeMode.END)
+        url.get_style_context().add_class("dim-label")
+        url.get_style_context().add_class("caption")
+        box.append(title)
+        box.append(url)
+        list_item.set_child(box)
+
+    def on_bind_item(self, factory, list_item):
+        entry = list_item.get_item()
+        title = list_item.get_child().get_first_child()
+        url = title.get_next_sibling()
+        # Bindings keep placeholder rows up to date once their page arrives
+        list_item.bindings = [
+            entry.bind_property("title", title, "label", GObject.BindingFlags.SYNC_CREATE),
+            entry.bind_property("url", url, "label", GObject.BindingFlags.SYNC_CREATE),
+            entry.bind_property("last-visit", url, "tooltip-text", GObject.BindingFlags.SYNC_CREATE,
+                                lambda binding, last_visit: datetime.fromtimestamp(last_visit).strftime("%Y-%m-%d %H:%M")),
+        ]
+
+    def on_unbind_item(self, factory, list_item):
+        for binding in getattr(list_item, "bindings", []):
+            binding.unbind()
+        list_item.bindings = []
+
+    def on_row_activated(self, list_view, position):
+        entry = self.model.get_item(position)
+        if entry and entry.loaded:
+            self._on_activate(entry.props.url)
@@ -0,0 +1,174 @@
+## Weaver [Version 1.0]
+## (c) Twilight Incorporated. All rights reserved.
+
+import array
+import bisect
+import hashlib
+import os
+import sys
+from urllib.parse import urlsplit
+from gi.repository import GLib
+
+# Index of the HSTS preload list, built by --build-hsts-index into ~/.weaver
+HSTS_INDEX_PATH = os.path.expanduser("~/.weaver/hsts-preload.bin")
+# File header, the version is bumped when the layout or hash changes
+HSTS_INDEX_MAGIC = b"WHSTS\x01"
+# Seconds an HTTPS-first attempt gets to receive a response before the
+# same URL is tried over HTTP
+HTTPS_FIRST_TIMEOUT = 3
+
+# Helper function to hash a host name into the index. The lowest bit is left
+# for the include_subdomains flag, so 63 bits remain: with the ~150k
+# preloaded hosts a false match is about one in 10^13 lookups
+def host_hash(host):
+    return int.from_bytes(hashlib.blake2b(host.encode(), digest_size=8).digest(), "little") & ~1
+
+# Helper function to build the index from Chromium's
+# transport_security_state_static.json, returns the number of hosts indexed
+def build_preload_index(json_path, index_path=HSTS_INDEX_PATH):
+    import json
+    with open(json_path, encoding="utf-8") as file:
+        # The list is JSON with // comment lines
+        text = "".join(line for line in file if not line.lstrip().startswith("//"))
+    entries = json.loads(text)["entries"]
+    hashes = array.array("Q", sorted(
+        host_hash(entry["name"].lower()) | bool(entry.get("include_subdomains"))
+        for entry in entries if entry.get("mode") == "force-https"))
+    if sys.byteorder != "little":
+        hashes.byteswap()
+    temporary_path = index_path + ".tmp"
+    with open(temporary_path, "wb") as file:
+        file.write(HSTS_INDEX_MAGIC)
+        hashes.tofile(file)
+    os.replace(temporary_path, index_path)
+    return len(hashes)
+
+class HstsPreload:
+    """
+    Hosts that only serve HTTPS, from the HSTS preload list:
+      - a sorted array of 64 bit host hashes, loaded in one read on the
+        first lookup
+      - a host matches if it is listed, or a parent domain is listed with
+        include_subdomains
+    """
+    def __init__(self, path=HSTS_INDEX_PATH):
+        self.path = path
+        self._hashes = None
+
+    def __len__(self):
+        return len(self._load())
+
+    def contains(self, host):
+        hashes = self._load()
+        if not hashes or not host:
+            return False
+        labels = host.lower().rstrip(".").split(".")
+        # Whole top level domains (like .dev) are preloaded too
+        for i in range(len(labels)):
+            hashed = host_hash(".".join(labels[i:]))
+            index = bisect.bisect_left(hashes, hashed)
+            # Entries for the same host differ in the flag bit only
+            for value in hashes[index:index + 2]:
+                if value & ~1 == hashed and (i == 0 or value & 1):
+                    return True
+        return False
+
+    def _load(self):
+        if self._hashes is None:
+            self._hashes = self._read(self.path)
+        return self._hashes
+
+    def _read(self, path):
+        hashes = array.array("Q")
+        try:
+            with open(path, "rb") as file:
+                data = file.read()
+        except FileNotFoundError:
+            return hashes
+        except OSError as e:
+            print(f"Failed to read the HSTS preload index {path}: {e}")
+            return hashes
+        if not data.startswith(HSTS_INDEX_MAGIC) or (len(data) - len(HSTS_INDEX_MAGIC)) % 8:
+            print(f"{path} is not an HSTS preload index, rebuild it with --build-hsts-index")
+            return hashes
+        hashes.frombytes(data[len(HSTS_INDEX_MAGIC):])
+        if sys.byteorder != "little":
+            hashes.byteswap()
+        return hashes
+
+class HttpsFirst:
+    """
+    Loads typed host names over HTTPS first:
+      - hosts on the HSTS preload list never touch HTTP, not even when a
+        link or the user asks for http://
+      - other hosts fall back to HTTP when the HTTPS connection fails or
+        sends no response within HTTPS_FIRST_TIMEOUT. An invalid certificate
+        is shown as an error, falling back would hide an attack
+      - cancel() a tab's attempt when it closes, nothing is left pointing at it
+    """
+    def __init__(self, preload, enabled=True):
+        self.preload = preload
+        self.enabled = enabled
+        # webview -> (HTTPS URL tried, HTTP fallback URL, timeout source id)
+        self._pending = {}
+
+    def load_typed(self, webview, text):
+        # text is a URL without scheme, like "example.com/page"
+        if not self.enabled:
+            webview.load_uri("http://" + text)
+            return
+        url = "https://" + text
+        self.cancel(webview)
+        if not self.preload.contains(urlsplit(url).hostname):
+            timeout = GLib.timeout_add_seconds(HTTPS_FIRST_TIMEOUT, self._on_timeout, webview)
+            self._pending[webview] = (url, "http://" + text, timeout)
+        webview.load_uri(url)
+
+    def upgrade(self, url):
+        # The https:// URL to load instead of url, or None
+        if self.enabled and url and url.startswith("http://") and self.preload.contains(urlsplit(url).hostname):
+            return "https://" + url[len("http://"):]
+        return None
+
+    def on_started(self, webview):
+        # Another load replaced the HTTPS attempt, it must not fall back
+        # over that one
+        if not self._is_pending(webview, webview.get_uri()):
+            self.cancel(webview)
+
+    def on_committed(self, webview):
+        # The HTTPS attempt got a response, it will not fall back any more
+        self.cancel(webview)
+
+    def on_cancelled(self, webview, failing_uri):
+        # The user stopped the HTTPS attempt
+        if self._is_pending(webview, failing_uri):
+            self.cancel(webview)
+
+    def fallback_for(self, webview, failing_uri):
+        # The HTTP URL to load after failing_uri failed, or None
+        if not self._is_pending(webview, failing_uri):
+            return None
+        fallback = self._pending[webview][1]
+        self.cancel(webview)
+        return fallback
+
+    def cancel(self, webview):
+        pending = self._pending.pop(webview, None)
+        if pending:
+            GLib.source_remove(pending[2])
+
+    def cancel_all(self):
+        for webview in list(self._pending):
+            self.cancel(webview)
+
+    def _is_pending(self, webview, url):
+        pending = self._pending.get(webview)
+        return pending is not None and bool(url) and urlsplit(url)[:2] == urlsplit(pending[0])[:2]
+
+    def _on_timeout(self, webview):
+        pending = self._pending.pop(webview, None)
+        if pending:
+            # Replacing the load cancels the HTTPS attempt
+            webview.load_uri(pending[1])
+        return GLib.SOURCE_REMOVE
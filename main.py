@@ -2,28 +2,46 @@
 ## Weaver [Version 1.0]
 ## (c) Twilight Incorporated. All rights reserved.
 
+import time
+# Launch time, before the imports the startup profile measures
+STARTUP_TIME = time.perf_counter()
+
 import gi
 import sys
 import re
-import requests
-import sqlite3
-import random
-import string
 import os
-from io import BytesIO
 from datetime import datetime
 gi.require_version('Gtk', '4.0')
 gi.require_version('WebKit', '6.0')
 gi.require_version('GObject', '2.0')
 gi.require_version('Adw', '1')
-from gi.repository import Gtk, Adw, WebKit, Gio, GLib, Gdk, GdkPixbuf, GObject
-from PIL import Image  # Import the Pillow library for image conversion
-import configparser
-import hashlib
-import adblockeryt as yt
+gi.require_version('Soup', '3.0')
+from gi.repository import Gtk, Adw, WebKit, Gio, GLib, Gdk, GObject, Pango
+from storage import BookmarkService, rebuild_search_index
+from networksession import DEFAULT_DISK_CACHE_SIZE_MB
+from dnsprefetch import STARTUP_PREFETCH_HOSTS, MENU_PREFETCH_HOSTS
+from hsts import HstsPreload, HttpsFirst, build_preload_index, HSTS_INDEX_PATH
+from profiles import Config, Profile, WEAVER_DIRECTORY
+from weaverscheme import WeaverSchemeHandler
+from sessionstore import SessionStore
+from tablifecycle import TabLifecycleManager, DEFAULT_DISCARD_IDLE_MINUTES, DEFAULT_DISCARD_MIN_AVAILABLE_MB
+from startupprofile import StartupProfiler
+# The history sidebar and the autocomplete index are imported on first use
+
+# Phase timings of this launch, printed with --profile-startup
+startup_profiler = StartupProfiler(STARTUP_TIME)
+startup_profiler.mark("imports")
 
 VERSION="1.0"
 APP_NAME="Weaver (Development)"
+# Number of entries in the application menu's history submenu
+RECENT_HISTORY_LIMIT=15
+# Time ranges offered by the "Clear history" menu, in seconds (None = all time)
+CLEAR_HISTORY_RANGES={"hour": 3600, "day": 86400, "all": None}
+# Suggestions shown under the URL entry while typing
+AUTOCOMPLETE_LIMIT=8
+# Results shown on a weaver://history?q= page
+HISTORY_SEARCH_LIMIT=100
 
 os.environ['GTK_INSPECTOR'] = '1'
 
@@ -124,41 +142,37 @@ class PreferencesDialog(Adw.PreferencesDialog):
         # monospace or serif fonts, you'd set those too.
         WebKit.Settings.set_sans_serif_font_family(self._webview_settings, chosen_font)
 
-# Helper function to generate profile name
-def generate_profile_name():
-    return ''.join(random.choices(string.ascii_lowercase + string.digits, k=8))
-
-# Helper function to create or read config.ini for the default profile
-def read_or_create_config():
-    config_path = os.path.expanduser("~/.weaver/config.ini")
-    config = configparser.ConfigParser()
-
-    if os.path.exists(config_path):
-        # If config.ini exists, read it
-        config.read(config_path)
-        profile_name = config.get("Settings", "profile_name", fallback=None)
-    else:
-        # If config.ini doesn't exist, create it and set default profile
-        profile_name = generate_profile_name()
-        config["Settings"] = {"profile_name": profile_name}
-        with open(config_path, "w") as config_file:
-            config.write(config_file)
-
-    return profile_name
-
 class MainWindow(Adw.ApplicationWindow):
-    def __init__(self, version, app_name, *args, **kwargs):
+    def __init__(self, version, app_name, profile, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.hb = Adw.HeaderBar()
         self.settings = Gtk.Settings.get_default()
         self.dark_mode = self.settings.get_property("gtk-application-prefer-dark-theme")
         self.app_name = app_name
-        self.weaver_title = None
-        self.is_weaver_url = False
-        self.weaver_url = None
-        self.adblocker_yt_js = yt.get_javascript()
         self.version = version
 
+        # The profile owns the storage, network session and caches of this window
+        self.profile = profile
+        self.profile_name = profile.name
+        self.profile_directory = profile.directory
+
+        # The databases are opened and migrated on the storage thread
+        self.storage = profile.storage
+        self.storage.get_open_time(lambda seconds: startup_profiler.record("DB open", seconds))
+
+        self.network_session = profile.network_session
+        self.disk_cache = profile.disk_cache
+        self.favicons = profile.favicons
+        self.content_blocker = profile.content_blocker
+        # Resolves the hosts of likely next navigations ahead of time
+        self.dns_predictor = profile.dns_predictor
+        # Times page loads and our own handlers of them, for weaver://performance
+        self.navigation_metrics = profile.navigation_metrics
+        # Typed host names are tried over HTTPS first, preloaded HSTS hosts only
+        self.https_first = HttpsFirst(self.get_application().hsts_preload, profile.get_int("https_first", 1) != 0)
+        # The Config outlives the window, which disconnects on destroy
+        self.config_changed_handler = profile.config.connect_changed(self.on_config_changed)
+
         # Create a Box for layout
         self.a = Gtk.Box(orientation=Gtk.Orientation.VERTICAL)
 
@@ -168,10 +182,29 @@ class MainWindow(Adw.ApplicationWindow):
         self.tab_bar = Adw.TabBar()
         self.tab_bar.set_view(self.tab_view)
         self.a.append(self.tab_bar)  # Add TabBar to the layout
-        self.a.append(self.tab_view)  # Add TabView to the layout
 
-        # Create the first WebView in a tab
-        self.create_new_tab()
+        # TabView next to the (hidden by default) history sidebar
+        self.content_box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL)
+        self.tab_view.set_hexpand(True)
+        self.content_box.append(self.tab_view)  # Add TabView to the layout
+        # The sidebar itself is built when first shown
+        self.history_sidebar = None
+        self.history_revealer = Gtk.Revealer(transition_type=Gtk.RevealerTransitionType.SLIDE_LEFT)
+        self.content_box.append(self.history_revealer)
+        self.a.append(self.content_box)
+
+        # Background tabs give up their WebView when idle or memory runs low
+        self.tab_lifecycle = TabLifecycleManager(
+            self.tab_view, self.create_webview,
+            profile.get_int("tab_discard_idle_minutes", DEFAULT_DISCARD_IDLE_MINUTES),
+            profile.get_int("tab_discard_min_available_mb", DEFAULT_DISCARD_MIN_AVAILABLE_MB))
+
+        # Reopen the tabs of the last session, or create the first WebView in a tab
+        self.session = SessionStore(self.profile_directory, self.tab_view, self.tab_lifecycle, self.favicons)
+        startup_profiler.mark("window build")
+        if not self.session.restore():
+            self.create_new_tab()
+        startup_profiler.mark("first tab")
 
         # Create HeaderBar buttons (Back, Forward, Reload, New Tab) and set URL Entry
         self.create_headerbar_buttons()
@@ -198,6 +231,10 @@ class MainWindow(Adw.ApplicationWindow):
 
         # Connect to the "notify::selected-page" signal to update the URL bar when the tab changes
         self.tab_view.connect("notify::selected-page", self.on_tab_changed)
+        self.tab_view.connect("close-page", self.on_close_page)
+        self.session.watch()
+        self.connect("close-request", self.on_close_request)
+        self.connect("destroy", self.on_destroy)
 
         # Track whether the grid view is active
         self.is_grid_view_active = False
@@ -208,155 +245,179 @@ class MainWindow(Adw.ApplicationWindow):
         # Initial update of button state
         self.update_navigation_buttons(self.get_current_webview())
 
-        # Read or create config.ini to get the profile name
-        self.profile_name = read_or_create_config()
-
-        # Create the directory for the profile
-        self.profile_directory = os.path.expanduser(f"~/.weaver/{self.profile_name}.default")
-        os.makedirs(self.profile_directory, exist_ok=True)
-        
-        # Initialize the databases directly here
-        self.history_db = self.initialize_history_db()
-        self.bookmarks_db = self.initialize_bookmarks_db()
-        
         self.create_bookmarks_menu()
+
+        # Bookmarks are cached in memory for the menu and the star icon
+        self.current_url_to_bookmark = None
+        self.bookmarks = BookmarkService(self.storage, self.on_bookmarks_changed)
+
+        # URL entry suggestions, the index is built on the storage thread
+        self.autocomplete = None
+        # One list per index being (re)loaded, of the visits made meanwhile
+        self.autocomplete_visit_queues = []
+        self.create_autocomplete_popover()
         
         # Connect the icon-press signal
         self.url_entry.connect("icon-press", self.on_icon_pressed)
+        startup_profiler.mark("window build")
+
+    def watch_first_paint(self):
+        # Call once presented, the rest of the startup waits for the first frame
+        frame_clock = self.get_frame_clock()
+        self.first_paint_handler = frame_clock.connect("after-paint", self.on_first_paint)
+
+    def on_first_paint(self, frame_clock):
+        frame_clock.disconnect(self.first_paint_handler)
+        startup_profiler.mark("first paint")
+        GLib.idle_add(self.start_deferred_work)
+
+    def start_deferred_work(self):
+        # Work the first frame does not need: filter lists, history menu,
+        # autocomplete index and disk cache size
+        self.content_blocker.load()
+        self.disk_cache.check()
+        self.populate_history_submenu(self.history_submenu)
+        self.load_autocomplete_index()
+        startup_profiler.mark("deferred work")
+        startup_profiler.report()
+        return GLib.SOURCE_REMOVE
+
+    def on_config_changed(self):
+        # config.ini was edited while running
+        self.tab_lifecycle.set_limits(
+            self.profile.get_int("tab_discard_idle_minutes", DEFAULT_DISCARD_IDLE_MINUTES),
+            self.profile.get_int("tab_discard_min_available_mb", DEFAULT_DISCARD_MIN_AVAILABLE_MB))
+        self.disk_cache.set_max_size(self.profile.get_int("disk_cache_size_mb", DEFAULT_DISK_CACHE_SIZE_MB))
+        self.disk_cache.check()
+        self.navigation_metrics.enabled = self.profile.get_int("navigation_metrics", 1) != 0
+
+    def on_close_request(self, window):
+        # The tabs are still open here, not any more at shutdown
+        self.session.close()
+        return False
+
+    def on_destroy(self, window):
+        # Otherwise the Config would keep the window alive and call it
+        self.profile.config.disconnect(self.config_changed_handler)
+        self.https_first.cancel_all()
+
+    def on_close_page(self, tab_view, page):
+        # A pending HTTPS-first fallback must not load into a closed tab
+        webview = self.get_tab_webview(page)
+        if webview:
+            self.https_first.cancel(webview)
+        # Let the tab view close it
+        return False
+
+    def clear_history(self, period):
+        # "hour", "day" and "all" clear a time range, "site" clears all
+        # history of the current tab's domain
+        since = None
+        domain = None
+        if period == "site":
+            webview = self.get_current_webview()
+            domain = self.get_domain(webview.get_uri() if webview else None)
+            if not domain:
+                return
+        elif CLEAR_HISTORY_RANGES.get(period):
+            since = int(datetime.now().timestamp()) - CLEAR_HISTORY_RANGES[period]
+
+        # One transaction on the storage thread, then one refresh
+        self.storage.clear_history(since, domain, vacuum=True, callback=self.on_history_cleared)
+
+    def on_history_cleared(self, result):
+        self.populate_history_submenu(self.history_submenu)
+        self.load_autocomplete_index()
+        if self.history_revealer.get_reveal_child():
+            self.history_sidebar.reload()
 
-    def initialize_history_db(self):
-        self.profile_name = read_or_create_config()
-        self.profile_directory = os.path.expanduser(f"~/.weaver/{self.profile_name}.default")
-        os.makedirs(self.profile_directory, exist_ok=True)
-        db_path = os.path.join(self.profile_directory, "history.db")
-        # Create the database file if it doesn't exist
-        if not os.path.exists(db_path):
-            with sqlite3.connect(db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute('''
-                CREATE TABLE IF NOT EXISTS history (
-                    id INTEGER PRIMARY KEY,
-                    url TEXT NOT NULL,
-                    title TEXT NOT NULL,
-                    timestamp TEXT NOT NULL
-                );
-                ''')
-                conn.commit()
-        return db_path
-
-    def initialize_bookmarks_db(self):
-        self.profile_name = read_or_create_config()
-        self.profile_directory = os.path.expanduser(f"~/.weaver/{self.profile_name}.default")
-        os.makedirs(self.profile_directory, exist_ok=True)
-        db_path = os.path.join(self.profile_directory, "bookmarks.db")
-        # Create the database file if it doesn't exist
-        if not os.path.exists(db_path):
-            with sqlite3.connect(db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute('''
-                CREATE TABLE IF NOT EXISTS bookmarks (
-                    id INTEGER PRIMARY KEY,
-                    url TEXT NOT NULL,
-                    title TEXT NOT NULL
-                );
-                ''')
-                conn.commit()
-        return db_path
-
-    def add_to_history(self, url, title):
-        self.history_db = self.initialize_history_db()
-        self.bookmarks_db = self.initialize_bookmarks_db()
-        # Insert a new record for visited URL
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        with sqlite3.connect(self.history_db) as conn:
-            cursor = conn.cursor()
-            cursor.execute("INSERT INTO history (url, title, timestamp) VALUES (?, ?, ?)", (url, title, timestamp))
-            conn.commit()
-
-    def get_history(self):
-        self.history_db = self.initialize_history_db()
-        self.bookmarks_db = self.initialize_bookmarks_db()
-        # Get all history records, ordered by most recent
-        with sqlite3.connect(self.history_db) as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT url, title, timestamp FROM history ORDER BY timestamp DESC")
-            return cursor.fetchall()
-            
-    def delete_from_history(self, url, title, timestamp):
-        self.history_db = self.initialize_history_db()
-        self.bookmarks_db = self.initialize_bookmarks_db()
-        with sqlite3.connect(self.history_db) as conn:
-            cursor = conn.cursor()
-            cursor.execute("DELETE FROM history WHERE url = ? AND title = ? AND timestamp = ?", (url, title, timestamp))
-            conn.commit()
-
-    def add_bookmark(self, url, title):
-        # Insert a new bookmark
-        with sqlite3.connect(self.bookmarks_db) as conn:
-            cursor = conn.cursor()
-            cursor.execute("INSERT INTO bookmarks (url, title) VALUES (?, ?)", (url, title))
-            conn.commit()
-
-    def get_bookmarks(self):
-        # Get all bookmarks
-        with sqlite3.connect(self.bookmarks_db) as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT url, title FROM bookmarks")
-            return cursor.fetchall()
-
-    def delete_bookmark(self, url):
-        # Delete a bookmark
-        with sqlite3.connect(self.bookmarks_db) as conn:
-            cursor = conn.cursor()
-            cursor.execute("DELETE FROM bookmarks WHERE url = ?", (url,))
-            conn.commit()
-            
-    def remove_history_items(self):
-        # Get history from the database
-        history_entries = self.get_history()
-        
-        # Add history items to the submenu
-        for url, title, timestamp in history_entries:
-            self.delete_from_history(url, title, timestamp)
-            self.populate_history_submenu(self.history_submenu)
-        
     def populate_history_submenu(self, history_submenu):
         # Clear the current history submenu
         history_submenu.remove_all()
 
-        # Get history from the database
-        history_entries = self.get_history()
-
         options = Gio.Menu()
-        history_items = Gio.Menu()
+        clear_options = Gio.Menu()
+        self.history_items = Gio.Menu()
+        self.history_item_urls = []
 
-        options.append("Delete history items", "app.remove_history_items")
+        options.append("Show all history", "app.show_history")
+        clear_options.append("Clear last hour", "app.clear_history('hour')")
+        clear_options.append("Clear last day", "app.clear_history('day')")
+        clear_options.append("Clear all history", "app.clear_history('all')")
+        clear_options.append("Clear history for this site", "app.clear_history('site')")
 
-        # Add history items to the submenu
-        for url, title, timestamp in history_entries:
-            # Create a Gio.MenuItem for each history entry
-            if len(title) > 20:
-                title = title[:20] + "..."
-            menu_item = Gio.MenuItem.new(f"{title}", f"app.history_item('{url}')")
-            history_items.append_item(menu_item)
-            
         history_submenu.append_section(None, options)
-        history_submenu.append_section("Recent history", history_items)
+        history_submenu.append_section(None, clear_options)
+        history_submenu.append_section("Recent history", self.history_items)
+
+        # Only the most recent entries are listed, the rest is in the history sidebar
+        self.storage.get_recent_history(RECENT_HISTORY_LIMIT, self.on_recent_history_loaded)
+
+    def on_recent_history_loaded(self, history_entries):
+        self.history_items.remove_all()
+        self.history_item_urls = []
+
+        # Add history items to the submenu
+        for url, title, last_visit in history_entries or ():
+            self.history_items.append_item(self.create_history_menu_item(url, title))
+            self.history_item_urls.append(url)
+
+    def create_history_menu_item(self, url, title):
+        # Create a Gio.MenuItem for a history entry
+        title = title or url
+        if len(title) > 20:
+            title = title[:20] + "..."
+        return Gio.MenuItem.new(f"{title}", f"app.history_item('{url}')")
+
+    def add_recent_history_item(self, url, title):
+        # Move the visited URL to the top instead of rebuilding the submenu
+        if url in self.history_item_urls:
+            index = self.history_item_urls.index(url)
+            self.history_items.remove(index)
+            del self.history_item_urls[index]
+
+        self.history_items.insert_item(0, self.create_history_menu_item(url, title))
+        self.history_item_urls.insert(0, url)
+
+        if len(self.history_item_urls) > RECENT_HISTORY_LIMIT:
+            self.history_items.remove(RECENT_HISTORY_LIMIT)
+            self.history_item_urls.pop()
+
+    def show_history_sidebar(self):
+        if self.history_sidebar is None:
+            from historyview import HistorySidebar
+            self.history_sidebar = HistorySidebar(self.storage, self.on_history_sidebar_activated, self.hide_history_sidebar)
+            self.history_revealer.set_child(self.history_sidebar)
+        self.history_sidebar.reload()
+        self.history_revealer.set_reveal_child(True)
+
+    def hide_history_sidebar(self):
+        self.history_revealer.set_reveal_child(False)
+
+    def on_history_sidebar_activated(self, url):
+        if url.startswith("weaver://"):
+            self.open_weaver_url(url)
+        else:
+            self.change_url(url)
+
+    def load_url(self, webview, url):
+        # http:// URLs of hosts on the HSTS preload list load over HTTPS
+        webview.load_uri(self.https_first.upgrade(url) or url)
 
     def change_url(self, url):
         # Handle URL change
         current_tab = self.tab_view.get_selected_page()
-        webview = current_tab.get_child()
+        webview = self.get_tab_webview(current_tab)
         if isinstance(webview, WebKit.WebView):
-            webview.load_uri(url)
+            self.load_url(webview, url)
             
     # Method to handle history item selection
     def on_history_item_selected(self, menu_item, url):
         # Handle history item selection and load the URL
         current_tab = self.tab_view.get_selected_page()
-        webview = current_tab.get_child()
+        webview = self.get_tab_webview(current_tab)
         if isinstance(webview, WebKit.WebView):
-            webview.load_uri(url)
+            self.load_url(webview, url)
 
     # Modify the create_bookmarks_menu method to use Gio.Menu and Gtk.MenuButton
     def create_bookmarks_menu(self):
@@ -367,24 +428,32 @@ class MainWindow(Adw.ApplicationWindow):
         # Create a Gio.Menu to hold the bookmarks items
         self.bookmarks_menu = Gio.Menu()
 
-        # Populate the menu with bookmark items
-        self.populate_bookmarks_menu()
-
-        # Set the Gio.Menu for the MenuButton
+        # Set the Gio.Menu for the MenuButton, it is filled in by
+        # populate_bookmarks_menu once the bookmarks are loaded
         self.bookmarks_button.set_menu_model(self.bookmarks_menu)
+        self.bookmarks_button.connect("notify::active", self.on_bookmarks_menu_toggled)
 
         # Add Bookmarks button to HeaderBar
         self.hb.pack_end(self.bookmarks_button)
 
+    def on_bookmarks_menu_toggled(self, button, pspec):
+        # Menu items do not report hovering, so prefetch what the menu lists
+        if button.get_active():
+            self.dns_predictor.prefetch_urls((url for url, title in self.bookmarks.items()), "menu", MENU_PREFETCH_HOSTS)
+
+    def on_bookmarks_changed(self):
+        self.populate_bookmarks_menu()
+        if self.autocomplete:
+            self.autocomplete.set_bookmarks(self.bookmarks.items())
+        if self.current_url_to_bookmark:
+            self.update_icon(self.current_url_to_bookmark)
+
     def populate_bookmarks_menu(self):
         # Clear current menu items
         self.bookmarks_menu.remove_all()
 
-        # Get bookmarks from the database
-        bookmarks = self.get_bookmarks()
-
         # Add bookmarks to the menu
-        for url, title in bookmarks:
+        for url, title in self.bookmarks.items():
             # Create a Gio.MenuItem for each bookmark
             menu_item = Gio.MenuItem.new(title, f"app.bookmark_item('{url}')")
             self.bookmarks_menu.append_item(menu_item)
@@ -392,14 +461,13 @@ class MainWindow(Adw.ApplicationWindow):
     def on_bookmark_selected(self, menu_item, url):
         # Handle bookmark selection and load the URL
         current_tab = self.tab_view.get_selected_page()
-        webview = current_tab.get_child()
+        webview = self.get_tab_webview(current_tab)
         if isinstance(webview, WebKit.WebView):
-            webview.load_uri(url)
+            self.load_url(webview, url)
 
     def populate_bookmarks_list(self):
         self.bookmarks_listbox.foreach(self.bookmarks_listbox.remove)  # Clear current list
-        bookmarks = self.get_bookmarks()
-        for url, title in bookmarks:
+        for url, title in self.bookmarks.items():
             row = Gtk.ListBoxRow()
             label = Gtk.Label(label=f"{title} - {url}")
             row.add(label)
@@ -409,15 +477,123 @@ class MainWindow(Adw.ApplicationWindow):
     def on_bookmarks_button_clicked(self, button):
         self.popover.show_all()
 
+    def create_autocomplete_popover(self):
+        self.autocomplete_listbox = Gtk.ListBox()
+        self.autocomplete_listbox.set_selection_mode(Gtk.SelectionMode.SINGLE)
+        self.autocomplete_listbox.set_can_focus(False)
+        self.autocomplete_listbox.connect("row-activated", self.on_autocomplete_row_activated)
+        self.autocomplete_listbox.connect("row-selected", self.on_autocomplete_row_selected)
+
+        # Not autohiding, so typing stays in the URL entry
+        self.autocomplete_popover = Gtk.Popover()
+        self.autocomplete_popover.set_autohide(False)
+        self.autocomplete_popover.set_has_arrow(False)
+        self.autocomplete_popover.set_position(Gtk.PositionType.BOTTOM)
+        self.autocomplete_popover.set_child(self.autocomplete_listbox)
+        self.autocomplete_popover.set_parent(self.url_entry)
+
+        key_controller = Gtk.EventControllerKey()
+        key_controller.set_propagation_phase(Gtk.PropagationPhase.CAPTURE)
+        key_controller.connect("key-pressed", self.on_url_entry_key_pressed)
+        self.url_entry.add_controller(key_controller)
+
+        focus_controller = Gtk.EventControllerFocus()
+        focus_controller.connect("leave", lambda controller: self.autocomplete_popover.popdown())
+        self.url_entry.add_controller(focus_controller)
+
+    def load_autocomplete_index(self):
+        from autocomplete import AutocompleteIndex
+        # Visits made while the worker builds the index are not in it, they
+        # are added once it is loaded
+        visits = []
+        self.autocomplete_visit_queues.append(visits)
+        self.storage.load_url_index(AutocompleteIndex, lambda index: self.on_autocomplete_index_loaded(index, visits))
+
+    def on_autocomplete_index_loaded(self, index, visits):
+        self.autocomplete_visit_queues.remove(visits)
+        if index is None:
+            # The history could not be read, keep the index there is
+            return
+        for url, title, timestamp in visits:
+            index.add_visit(url, title, timestamp)
+        index.set_bookmarks(self.bookmarks.items())
+        self.autocomplete = index
+        self.dns_predictor.prefetch_urls(index.top(STARTUP_PREFETCH_HOSTS * 4), "startup", STARTUP_PREFETCH_HOSTS)
+
     def on_url_changed(self, entry):
-        # Handle URL changes here
-        pass
+        # Only suggest while the user is typing, not when a load sets the text
+        focus = self.get_focus()
+        if not self.autocomplete or focus is None or not focus.is_ancestor(entry):
+            self.autocomplete_popover.popdown()
+            return
+
+        suggestions = self.autocomplete.search(entry.get_text(), AUTOCOMPLETE_LIMIT)
+        self.autocomplete_listbox.remove_all()
+        for url, title in suggestions:
+            row = Gtk.ListBoxRow()
+            row.set_can_focus(False)
+            row.url = url
+            box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, margin_top=4, margin_bottom=4, margin_start=6, margin_end=6)
+            title_label = Gtk.Label(label=title or url, halign=Gtk.Align.START, ellipsize=Pango.EllipsizeMode.END)
+            url_label = Gtk.Label(label=url, halign=Gtk.Align.START, ellipsize=Pango.EllipsizeMode.END)
+            url_label.get_style_context().add_class("dim-label")
+            url_label.get_style_context().add_class("caption")
+            box.append(title_label)
+            box.append(url_label)
+            row.set_child(box)
+            motion_controller = Gtk.EventControllerMotion()
+            motion_controller.connect("enter", lambda controller, x, y, url=url: self.dns_predictor.prefetch_url(url, "hover"))
+            row.add_controller(motion_controller)
+            self.autocomplete_listbox.append(row)
+
+        if suggestions:
+            # The best match is the likeliest next navigation
+            self.dns_predictor.prefetch_url(suggestions[0][0], "typed")
+            self.autocomplete_popover.set_size_request(entry.get_width(), -1)
+            self.autocomplete_popover.popup()
+        else:
+            self.autocomplete_popover.popdown()
+
+    def on_url_entry_key_pressed(self, controller, keyval, keycode, state):
+        if not self.autocomplete_popover.get_visible():
+            return False
+        if keyval == Gdk.KEY_Escape:
+            self.autocomplete_popover.popdown()
+            return True
+        if keyval in (Gdk.KEY_Down, Gdk.KEY_Up):
+            # Move the selection, wrapping around to "no selection"
+            selected = self.autocomplete_listbox.get_selected_row()
+            index = selected.get_index() if selected else -1
+            index += 1 if keyval == Gdk.KEY_Down else -1
+            row = self.autocomplete_listbox.get_row_at_index(index) if index >= 0 else None
+            if row:
+                self.autocomplete_listbox.select_row(row)
+            else:
+                self.autocomplete_listbox.unselect_all()
+            return True
+        return False
+
+    def on_autocomplete_row_selected(self, listbox, row):
+        if row:
+            self.dns_predictor.prefetch_url(row.url, "selected")
+
+    def on_autocomplete_row_activated(self, listbox, row):
+        self.autocomplete_listbox.select_row(row)
+        self.on_url_activated(self.url_entry)
 
     def on_url_activated(self, entry):
         current_tab = self.tab_view.get_selected_page()
-        webview = current_tab.get_child()
+        webview = self.get_tab_webview(current_tab)
+
+        # A suggestion picked with the arrow keys replaces the typed text
+        selected = self.autocomplete_listbox.get_selected_row() if self.autocomplete_popover.get_visible() else None
+        if selected:
+            entry.set_text(selected.url)
+        self.autocomplete_popover.popdown()
 
         url = entry.get_text()
+        # Host names typed without a scheme, loaded HTTPS first
+        typed_host = False
         if url.startswith("file://") or url.startswith("weaver://"):
             url = url
         elif url.startswith("about:blank"):
@@ -426,344 +602,53 @@ class MainWindow(Adw.ApplicationWindow):
         elif not re.search(r'.*\.[a-z]{2,6}(/.*)?$', url):
             url = f"https://www.duckduckgo.com/?q={url}"
         elif not url.startswith("http://") and not url.startswith("https://"):
-            url = "http://" + url
+            typed_host = True
 
         if isinstance(webview, WebKit.WebView):
             if url.startswith("weaver://"):
-                self.is_weaver_url = True
-                self.weaver_url = url
-                self.load_weaver_page(url.replace("weaver://", ""))
+                self.open_weaver_url(url)
+            elif typed_host:
+                self.https_first.load_typed(webview, url)
             else:
-                self.is_weaver_url = False
-                self.weaver_url = None
-                webview.load_uri(url)
+                self.load_url(webview, url)
+            # Later set_text() calls from the load must not bring suggestions back
+            webview.grab_focus()
 
         # Update navigation buttons after URL change
         self.update_navigation_buttons(webview)
 
+    def on_decide_policy(self, webview, decision, decision_type):
+        if decision_type == WebKit.PolicyDecisionType.NAVIGATION_ACTION:
+            uri = decision.get_navigation_action().get_request().get_uri()
+            # Links to the full history open the sidebar
+            if uri == "weaver://history":
+                decision.ignore()
+                self.open_weaver_url(uri)
+                return True
+        # Popups opened by the page go through the $popup filters
+        elif decision_type == WebKit.PolicyDecisionType.NEW_WINDOW_ACTION:
+            uri = decision.get_navigation_action().get_request().get_uri()
+            if uri and self.content_blocker.should_block(uri, webview.get_uri(), "popup"):
+                decision.ignore()
+                return True
+        return False
+
+    def open_weaver_url(self, url):
+        if url == "weaver://history":
+            # History is shown in the sidebar rather than as a page
+            self.show_history_sidebar()
+            return
+        webview = self.get_current_webview()
+        if webview:
+            self.url_entry.set_text(url)
+            webview.load_uri(url)
+
     def load_weaver_page(self, url):
-        current_tab = self.tab_view.get_selected_page()
-        webview = current_tab.get_child()
-        if isinstance(webview, WebKit.WebView):
-            if url == "home":
-                webview.load_html('test')
-            elif url == "about":
-                self.weaver_title = f"About {self.app_name}"
-                webview.load_html(f"""
-<html xmlns="http://www.w3.org/1999/xhtml" xml:lang="en" lang="en" dir="ltr">
-<head>
-  <meta http-equiv="content-type" content="text/html; charset=utf-8">
-  <meta http-equiv="weaver-url" content="{url}">
-  <title>{self.weaver_title}</title>
-  <style>
-    /* Global CSS for error pages */
-    :root {{ 
-        --bg-color: {'#242424' if self.dark_mode else '#fafafa'}; 
-        --fg-color: {'rgba(255, 255, 255, 0.8)' if self.dark_mode else 'rgba(0, 0, 0, 0.8)'}; 
-        --base-color: {'#000' if self.dark_mode else '#fff'}; 
-        --text-color: {'#fff' if self.dark_mode else '#000'}; 
-        --borders: #d3d7cf; 
-        --error-color: #c01c28;
-        --icon-invert: 0.2; /* icon color adjustment */
-        --error-filter: hue-rotate(-5.1deg) grayscale(45%) brightness(144%);
-        color-scheme: light dark;
-    }}
-    body {{
-        font-family: -webkit-system-font, Cantarell, sans-serif;
-        color: var(--fg-color);
-        background-color: var(--bg-color);
-        height: 100%;
-    }}
-    .error-body {{
-        box-sizing: border-box;
-        display: flex;
-        flex-direction: column;
-        justify-content: center;
-        max-width: 40em;
-        margin: auto;
-        padding-left: 12px;
-        padding-right: 12px;
-        line-height: 1.5;
-        height: 100%;
-    }}
-    .clickable {{
-        cursor: pointer;
-        opacity: 0.6;
-    }}
-    .clickable:hover, .clickable:focus {{
-        opacity: 0.8;
-    }}
-    #msg-title {{
-        text-align: center;
-        font-size: 20pt;
-        font-weight: 800;
-    }}
-    #msg-subtitle {{
-        text-align: center;
-        font-size: 20pt;
-        font-weight: 800;
-        margin-top: 0px;
-        margin-bottom: 10px;
-    }}
-    #msg-icon {{
-        margin-left: auto;
-        margin-right: auto;
-        width: 128px;
-        height: 128px;
-        background-size: cover;
-    }}
-    #msg-details {{
-        margin-top: 10px;
-        margin-bottom: 10px;
-    }}
-    #msg-body {{
-        text-align: center; 
-    }}
-    .btn {{
-        min-width: 200px;
-        height: 32px;
-        margin-top: 15px;
-        margin-bottom: 0;
-        line-height: 1.42857143;
-        text-align: center;
-        white-space: nowrap;
-        vertical-align: middle;
-        cursor: pointer;
-        border: none;
-        border-radius: 5px;
-    }}
-    .suggested-action {{
-        color: white;
-        background-color: #3584e4;
-    }}
-    .suggested-action:hover, .suggested-action:focus, .suggested-action:active {{
-        color: white;
-        background-color: #3987e5;
-    }}
-    .destructive-action {{
-        color: white;
-        background-color: #e01b24;
-    }}
-    .destructive-action:hover, .destructive-action:focus, .destructive-action:active {{
-        color: white;
-        background-color: #e41c26;
-    }}
-  </style>
-</head>
-<body class="error-body">
-  <svg xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink" id="msg-icon" width="128" height="128"><defs><clipPath id="i"><path d="M0 0h192v152H0z"/></clipPath><clipPath id="Y"><path d="M79 0h49v128H79zm0 0"/></clipPath><clipPath id="b"><path d="M0 0h192v152H0z"/></clipPath><clipPath id="Z"><path d="M479.988 20.078c0 110.453-89.543 200-200 200-110.453 0-200-89.547-200-200 0-110.457 89.547-200 200-200 110.457 0 200 89.543 200 200zm0 0"/></clipPath><clipPath id="c"><path d="M0 0h192v152H0z"/></clipPath><clipPath id="q"><path d="M0 0h192v152H0z"/></clipPath><clipPath id="p"><path d="M0 0h192v152H0z"/></clipPath><clipPath id="d"><path d="M0 0h192v152H0z"/></clipPath><clipPath id="o"><path d="M0 0h192v152H0z"/></clipPath><clipPath id="e"><path d="M0 0h192v152H0z"/></clipPath><clipPath id="n"><path d="M0 0h192v152H0z"/></clipPath><clipPath id="f"><path d="M0 0h192v152H0z"/></clipPath><clipPath id="m"><path d="M0 0h192v152H0z"/></clipPath><clipPath id="g"><path d="M0 0h192v152H0z"/></clipPath><clipPath id="l"><path d="M0 0h192v152H0z"/></clipPath><clipPath id="h"><path d="M0 0h192v152H0z"/></clipPath><clipPath id="k"><path d="M0 0h192v152H0z"/></clipPath><clipPath id="j"><path d="M0 0h192v152H0z"/></clipPath><mask id="S"><g filter="url(#a)"><path fill-opacity=".668" d="M0 0h128v128H0z"/></g></mask><mask id="ab"><g filter="url(#a)"><path fill-opacity=".5" d="M0 0h128v128H0z"/></g></mask><mask id="M"><g filter="url(#a)"><path fill-opacity=".1" d="M0 0h128v128H0z"/></g></mask><mask id="I"><g filter="url(#a)"><path fill-opacity=".1" d="M0 0h128v128H0z"/></g></mask><mask id="O"><g filter="url(#a)"><path fill-opacity=".1" d="M0 0h128v128H0z"/></g></mask><mask id="G"><g filter="url(#a)"><path fill-opacity=".1" d="M0 0h128v128H0z"/></g></mask><mask id="Q"><g filter="url(#a)"><path fill-opacity=".668" d="M0 0h128v128H0z"/></g></mask><mask id="E"><g filter="url(#a)"><path fill-opacity=".1" d="M0 0h128v128H0z"/></g></mask><mask id="t"><g filter="url(#a)"><path fill-opacity=".1" d="M0 0h128v128H0z"/></g></mask><mask id="C"><g filter="url(#a)"><path fill-opacity=".1" d="M0 0h128v128H0z"/></g></mask><mask id="U"><g filter="url(#a)"><path fill-opacity=".668" d="M0 0h128v128H0z"/></g></mask><mask id="A"><g filter="url(#a)"><path fill-opacity=".1" d="M0 0h128v128H0z"/></g></mask><mask id="W"><g filter="url(#a)"><path fill-opacity=".3" d="M0 0h128v128H0z"/></g></mask><mask id="y"><g filter="url(#a)"><path fill-opacity=".1" d="M0 0h128v128H0z"/></g></mask><mask id="v"><g filter="url(#a)"><path fill-opacity=".2" d="M0 0h128v128H0z"/></g></mask><mask id="K"><g filter="url(#a)"><path fill-opacity=".1" d="M0 0h128v128H0z"/></g></mask><g id="F" clip-path="url(#h)"><path d="M103.586 65.293h4v2h-4zm0 0" fill="#fff"/></g><g id="N" clip-path="url(#l)"><path d="M63.586 47.293h4v2h-4zm0 0" fill="#fff"/></g><g id="x" clip-path="url(#d)"><path d="M85.586 97.293h6v2h-6zm0 0" fill="#fff"/></g><g id="B" clip-path="url(#f)"><path d="M39.586 43.293h6v2h-6zm0 0" fill="#fff"/></g><g id="P" clip-path="url(#m)"><path d="M66.8 66.254c0 6.617-5.362 11.98-11.98 11.98-6.613 0-11.976-5.363-11.976-11.98s5.363-11.98 11.976-11.98c6.617 0 11.98 5.363 11.98 11.98zm0 0" fill="none" stroke-width="5.59" stroke-linejoin="round" stroke="#fff"/></g><g id="H" clip-path="url(#i)"><path d="M103.586 71.293h2v2h-2zm0 0" fill="#fff"/></g><g id="aa" clip-path="url(#q)"><path d="M169.336 19.172v3.531l.883.883.34.344.543-.543v-.684h.683l.2-.2v-.683l.882-.883h.684l.199-.199v-.683l-.883-.883zm8.113 0v1.765h1.598l.91 1.325v.441l.856.883v-4.414zm3.363 4.414l-.91.05-.855-.933v-.219h-1.078l-.442-.664h-.078v2.883l.301.43v1.762L179.047 28l.883-.883V24.47zm0 0" fill="#2e3436"/></g><g id="R" clip-path="url(#n)"><path d="M77.602 66.254c0 12.582-10.2 22.781-22.782 22.781-12.578 0-22.777-10.2-22.777-22.781 0-12.582 10.2-22.781 22.777-22.781 12.582 0 22.782 10.199 22.782 22.78zm0 0" fill="none" stroke-width="3.862" stroke-linejoin="round" stroke="#fff"/></g><g id="s" clip-path="url(#b)"><path d="M107.586 115.293v14a60.121 60.121 0 0012-12v-2zm0 0" fill="#fff"/></g><g id="J" clip-path="url(#j)"><path d="M113.586 71.293h6v2h-6zm0 0" fill="#fff"/></g><g id="T" clip-path="url(#o)"><path d="M88.879 66.254c0 18.808-15.246 34.058-34.059 34.058-18.808 0-34.058-15.25-34.058-34.058 0-18.813 15.25-34.059 34.058-34.059 18.813 0 34.059 15.246 34.059 34.059zm0 0" fill="none" stroke-width="1.98" stroke-linejoin="round" stroke="#fff"/></g><g id="D" clip-path="url(#g)"><path d="M47.586 67.293h4v2h-4zm0 0" fill="#fff"/></g><g id="z" clip-path="url(#e)"><path d="M33.586 77.293h4v2h-4zm0 0" fill="#fff"/></g><g id="V" clip-path="url(#p)"><path d="M55.176 70.605L17.512 107.16a59.63 59.63 0 006.293 10.336l5.379.176-1.914 3.973a60.081 60.081 0 009.851 8.722l3.3-7.43 15.067 16.094c.13.031.258.067.387.098zm0 0" fill-rule="evenodd" fill="#12121c"/></g><g id="L" clip-path="url(#k)"><path d="M101.586 45.148h4v2h-4zm0 0" fill="#fff"/></g><g id="u" clip-path="url(#c)"><path d="M71.586 21.293a60.068 60.068 0 00-24.477 5.219l8.477 6.781v8l8 8h4v-4l6-6v-4l4-4v-9.7c-1.992-.198-3.996-.3-6-.3zm-40.79 16a59.996 59.996 0 00-19.085 40.113l19.875 17.887v-6l-4-4 6-6h4l4 4 .125-8.402 5.875-5.598h4v-4l4-4v-6l-4.273-3.875-9.727-.125v8h-4l-4-4v-4l6-6h6v-4l-4-4zm70.79 2l-6 6v4h6v-2.145h4v4.27l-2 1.875h-10v4h-4v6h-8v8h10v-4h8v2l4 4h2v-2l-2-2v-2h4l6 6h6v2l-2 2h-4l16.652 16.652a60.002 60.002 0 00-15.805-54.652zm12 38h-12l-2-2h-14l-8 8v8l8 8h6l4 4v2l2 2v12l10 10a60.02 60.02 0 0012-12v-14l4-4v-8l-10-10zm-2-12h4l6 6h-4zm-74 28l-4 4v10l8.125 8.144-.086 17.836a59.466 59.466 0 007.96 3.84v-3.82l6-6v-4l6-6v-4l4-4v-8l-4-4h-8l-4-4zm0 0"/></g><radialGradient id="X" gradientUnits="userSpaceOnUse" cx="17.814" cy="24.149" fx="17.814" fy="24.149" r="9.125" gradientTransform="matrix(7.42904 0 0 7.1212 -88.327 -114.956)"><stop offset="0" stop-color="#fff"/><stop offset="1" stop-color="#e4e4e4"/></radialGradient><radialGradient id="w" gradientUnits="userSpaceOnUse" cx="46.511" cy="236.83" fx="46.511" fy="236.83" r="224" gradientTransform="matrix(.29041 -.00079 .00067 .24464 49.921 -16.608)"><stop offset="0" stop-color="#cee2f8"/><stop offset=".552" stop-color="#98c1f1"/><stop offset="1" stop-color="#62a0ea"/></radialGradient><radialGradient id="r" gradientUnits="userSpaceOnUse" cx="256" cy="-46.416" fx="256" fy="-46.416" r="224" gradientTransform="matrix(.29048 0 0 .29907 -10.777 55.175)"><stop offset="0" stop-color="#62a0ea"/><stop offset=".552" stop-color="#3584e4"/><stop offset="1" stop-color="#1a5fb4"/></radialGradient><filter id="a" filterUnits="objectBoundingBox" x="0%" y="0%" width="100%" height="100%"><feColorMatrix in="SourceGraphic" values="0 0 0 0 1 0 0 0 0 1 0 0 0 0 1 0 0 0 1 0"/></filter></defs><path d="M39.11 8.512v2l4.011-.16.09-1.997zm0 0" fill-rule="evenodd" fill="#2967b4"/><path d="M3.71 59.41v2l4.013-.16.09-1.996zm0 0" fill-rule="evenodd" fill="#164e93"/><path d="M123.586 65.293c0 33.137-26.863 60-60 60s-60-26.863-60-60 26.863-60 60-60 60 26.863 60 60zm0 0" fill="url(#r)"/><use xlink:href="#s" transform="translate(-8 -16)" mask="url(#t)"/><use xlink:href="#u" transform="translate(-8 -16)" mask="url(#v)"/><path d="M105.586 59.293v2h4v-2zm0 0" fill-rule="evenodd" fill="#144788"/><path d="M63.586 3.293a60.068 60.068 0 00-24.477 5.219l8.477 6.781v8l8 8h4v-4l6-6v-4l4-4v-9.7c-1.992-.198-3.996-.3-6-.3zm-40.79 16A59.996 59.996 0 003.712 59.406l19.875 17.887v-6l-4-4 6-6h4l4 4 .125-8.402 5.875-5.598h4v-4l4-4v-6l-4.273-3.875-9.727-.125v8h-4l-4-4v-4l6-6h6v-4l-4-4zm70.79 2l-6 6v4h6v-2.145h4v4.27l-2 1.875h-10v4h-4v6h-8v8h10v-4h8v2l4 4h2v-2l-2-2v-2h4l6 6h6v2l-2 2h-4l16.652 16.652a60.002 60.002 0 00-15.805-54.652zm12 38h-12l-2-2h-14l-8 8v8l8 8h6l4 4v2l2 2v12l10 10a60.02 60.02 0 0012-12v-14l4-4v-8l-10-10zm-2-12h4l6 6h-4zm-74 28l-4 4v10l8.125 8.144-.086 17.836a59.466 59.466 0 007.96 3.84v-3.82l6-6v-4l6-6v-4l4-4v-8l-4-4h-8l-4-4zm0 0" fill="url(#w)"/><use xlink:href="#x" transform="translate(-8 -16)" mask="url(#y)"/><use xlink:href="#z" transform="translate(-8 -16)" mask="url(#A)"/><use xlink:href="#B" transform="translate(-8 -16)" mask="url(#C)"/><use xlink:href="#D" transform="translate(-8 -16)" mask="url(#E)"/><use xlink:href="#F" transform="translate(-8 -16)" mask="url(#G)"/><use xlink:href="#H" transform="translate(-8 -16)" mask="url(#I)"/><use xlink:href="#J" transform="translate(-8 -16)" mask="url(#K)"/><use xlink:href="#L" transform="translate(-8 -16)" mask="url(#M)"/><use xlink:href="#N" transform="translate(-8 -16)" mask="url(#O)"/><use xlink:href="#P" transform="translate(-8 -16)" mask="url(#Q)"/><use xlink:href="#R" transform="translate(-8 -16)" mask="url(#S)"/><use xlink:href="#T" transform="translate(-8 -16)" mask="url(#U)"/><use xlink:href="#V" transform="translate(-8 -16)" mask="url(#W)"/><path d="M47.176 50.605L-.59 96.97l21.774.703-9.13 18.965c-2.812 8.43 9.833 11.59 11.942 5.27l8.43-18.97 15.453 16.508zm0 0" fill-rule="evenodd" fill="url(#X)"/><path d="M47.176 50.605l-.246.239-31.16 73.781c3.148 1.277 7.12.586 8.222-2.719l8.43-18.969 15.457 16.508zm0 0" fill-rule="evenodd" fill="#e4e6e8"/><g clip-path="url(#Y)"><g clip-path="url(#Z)"><use xlink:href="#aa" transform="translate(-8 -16)" mask="url(#ab)"/></g></g></svg>
-  <h1 id="msg-title">Weaver</h1>
-  <h2 id="msg-subtitle" style="opacity: 0.55;">Version {self.version}</h2>
-  <p id="msg-body">A simple web browser written in Python, GTK4, libadwaita, and WebKitGTK</p>
-</body>
-</html>
-""")
-            elif url == "start":
-                self.weaver_title = f"Welcome to {self.app_name}"
-                webview.load_html(f"""
-<html xmlns="http://www.w3.org/1999/xhtml" xml:lang="en" lang="en" dir="ltr">
-<head>
-  <meta http-equiv="content-type" content="text/html; charset=utf-8">
-  <title>{self.weaver_title}</title>
-  <style>
-    /* Global CSS for error pages */
-    :root {{ 
-        --bg-color: {'#242424' if self.dark_mode else '#fafafa'}; 
-        --fg-color: {'rgba(255, 255, 255, 0.8)' if self.dark_mode else 'rgba(0, 0, 0, 0.8)'}; 
-        --base-color: {'#000' if self.dark_mode else '#fff'}; 
-        --text-color: {'#fff' if self.dark_mode else '#000'}; 
-        --borders: #d3d7cf; 
-        --error-color: #c01c28;
-        --icon-invert: 0.2; /* icon color adjustment */
-        --error-filter: hue-rotate(-5.1deg) grayscale(45%) brightness(144%);
-        color-scheme: light dark;
-    }}
-    body {{
-        font-family: -webkit-system-font, Cantarell, sans-serif;
-        color: var(--fg-color);
-        background-color: var(--bg-color);
-        height: 100%;
-    }}
-    .error-body {{
-        box-sizing: border-box;
-        display: flex;
-        flex-direction: column;
-        justify-content: center;
-        max-width: 40em;
-        margin: auto;
-        padding-left: 12px;
-        padding-right: 12px;
-        line-height: 1.5;
-        height: 100%;
-    }}
-    .clickable {{
-        cursor: pointer;
-        opacity: 0.6;
-    }}
-    .clickable:hover, .clickable:focus {{
-        opacity: 0.8;
-    }}
-    #msg-title {{
-        text-align: center;
-        font-size: 20pt;
-        font-weight: 800;
-    }}
-    #msg-icon {{
-        margin-left: auto;
-        margin-right: auto;
-        width: 128px;
-        height: 128px;
-        background-size: cover;
-        opacity: 0.5;
-        filter: brightness(0) invert(var(--icon-invert));
-    }}
-    #msg-details {{
-        margin-top: 10px;
-        margin-bottom: 10px;
-    }}
-    .btn {{
-        min-width: 200px;
-        height: 32px;
-        margin-top: 15px;
-        margin-bottom: 0;
-        line-height: 1.42857143;
-        text-align: center;
-        white-space: nowrap;
-        vertical-align: middle;
-        cursor: pointer;
-        border: none;
-        border-radius: 5px;
-    }}
-    .suggested-action {{
-        color: white;
-        background-color: #3584e4;
-    }}
-    .suggested-action:hover, .suggested-action:focus, .suggested-action:active {{
-        color: white;
-        background-color: #3987e5;
-    }}
-    .destructive-action {{
-        color: white;
-        background-color: #e01b24;
-    }}
-    .destructive-action:hover, .destructive-action:focus, .destructive-action:active {{
-        color: white;
-        background-color: #e41c26;
-    }}
-  </style>
-</head>
-<body class="error-body">
-  <h1 id="msg-title">Work in progress</h1>
-  <p>This page is currently under construction.</p>
-  <p>Expect to see some changes soon.</p>
-  <div>
-    <button class="btn suggested-action" onclick="">Suggest a feature</button>
-  </div>
-</body>
-</html>
-""")
-            else:
-                self.weaver_title = "Problem Loading Page"
-                webview.load_html(f"""
-<html xmlns="http://www.w3.org/1999/xhtml" xml:lang="en" lang="en" dir="ltr">
-<head>
-  <meta http-equiv="content-type" content="text/html; charset=utf-8">
-  <meta http-equiv="weaver-url" content="{url}">
-  <title>{self.weaver_title}</title>
-  <style>
-    /* Global CSS for error pages */
-    :root {{ 
-        --bg-color: {'#242424' if self.dark_mode else '#fafafa'}; 
-        --fg-color: {'rgba(255, 255, 255, 0.8)' if self.dark_mode else 'rgba(0, 0, 0, 0.8)'}; 
-        --base-color: {'#000' if self.dark_mode else '#fff'}; 
-        --text-color: {'#fff' if self.dark_mode else '#000'}; 
-        --borders: #d3d7cf; 
-        --error-color: #c01c28;
-        --icon-invert: 0.2; /* icon color adjustment */
-        --error-filter: hue-rotate(-5.1deg) grayscale(45%) brightness(144%);
-        color-scheme: light dark;
-    }}
-    body {{
-        font-family: -webkit-system-font, Cantarell, sans-serif;
-        color: var(--fg-color);
-        background-color: var(--bg-color);
-        height: 100%;
-    }}
-    .error-body {{
-        box-sizing: border-box;
-        display: flex;
-        flex-direction: column;
-        justify-content: center;
-        max-width: 40em;
-        margin: auto;
-        padding-left: 12px;
-        padding-right: 12px;
-        line-height: 1.5;
-        height: 100%;
-    }}
-    .clickable {{
-        cursor: pointer;
-        opacity: 0.6;
-    }}
-    .clickable:hover, .clickable:focus {{
-        opacity: 0.8;
-    }}
-    #msg-title {{
-        text-align: center;
-        font-size: 20pt;
-        font-weight: 800;
-    }}
-    #msg-icon {{
-        margin-left: auto;
-        margin-right: auto;
-        width: 128px;
-        height: 128px;
-        background-size: cover;
-        opacity: 0.5;
-        filter: brightness(0) invert(var(--icon-invert));
-    }}
-    #msg-details {{
-        margin-top: 10px;
-        margin-bottom: 10px;
-    }}
-    .btn {{
-        min-width: 200px;
-        height: 32px;
-        margin-top: 15px;
-        margin-bottom: 0;
-        line-height: 1.42857143;
-        text-align: center;
-        white-space: nowrap;
-        vertical-align: middle;
-        cursor: pointer;
-        border: none;
-        border-radius: 5px;
-    }}
-    .suggested-action {{
-        color: white;
-        background-color: #3584e4;
-    }}
-    .suggested-action:hover, .suggested-action:focus, .suggested-action:active {{
-        color: white;
-        background-color: #3987e5;
-    }}
-    .destructive-action {{
-        color: white;
-        background-color: #e01b24;
-    }}
-    .destructive-action:hover, .destructive-action:focus, .destructive-action:active {{
-        color: white;
-        background-color: #e41c26;
-    }}
-  </style>
-</head>
-<body class="error-body">
-  <h1 id="msg-title">Invalid URL</h1>
-  <p>The URL cannot be recognized by Weaver</p>
-</body>
-</html>
-""")
-        
+        # weaver:// pages are served by the WeaverSchemeHandler of the app
+        webview = self.get_current_webview()
+        if webview:
+            webview.load_uri(f"weaver://{url}")
+
     def create_headerbar_buttons(self):
         # Back Button with symbolic icon
         self.back_button = Gtk.Button()
@@ -800,25 +685,22 @@ class MainWindow(Adw.ApplicationWindow):
         
     def on_back_clicked(self, button):
         current_tab = self.tab_view.get_selected_page()
-        webview = current_tab.get_child()
+        webview = self.get_tab_webview(current_tab)
         if isinstance(webview, WebKit.WebView) and webview.can_go_back():
             webview.go_back()
 
     def on_forward_clicked(self, button):
         current_tab = self.tab_view.get_selected_page()
-        webview = current_tab.get_child()
+        webview = self.get_tab_webview(current_tab)
         if isinstance(webview, WebKit.WebView) and webview.can_go_forward():
             webview.go_forward()
 
     def on_reload_clicked(self, button):
         current_tab = self.tab_view.get_selected_page()
-        webview = current_tab.get_child()
+        webview = self.get_tab_webview(current_tab)
         if isinstance(webview, WebKit.WebView):
             self.reload_icon.set_from_icon_name("process-stop")
-            if self.is_weaver_url == False:
-                webview.reload()
-            else:
-                self.load_weaver_page(self.weaver_url.replace("weaver://", ""))
+            webview.reload()
             
     def connect_navigation_signals(self):
         # Connect the history change signals for the current WebView
@@ -829,14 +711,13 @@ class MainWindow(Adw.ApplicationWindow):
     
     def on_tab_changed(self, tab_view, pspec):
         selected_tab = tab_view.get_selected_page()
-        webview = selected_tab.get_child()
+        if selected_tab is None:
+            return
+        # Rebuilds the WebView of a discarded tab
+        self.tab_lifecycle.on_page_selected(selected_tab)
+        webview = self.get_tab_webview(selected_tab)
         if isinstance(webview, WebKit.WebView):
-            if self.weaver_url and self.is_weaver_url == False:
-                self.is_weaver_url = True
-            else:
-                self.is_weaver_url = False
-            
-            current_url = self.weaver_url if self.is_weaver_url else webview.get_uri()
+            current_url = webview.get_uri()
             self.url_entry.set_text(current_url if current_url else '')
 
             # Update navigation buttons based on the new active tab's WebView
@@ -848,11 +729,21 @@ class MainWindow(Adw.ApplicationWindow):
         
         # Check if the selected tab has a child (WebView)
         if selected_tab:
-            webview = selected_tab.get_child()
-            if isinstance(webview, WebKit.WebView):
-                return webview
+            return self.get_tab_webview(selected_tab)
         
         return None  # Return None if no WebView is found
+
+    def get_tab_webview(self, tab):
+        # Tabs hold an Adw.Bin with the WebView, or a DiscardedTab in its place
+        webview = tab.get_child().get_child()
+        return webview if isinstance(webview, WebKit.WebView) else None
+
+    def open_tab_urls(self):
+        # Pages shown by the tabs of this window, discarded ones have none
+        for index in range(self.tab_view.get_n_pages()):
+            webview = self.get_tab_webview(self.tab_view.get_nth_page(index))
+            if webview:
+                yield webview.get_uri()
     
     def apply_button_style(self):
         css_provider = Gtk.CssProvider()
@@ -873,125 +764,30 @@ class MainWindow(Adw.ApplicationWindow):
         )
      
 
-    def get_favicon_from_html(self, html_content, base_url):
-        # Regular expression to match the <link rel="icon" href="..."> tag
-        favicon_regex = r'<link rel=["\"]icon["\"]\s+href=["\"](.*?)["\"]'
-        match = re.search(favicon_regex, html_content, re.IGNORECASE)
-        
-        if match:
-            favicon_url = match.group(1)
-            # If the URL is relative, prepend the base URL
-            if not favicon_url.startswith(('http://', 'https://')):
-                favicon_url = f"{base_url}/{favicon_url.lstrip('/')}"
-            return favicon_url
-        return None
-
-    def set_favicon_for_tab(self, tab_page, url):
-        base_url = self.get_base_url(url)
-        favicon_url = f"{base_url}/favicon.ico"  # Default path for favicon.ico
-
-        try:
-            # Try fetching the favicon.ico file first
-            response = requests.get(favicon_url)
-            response.raise_for_status()  # Raise an exception for bad responses
-
-            # Convert the favicon to PNG using Pillow
-            image = Image.open(BytesIO(response.content))
-            with BytesIO() as png_image:
-                image.save(png_image, format="PNG")
-                png_image.seek(0)  # Go back to the start of the BytesIO buffer
-
-                # Create a Pixbuf from the PNG image data
-                pixbuf = GdkPixbuf.Pixbuf.new_from_stream_at_scale(
-                    Gio.MemoryInputStream.new_from_data(png_image.read()),
-                    32, 32, True
-                )
-
-            # Set the favicon image to the tab's icon
-            tab_page = self.tab_view.get_selected_page()
-            tab_page.set_icon(pixbuf)
-
-        except requests.exceptions.RequestException as e:
-            # Fallback to PNG if the .ico file fails
-            fallback_url = favicon_url.replace('.ico', '.png')
-            try:
-                response = requests.get(fallback_url)
-                response.raise_for_status()  # Raise an exception for bad responses
-
-                with BytesIO() as png_image:
-                    png_image.write(response.content)
-                    png_image.seek(0)  # Go back to the start of the BytesIO buffer
-
-                    # Create a Pixbuf from the PNG image data
-                    pixbuf = GdkPixbuf.Pixbuf.new_from_stream_at_scale(
-                        Gio.MemoryInputStream.new_from_data(png_image.read()),
-                        32, 32, True
-                    )
-
-                # Set the favicon image to the tab's icon
-                tab_page = self.tab_view.get_selected_page()
-                tab_page.set_icon(pixbuf)
-
-            except requests.exceptions.RequestException as e:
-                # If both .ico and .png fail, try parsing the HTML for <link rel="icon">
-                try:
-                    response = requests.get(url)
-                    response.raise_for_status()  # Check if the request was successful
-
-                    # Try to extract favicon from HTML content
-                    favicon_url = self.get_favicon_from_html(response.text, base_url)
-
-                    if favicon_url:
-                        # Fetch the favicon from the parsed URL (either absolute or relative)
-                        response = requests.get(favicon_url)
-                        response.raise_for_status()
-
-                        # Convert the favicon to PNG using Pillow
-                        image = Image.open(BytesIO(response.content))
-                        with BytesIO() as png_image:
-                            image.save(png_image, format="PNG")
-                            png_image.seek(0)  # Go back to the start of the BytesIO buffer
-
-                            # Create a Pixbuf from the PNG image data
-                            pixbuf = GdkPixbuf.Pixbuf.new_from_stream_at_scale(
-                                Gio.MemoryInputStream.new_from_data(png_image.read()),
-                                32, 32, True
-                            )
-
-                        # Set the favicon image to the tab's icon
-                        tab_page = self.tab_view.get_selected_page()
-                        tab_page.set_icon(pixbuf)
-
-                    else:
-                        print("No favicon found in the HTML.")
-
-                        return None  # No favicon was found
-
-                except requests.exceptions.RequestException as e:
-                    print(f"Failed to fetch favicon using all methods: {e}")
-                    return None  # Return None if all attempts fail
-     
     def on_webview_load_changed(self, webview, load_event):
         if load_event == WebKit.LoadEvent.STARTED:
             self.reload_icon.set_from_icon_name("process-stop")
             selected_tab = self.tab_view.get_selected_page()
             selected_tab.set_loading(True)
+            self.dns_predictor.on_navigation(webview.get_uri())
+            self.https_first.on_started(webview)
+            # Element hiding is in place before the page's first paint. Load
+            # events are only emitted for the main frame, not for frames
+            self.content_blocker.apply_cosmetic_filters(webview.get_uri(), self.open_tab_urls())
+        elif load_event == WebKit.LoadEvent.COMMITTED:
+            self.https_first.on_committed(webview)
+            # After redirects the page may be on another host than at the start
+            self.content_blocker.apply_cosmetic_filters(webview.get_uri(), self.open_tab_urls())
         elif load_event == WebKit.LoadEvent.FINISHED:
             selected_tab = self.tab_view.get_selected_page()
             selected_tab.set_loading(False)
             current_url = webview.get_uri()
             self.reload_icon.set_from_icon_name("view-refresh-symbolic")
             self.update_navigation_buttons(webview)
+            self.session.schedule_save()
 
-            if current_url == "about:blank" and self.is_weaver_url == False:
+            if current_url == "about:blank":
                 selected_tab.set_title("Untitled")
-            elif self.is_weaver_url:
-                self.url_entry.set_text(self.weaver_url)
-                self.tab_view.get_selected_page().set_title(self.weaver_title)
-                self.set_title(f"{self.weaver_title} - Weaver")
-                self.add_to_history(self.weaver_url, self.weaver_title)
-                self.populate_history_submenu(self.history_submenu)
-                self.is_weaver_url = False
             elif current_url != f'about:blank':
                 self.url_entry.set_text(current_url)
 
@@ -1007,28 +803,29 @@ class MainWindow(Adw.ApplicationWindow):
                     self.current_url_to_bookmark = current_url
                     self.update_icon(current_url)
                     
-                # Save to history
-                self.add_to_history(current_url, webview.get_title())
-                
-                # Add bookmark functionality
-                self.populate_history_submenu(self.history_submenu)
-
-                if "www.youtube.com" in current_url:
-                    WebKit.WebView.evaluate_javascript(webview, self.adblocker_yt_js, len(self.adblocker_yt_js), None, None)
-
-    def get_base_url(self, url):
-        # Extract the base URL (protocol + domain) from the full URL
+                # Save to history, Weaver's own pages are not browsing
+                if not current_url.startswith("weaver:"):
+                    self.storage.add_visit(current_url, webview.get_title())
+                    if self.autocomplete:
+                        self.autocomplete.add_visit(current_url, webview.get_title())
+                    for visits in self.autocomplete_visit_queues:
+                        visits.append((current_url, webview.get_title(), time.time()))
+                    self.add_recent_history_item(current_url, webview.get_title())
+
+    def get_domain(self, url):
+        # Host of a web URL without a leading "www.", or None
         from urllib.parse import urlparse
-        parsed_url = urlparse(url)
-        base_url = f"{parsed_url.scheme}://{parsed_url.netloc}"
-        return base_url
+        if not url or not url.startswith(("http://", "https://")):
+            return None
+        host = urlparse(url).hostname
+        if host and host.startswith("www."):
+            host = host[4:]
+        return host
 
     def update_icon(self, url):
         # Update the icon based on the bookmark state
-        icon_name = "starred-symbolic" if url in self.get_bookmarks() else "non-starred-symbolic"
+        icon_name = "starred-symbolic" if self.bookmarks.contains(url) else "non-starred-symbolic"
         self.url_entry.set_icon_from_icon_name(Gtk.EntryIconPosition.SECONDARY, icon_name)
-        selected_tab = self.tab_view.get_selected_page()
-        self.set_favicon_for_tab(selected_tab, url)
         
     def on_icon_pressed(self, entry, icon_pos):
         # Toggle the bookmark state when the secondary icon is pressed
@@ -1066,8 +863,8 @@ class MainWindow(Adw.ApplicationWindow):
         if response == Gtk.ResponseType.OK:
             name = name_entry.get_text()
             url = url_entry.get_text()
-            self.add_bookmark(url, name)
-            self.populate_bookmarks_menu()
+            # Updates the menu and the star icon
+            self.bookmarks.add(url, name)
         dialog.close()
           
     def update_navigation_buttons(self, webview):
@@ -1084,8 +881,10 @@ class MainWindow(Adw.ApplicationWindow):
         menu_button = Gtk.MenuButton()
         menu_button.set_icon_name("open-menu-symbolic")
 
+        # Filled from the history once the window is shown
         self.history_submenu = Gio.Menu()
-        self.populate_history_submenu(self.history_submenu)
+        self.history_items = Gio.Menu()
+        self.history_item_urls = []
 
         # Create a Menu Model for the menu items
         menu = Gio.Menu()
@@ -1096,30 +895,52 @@ class MainWindow(Adw.ApplicationWindow):
 
         # Set the menu to the button
         menu_button.set_menu_model(menu)
+        menu_button.connect("notify::active", self.on_application_menu_toggled)
         self.hb.pack_end(menu_button)
 
+    def on_application_menu_toggled(self, button, pspec):
+        # Prefetch the recent history listed in the submenu
+        if button.get_active():
+            self.dns_predictor.prefetch_urls(self.history_item_urls, "menu", MENU_PREFETCH_HOSTS)
+
     def create_new_tab(self, url=None):
-        webview = WebKit.WebView()
-        webview.connect("context-menu", self.on_context_menu)
-        inspector = WebKit.WebView.get_inspector(webview)
-        inspector.connect("attach", self.on_attach_inspector, webview)
+        content = Adw.Bin()
         title = "New tab"
-        tab = self.tab_view.append(webview)
+        tab = self.tab_view.append(content)
         tab.set_title(title)
+        content.set_child(self.create_webview(tab))
         self.tab_view.set_selected_page(tab)
         self.load_weaver_page("start")
-        webview.connect("load-changed", self.on_webview_load_changed)
-        webview.connect("load-failed", self.on_webview_load_failed)
+
+    def create_webview(self, tab):
+        # Builds the WebView of a new tab, or of a discarded one being restored
+        webview = WebKit.WebView(network_session=self.network_session,
+                                 user_content_manager=self.content_blocker.user_content_manager)
+        webview.connect("context-menu", self.on_context_menu)
+        inspector = WebKit.WebView.get_inspector(webview)
+        # Not given the WebView, which would keep a discarded tab's alive
+        inspector.connect("attach", self.on_attach_inspector)
+        # Page load timings, ahead of the handlers they time
+        metrics = self.navigation_metrics
+        webview.connect("load-changed", metrics.on_load_changed)
+        webview.connect("load-failed", metrics.on_load_failed)
+        webview.connect("load-failed-with-tls-errors", metrics.on_load_failed)
+        webview.connect("load-changed", metrics.timed("load-changed", self.on_webview_load_changed))
+        webview.connect("load-failed", metrics.timed("load-failed", self.on_webview_load_failed))
+        webview.connect("load-failed-with-tls-errors", metrics.timed("load-failed-with-tls-errors", self.on_webview_tls_errors))
+        webview.connect("decide-policy", metrics.timed("decide-policy", self.on_decide_policy))
+        # WebKit reports the page's icon as it finds it during the load
+        webview.connect("notify::favicon", metrics.timed(
+            "notify::favicon", lambda webview, pspec: self.favicons.on_favicon_changed(tab, webview)))
         self.webview_settings = webview.get_settings()
+        return webview
  
 
     def on_context_menu(self, webview, context_menu, hit_test_result):
         WebKit.ContextMenu.append(context_menu, WebKit.ContextMenuItem.new_separator())
         WebKit.ContextMenu.append(context_menu, WebKit.ContextMenuItem.new_from_stock_action(WebKit.ContextMenuAction.INSPECT_ELEMENT))
 
-    def on_attach_inspector(self, inspector, webview):
-        print(inspector)
-        print(webview)
+    def on_attach_inspector(self, inspector):
         inspector.show()
 
     def on_new_tab_clicked(self, button):
@@ -1129,8 +950,24 @@ class MainWindow(Adw.ApplicationWindow):
         width = self.get_width()
         print(f"Window width: {width}")
 
+    def on_webview_tls_errors(self, webview, failing_uri, certificate, errors):
+        # An invalid certificate is shown, also when trying HTTPS first:
+        # falling back to HTTP would let whoever presents it downgrade the site
+        self.https_first.cancel(webview)
+        return False
+
     def on_webview_load_failed(self, webview, frame, error, failed_uri):
         # This method will be called when page loading fails (e.g., connection refused)
+        # (error is the URI that failed, failed_uri the GLib.Error)
+
+        # Loads replaced by another one, like an HTTPS-first fallback, did not fail
+        if failed_uri.matches(WebKit.network_error_quark(), WebKit.NetworkError.CANCELLED):
+            self.https_first.on_cancelled(webview, error)
+            return False
+        fallback = self.https_first.fallback_for(webview, error)
+        if fallback:
+            webview.load_uri(fallback)
+            return True
         
         # Prepare the error page HTML
         error_page_html = f"""
@@ -1255,7 +1092,26 @@ class MainWindow(Adw.ApplicationWindow):
 class MyApp(Adw.Application):
     def __init__(self, version, app_name, **kwargs):
         super().__init__(**kwargs)
+        # Profile name -> its window, profiles opened with --profile run side by side
+        self.windows = {}
+        self.profiles = {}
+        self.config = None
+        self.profile_names = []
+        self.scheme_handler = None
+        # Read on the first lookup, shared by all windows
+        self.hsts_preload = HstsPreload()
         self.connect('activate', self.on_activate)
+        self.connect('shutdown', self.on_shutdown)
+        self.add_main_option("profile-startup", 0, GLib.OptionFlags.NONE, GLib.OptionArg.NONE,
+                             "Print how long each phase of the startup took", None)
+        self.add_main_option("profile", 0, GLib.OptionFlags.NONE, GLib.OptionArg.STRING_ARRAY,
+                             "Open a window for this profile, repeat to run several profiles side by side", "NAME")
+        self.add_main_option("build-hsts-index", 0, GLib.OptionFlags.NONE, GLib.OptionArg.FILENAME,
+                             "Index Chromium's HSTS preload list (transport_security_state_static.json) and exit",
+                             "FILE")
+        self.add_main_option("rebuild-search-index", 0, GLib.OptionFlags.NONE, GLib.OptionArg.NONE,
+                             "Rebuild the history search index of the profile and exit", None)
+        self.connect('handle-local-options', self.on_handle_local_options)
         
         self.version = version
         self.app_name = app_name
@@ -1268,8 +1124,8 @@ class MyApp(Adw.Application):
         action2.connect("activate", self.create_new_tab)
         self.add_action(action2)
         
-        action3 = Gio.SimpleAction.new("remove_history_items", None)
-        action3.connect("activate", self.remove_history_items)
+        action3 = Gio.SimpleAction.new("clear_history", GLib.VariantType("s"))
+        action3.connect("activate", self.clear_history)
         self.add_action(action3)
 
         action4 = Gio.SimpleAction.new("history_item", GLib.VariantType("s"))
@@ -1279,6 +1135,10 @@ class MyApp(Adw.Application):
         action5 = Gio.SimpleAction.new("bookmark_item", GLib.VariantType("s"))
         action5.connect("activate", self.bookmark_item)
         self.add_action(action5)
+
+        action6 = Gio.SimpleAction.new("show_history", None)
+        action6.connect("activate", self.show_history)
+        self.add_action(action6)
         
         preferences_action = Gio.SimpleAction.new("preferences", None)
         preferences_action.connect("activate", self.on_preferences_activate)
@@ -1295,16 +1155,83 @@ class MyApp(Adw.Application):
         self.version = self.version
         self.app_name = self.app_name
 
+    @property
+    def win(self):
+        # The window actions apply to: the focused one, or any if none is
+        return self.get_active_window() or next(iter(self.windows.values()), None)
+
+    def on_handle_local_options(self, app, options):
+        self.config = Config()
+        profile_names = options.lookup_value("profile", GLib.VariantType("as"))
+        self.profile_names = list(dict.fromkeys(profile_names.unpack())) if profile_names else []
+        if not self.profile_names:
+            self.profile_names = [self.config.get_default_profile_name()]
+        if options.contains("build-hsts-index"):
+            json_path = options.lookup_value("build-hsts-index", GLib.VariantType("ay")).get_bytestring().decode()
+            try:
+                count = build_preload_index(json_path)
+            except (OSError, ValueError, KeyError) as e:
+                print(f"Failed to build the HSTS preload index from {json_path}: {e}")
+                return 1
+            print(f"Indexed {count} HSTS preloaded hosts into {HSTS_INDEX_PATH}")
+            return 0
+        if options.contains("rebuild-search-index"):
+            for name in self.profile_names:
+                profile_directory = Profile(name, self.config).directory
+                rebuild_search_index(profile_directory)
+                print(f"Rebuilt the history search index in {profile_directory}")
+            return 0
+        startup_profiler.enabled = options.contains("profile-startup")
+        # Carry on starting the browser
+        return -1
+
     def on_activate(self, app):
-        self.win = MainWindow(version=self.version, application=app, app_name=self.app_name)
-        self.win.present()
+        startup_profiler.mark("GTK init")
+        self.config.watch()
+        if self.scheme_handler is None:
+            # weaver:// pages, for the tabs of every profile
+            self.scheme_handler = WeaverSchemeHandler(self.version, self.app_name, self.search_history,
+                                                      HISTORY_SEARCH_LIMIT, self.performance_report)
+            self.scheme_handler.register(WebKit.WebContext.get_default())
+        for name in self.profile_names:
+            if name in self.windows:
+                self.windows[name].present()
+                continue
+            profile = self.profiles.get(name) or Profile(name, self.config)
+            self.profiles[name] = profile
+            window = MainWindow(version=self.version, application=app, app_name=self.app_name, profile=profile)
+            self.windows[name] = window
+            window.connect("destroy", lambda window, name=name: self.windows.pop(name, None))
+            window.present()
+            startup_profiler.mark("present")
+            window.watch_first_paint()
+
+    def search_history(self, webview, query, limit, callback):
+        # History of the profile whose window the requesting tab is in
+        window = webview.get_root() if webview else None
+        if isinstance(window, MainWindow):
+            window.storage.search_history(query, limit, callback)
+        else:
+            callback([])
+
+    def performance_report(self, webview, since, callback):
+        # Navigation metrics of the profile whose window the requesting tab is in
+        window = webview.get_root() if webview else None
+        if isinstance(window, MainWindow):
+            window.navigation_metrics.get_report(since, callback)
+        else:
+            callback(([], []))
+
+    def on_shutdown(self, app):
+        # Write out queued history before the process exits
+        for window in self.windows.values():
+            window.session.shutdown()
+        for profile in self.profiles.values():
+            profile.close()
 
     def history_item(self, action, param):
         if param.get_string().startswith("weaver://"):
-            self.win.is_weaver_url = True
-            self.win.weaver_url = param.get_string()
-            self.win.url_entry.set_text(param.get_string())
-            self.win.load_weaver_page(param.get_string().replace("weaver://", ""))
+            self.win.open_weaver_url(param.get_string())
         else:
             self.win.change_url(param.get_string())
 
@@ -1314,8 +1241,11 @@ class MyApp(Adw.Application):
     def create_new_tab(self, action, param):
         self.win.create_new_tab()
         
-    def remove_history_items(self, action, param):
-        self.win.remove_history_items()
+    def clear_history(self, action, param):
+        self.win.clear_history(param.get_string())
+
+    def show_history(self, action, param):
+        self.win.show_history_sidebar()
         
     def show_about_dialog(self, action, param):
         about_dialog = Adw.AboutDialog()
@@ -1335,6 +1265,5 @@ def main(version, app_name):
     return app.run(sys.argv)
 
 if __name__ == '__main__':
-    if not os.path.exists(os.path.expanduser('~/.weaver')):
-        os.makedirs(os.path.expanduser('~/.weaver'), exist_ok=True)  # Create ~/.weaver if it doesn't exist'/.weaver')
+    os.makedirs(WEAVER_DIRECTORY, exist_ok=True)  # Create ~/.weaver if it doesn't exist
     main(VERSION, APP_NAME)
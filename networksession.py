@@ -0,0 +1,97 @@
+## Weaver [Version 1.0]
+## (c) Twilight Incorporated. All rights reserved.
+
+import os
+import threading
+from gi.repository import GLib, WebKit
+
+# HTTP disk cache size cap when config.ini does not set disk_cache_size_mb
+DEFAULT_DISK_CACHE_SIZE_MB = 256
+
+# Helper function to add up the size of the files under a directory
+def directory_size(path):
+    total = 0
+    for directory, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(directory, name)).st_blocks * 512
+            except OSError:
+                pass
+    return total
+
+# Helper function to list the stored responses and bodies of WebKit's disk
+# cache under path as (last written, bytes, file), least recently written first
+def cache_entries(path):
+    entries = []
+    for directory, _, files in os.walk(path):
+        parts = directory.split(os.sep)
+        if "Records" not in parts and "Blobs" not in parts:
+            continue
+        for name in files:
+            file_path = os.path.join(directory, name)
+            try:
+                stat = os.lstat(file_path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_blocks * 512, file_path))
+    entries.sort()
+    return entries
+
+# Helper function to create the network session of a profile. Website data
+# (HSTS, local storage, ...) and the HTTP cache live in the profile, cookies
+# are kept in its cookies.sqlite, so all of them survive restarts
+def create_network_session(profile_directory):
+    data_directory = os.path.join(profile_directory, "webkit-data")
+    cache_directory = os.path.join(profile_directory, "webkit-cache")
+    network_session = WebKit.NetworkSession.new(data_directory, cache_directory)
+    network_session.get_cookie_manager().set_persistent_storage(
+        os.path.join(profile_directory, "cookies.sqlite"), WebKit.CookiePersistentStorage.SQLITE)
+    # Size the memory and disk caches for browsing, not for a document viewer
+    WebKit.WebContext.get_default().set_cache_model(WebKit.CacheModel.WEB_BROWSER)
+    return network_session
+
+class DiskCacheLimiter:
+    """
+    Keeps the HTTP disk cache of a network session under a size cap:
+      - WebKit has no setting for the size of its disk cache, so the cache
+        directory is measured in the background at startup
+      - when it is over the cap, the least recently written entries are
+        removed until it is under it again. WebKit takes a missing file for
+        a cache miss, so the rest of the cache stays usable
+    """
+    def __init__(self, network_session, max_size_mb):
+        self._data_manager = network_session.get_website_data_manager()
+        self.set_max_size(max_size_mb)
+        self.size = None
+
+    def set_max_size(self, max_size_mb):
+        self._max_bytes = max_size_mb * 1024 * 1024
+
+    def check(self):
+        threading.Thread(target=self._measure, name="weaver-disk-cache", daemon=True).start()
+
+    # Worker thread
+
+    def _measure(self):
+        cache_directory = self._data_manager.get_base_cache_directory()
+        size = directory_size(cache_directory)
+        freed = 0
+        if size > self._max_bytes:
+            for _, entry_size, path in cache_entries(cache_directory):
+                if size - freed <= self._max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                    freed += entry_size
+                except OSError:
+                    pass
+        GLib.idle_add(self._on_measured, size, freed)
+
+    # Main thread
+
+    def _on_measured(self, size, freed):
+        self.size = size - freed
+        if freed:
+            print(f"HTTP disk cache was {size // (1024 * 1024)} MiB, over its {self._max_bytes // (1024 * 1024)} MiB cap, "
+                  f"removed its oldest {freed // (1024 * 1024)} MiB")
+        return GLib.SOURCE_REMOVE
@@ -0,0 +1,166 @@
+## Weaver [Version 1.0]
+## (c) Twilight Incorporated. All rights reserved.
+
+import configparser
+import os
+from functools import cached_property
+from gi.repository import Gio, GLib
+from storage import StorageService
+from favicons import FaviconService
+from contentblocker import ContentBlocker
+from networksession import create_network_session, DiskCacheLimiter, DEFAULT_DISK_CACHE_SIZE_MB
+from dnsprefetch import DnsPredictor
+from telemetry import NavigationMetrics
+
+# Everything Weaver keeps lives under this directory
+WEAVER_DIRECTORY = os.path.expanduser("~/.weaver")
+# Settings of all profiles, and the name of the default one
+CONFIG_PATH = os.path.join(WEAVER_DIRECTORY, "config.ini")
+
+# Helper function to generate profile name
+def generate_profile_name():
+    # Only needed on the first launch
+    import random
+    import string
+    return ''.join(random.choices(string.ascii_lowercase + string.digits, k=8))
+
+# Helper function to get the directory of a profile
+def get_profile_directory(profile_name):
+    return os.path.join(WEAVER_DIRECTORY, f"{profile_name}.default")
+
+class Config:
+    """
+    config.ini, parsed once and kept up to date:
+      - [Settings] holds the default profile_name and settings for all
+        profiles, a [Profile <name>] section overrides them for one profile
+      - a file monitor reparses it when it is edited while Weaver runs and
+        calls the functions passed to connect_changed(), until they are
+        disconnected with the ID it returned
+    """
+    def __init__(self, path=CONFIG_PATH):
+        self.path = path
+        self._parser = configparser.ConfigParser()
+        # Handler ID -> function, like GObject signal handlers
+        self._listeners = {}
+        self._next_handler_id = 1
+        self._monitor = None
+        self._read()
+
+    def watch(self):
+        # Start following external edits, the monitor needs a main loop
+        if self._monitor is None:
+            self._monitor = Gio.File.new_for_path(self.path).monitor_file(Gio.FileMonitorFlags.NONE, None)
+            self._monitor.connect("changed", self.on_file_changed)
+
+    def connect_changed(self, callback):
+        handler_id = self._next_handler_id
+        self._next_handler_id += 1
+        self._listeners[handler_id] = callback
+        return handler_id
+
+    def disconnect(self, handler_id):
+        self._listeners.pop(handler_id, None)
+
+    def get_default_profile_name(self):
+        # Creates config.ini, or the default profile in it, if missing
+        profile_name = self._parser.get("Settings", "profile_name", fallback=None)
+        if not profile_name:
+            profile_name = generate_profile_name()
+            if not self._parser.has_section("Settings"):
+                self._parser.add_section("Settings")
+            self._parser.set("Settings", "profile_name", profile_name)
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, "w") as config_file:
+                self._parser.write(config_file)
+        return profile_name
+
+    def get_int(self, profile_name, key, fallback):
+        for section in (f"Profile {profile_name}", "Settings"):
+            if self._parser.has_option(section, key):
+                try:
+                    return self._parser.getint(section, key)
+                except ValueError:
+                    print(f"Invalid {key} in config.ini, using {fallback}")
+                    break
+        return fallback
+
+    def on_file_changed(self, monitor, file, other_file, event_type):
+        if event_type not in (Gio.FileMonitorEvent.CHANGES_DONE_HINT, Gio.FileMonitorEvent.CREATED):
+            return
+        self._read()
+        # A callback may disconnect itself
+        for callback in list(self._listeners.values()):
+            callback()
+
+    def _read(self):
+        parser = configparser.ConfigParser()
+        try:
+            parser.read(self.path)
+        except configparser.Error as e:
+            # Keep the last good settings while the file is being edited
+            print(f"Failed to read {self.path}: {e}")
+            return
+        self._parser = parser
+
+class Profile:
+    """
+    One profile and everything it owns, shared by its windows and tabs:
+      - its directory (created once), settings from the shared Config
+      - history and bookmarks storage, favicon cache, content blocker, DNS
+        predictor, navigation metrics and WebKit network session, each
+        opened on first use
+    Profiles never share these, so several can run side by side in one process.
+    """
+    def __init__(self, name, config):
+        self.name = name
+        self.config = config
+        self.directory = get_profile_directory(name)
+        os.makedirs(self.directory, exist_ok=True)
+
+    def get_int(self, key, fallback):
+        return self.config.get_int(self.name, key, fallback)
+
+    @cached_property
+    def storage(self):
+        # History and bookmarks are read and written on a background thread,
+        # results come back on the main loop
+        return StorageService(self.directory, GLib.idle_add)
+
+    @cached_property
+    def network_session(self):
+        # Shared by every tab so they share cookies, connections and the HTTP cache
+        return create_network_session(self.directory)
+
+    @cached_property
+    def disk_cache(self):
+        return DiskCacheLimiter(self.network_session, self.get_int("disk_cache_size_mb", DEFAULT_DISK_CACHE_SIZE_MB))
+
+    @cached_property
+    def dns_predictor(self):
+        return DnsPredictor(self.network_session, self.directory)
+
+    @cached_property
+    def favicons(self):
+        # Favicons come from WebKit's own database and are cached in the profile
+        return FaviconService(self.network_session, self.directory)
+
+    @cached_property
+    def content_blocker(self):
+        # Filter lists compiled into a content blocker, shared by every tab
+        return ContentBlocker(self.directory)
+
+    @cached_property
+    def navigation_metrics(self):
+        # Page load timings for weaver://performance, kept in the profile only
+        return NavigationMetrics(self.directory, self.get_int("navigation_metrics", 1) != 0)
+
+    def close(self):
+        # Writes out queued history, favicons and statistics, of whatever was opened
+        if "dns_predictor" in self.__dict__:
+            self.dns_predictor.save_stats()
+        if "favicons" in self.__dict__:
+            self.favicons.shutdown()
+        if "storage" in self.__dict__:
+            self.storage.close()
+        if "navigation_metrics" in self.__dict__:
+            self.navigation_metrics.close()
@@ -0,0 +1,142 @@
+## Weaver [Version 1.0]
+## (c) Twilight Incorporated. All rights reserved.
+
+import marshal
+import os
+from concurrent.futures import ThreadPoolExecutor
+from gi.repository import GLib, WebKit
+from tablifecycle import DiscardedTab
+
+# Open tabs of the profile, rewritten as a whole when they change
+SESSION_FILE = "session.bin"
+# Bump when the layout of the session file changes
+SESSION_VERSION = 1
+# Milliseconds to wait for more tab changes before writing the session
+SESSION_SAVE_DELAY = 2000
+
+# Helper function to read a session file into (selected index, tabs), where
+# tabs are (url, title, serialized session state) tuples
+def read_session(path):
+    try:
+        with open(path, "rb") as file:
+            session = marshal.loads(file.read())
+    except FileNotFoundError:
+        return 0, []
+    except (OSError, EOFError, ValueError, TypeError) as e:
+        print(f"Failed to read the session from {path}: {e}")
+        return 0, []
+    if not isinstance(session, dict) or session.get("version") != SESSION_VERSION:
+        return 0, []
+    return session["selected"], session["tabs"]
+
+# Helper function to write a session file without ever leaving a partial one
+def write_session(path, selected, tabs):
+    data = marshal.dumps({"version": SESSION_VERSION, "selected": selected, "tabs": tabs})
+    temporary_path = path + ".tmp"
+    with open(temporary_path, "wb") as file:
+        file.write(data)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary_path, path)
+
+class SessionStore:
+    """
+    Keeps the open tabs of a profile in its session file:
+      - tab order, URL, title and WebKit session state (back/forward list)
+        of every tab on a web or weaver:// page
+      - written atomically on a background thread, at most once per
+        SESSION_SAVE_DELAY however many tabs change
+      - restored tabs are DiscardedTab placeholders, only the selected one
+        gets a WebView (and a web process) at startup
+    """
+    def __init__(self, profile_directory, tab_view, tab_lifecycle, favicons):
+        self.path = os.path.join(profile_directory, SESSION_FILE)
+        self._tab_view = tab_view
+        self._tab_lifecycle = tab_lifecycle
+        self._favicons = favicons
+        self._save_source = None
+        self._handlers = []
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="weaver-session")
+
+    def restore(self):
+        # Returns whether any tab was restored
+        selected, tabs = read_session(self.path)
+        pages = []
+        for url, title, state in tabs:
+            page = self._tab_lifecycle.append_discarded(url, title, GLib.Bytes.new(state))
+            self._favicons.get_favicon(url, lambda texture, page=page: self._on_favicon(page, texture))
+            pages.append(page)
+        if not pages:
+            return False
+        page = pages[min(selected, len(pages) - 1)]
+        self._tab_view.set_selected_page(page)
+        self._tab_lifecycle.on_page_selected(page)
+        return True
+
+    def watch(self):
+        # Start saving on tab changes, call once the tabs are set up
+        for signal in ("page-attached", "page-detached", "page-reordered", "notify::selected-page"):
+            self._handlers.append(self._tab_view.connect(signal, lambda *args: self.schedule_save()))
+
+    def schedule_save(self):
+        if self._save_source is None and self._handlers:
+            self._save_source = GLib.timeout_add(SESSION_SAVE_DELAY, self._on_save_timeout)
+
+    def save(self):
+        # Collects the tabs on the main thread, writes them on the session thread
+        if self._save_source is not None:
+            GLib.source_remove(self._save_source)
+            self._save_source = None
+        selected_page = self._tab_view.get_selected_page()
+        selected, tabs = 0, []
+        for index in range(self._tab_view.get_n_pages()):
+            page = self._tab_view.get_nth_page(index)
+            tab = self._collect(page)
+            if tab is None:
+                continue
+            if page == selected_page:
+                selected = len(tabs)
+            tabs.append(tab)
+        self._executor.submit(self._write, selected, tabs)
+
+    def close(self):
+        # Saves the tabs one last time, call before the window takes them down
+        for handler in self._handlers:
+            self._tab_view.disconnect(handler)
+        self._handlers = []
+        self.save()
+        self.shutdown()
+
+    def shutdown(self):
+        # Waits for the last write
+        self._executor.shutdown(wait=True)
+
+    def _collect(self, page):
+        child = page.get_child().get_child()
+        if isinstance(child, DiscardedTab):
+            # Discarded tabs keep the state they were saved with
+            return child.url, page.get_title() or "", child.session_state.get_data()
+        if not isinstance(child, WebKit.WebView):
+            return None
+        url = child.get_uri()
+        if not url or not url.startswith(("http://", "https://", "file://", "weaver://")):
+            return None
+        state = child.get_session_state().serialize().get_data()
+        return url, page.get_title() or "", state
+
+    def _on_favicon(self, page, texture):
+        if texture is not None:
+            page.set_icon(texture)
+
+    def _on_save_timeout(self):
+        self._save_source = None
+        self.save()
+        return GLib.SOURCE_REMOVE
+
+    # Session thread
+
+    def _write(self, selected, tabs):
+        try:
+            write_session(self.path, selected, tabs)
+        except OSError as e:
+            print(f"Failed to save the session to {self.path}: {e}")
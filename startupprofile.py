@@ -0,0 +1,46 @@
+## Weaver [Version 1.0]
+## (c) Twilight Incorporated. All rights reserved.
+
+import time
+
+class StartupProfiler:
+    """
+    Times the phases of a launch for --profile-startup:
+      - mark(phase) charges the time since the previous mark to phase, so
+        phases interleaved with others add up
+      - record(phase, seconds) adds work timed on another thread, listed
+        apart since it overlaps the main thread's phases
+      - report() prints the breakdown once, when enabled
+    """
+    def __init__(self, start=None):
+        self.enabled = False
+        self._start = time.perf_counter() if start is None else start
+        self._last = self._start
+        # phase -> seconds, in the order phases first ended
+        self._phases = {}
+        # phase -> seconds, of work done off the main thread
+        self._background = {}
+        self._reported = False
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        self._phases[phase] = self._phases.get(phase, 0.0) + now - self._last
+        self._last = now
+
+    def record(self, phase, seconds):
+        self._background[phase] = seconds
+        if self.enabled and self._reported:
+            # Finished after the startup was reported
+            print(f"  {phase:<16} {seconds * 1000:8.1f} ms  (in the background, after startup)")
+
+    def report(self):
+        if not self.enabled or self._reported:
+            return
+        self._reported = True
+        total = self._last - self._start
+        print("Startup profile:")
+        for phase, seconds in self._phases.items():
+            print(f"  {phase:<16} {seconds * 1000:8.1f} ms  {seconds / total * 100 if total else 0:5.1f} %")
+        print(f"  {'total':<16} {total * 1000:8.1f} ms")
+        for phase, seconds in self._background.items():
+            print(f"  {phase:<16} {seconds * 1000:8.1f} ms  (in the background)")
@@ -0,0 +1,658 @@
+## Weaver [Version 1.0]
+## (c) Twilight Incorporated. All rights reserved.
+
+import os
+import queue
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from urllib.parse import urlsplit
+
+# Visits are written in one transaction once this many are queued...
+VISIT_BATCH_SIZE = 64
+# ...or once the worker has been idle for this many seconds
+VISIT_FLUSH_DELAY = 1.0
+# Repeat visits to the same URL within this many seconds (reloads,
+# redirects) update the existing entry instead of adding a visit
+VISIT_COALESCE_SECONDS = 30
+
+# Bumped whenever the history schema changes, see HistoryDatabase._migrate
+HISTORY_SCHEMA_VERSION = 3
+
+# Marks around matched words in search_history() highlights, escaped
+# text can not contain them
+HIGHLIGHT_START = "\x01"
+HIGHLIGHT_END = "\x02"
+# Title matches count this many times more than URL matches
+SEARCH_TITLE_WEIGHT = 4.0
+# Only this many matches of a search are ranked, those whose URL was first
+# visited most recently (highest urls.id), so short queries matching most
+# of the history stay fast
+SEARCH_RANKED_CANDIDATES = 2000
+# When a search has more matches than that, this many of the most recently
+# visited other URLs are checked too, so a URL first visited long ago still
+# shows up while it is in use. They fill at most a quarter of the results
+SEARCH_RECENT_CANDIDATES = 200
+
+# On-disk favicon cache size cap, least recently used origins are evicted past it
+FAVICON_CACHE_MAX_BYTES = 8 * 1024 * 1024
+# Decoded icons kept in memory
+FAVICON_MEMORY_ENTRIES = 256
+
+# Helper function to get the reversed host of a URL ("www.example.com" ->
+# "moc.elpmaxe.www."), so a domain and its subdomains share an index prefix
+def reverse_host(url):
+    host = urlsplit(url).hostname or ""
+    return host[::-1] + "."
+
+# Helper function to get the [start, end) rev_host range of a domain
+def reverse_host_range(domain):
+    start = domain.lower()[::-1] + "."
+    return start, start[:-1] + "/"
+
+# Words as the search index splits them (unicode61 tokenizer)
+_WORD = re.compile(r"[^\W_]+")
+
+# Helper function to fold text like the search index does: lower case,
+# without diacritics
+def fold(text):
+    text = text.lower()
+    if text.isascii():
+        return text
+    return "".join(char for char in unicodedata.normalize("NFKD", text) if not unicodedata.combining(char))
+
+# Helper function to mark the words of text starting with one of the folded
+# prefixes, like highlight() on a search_query() match
+def highlight_words(text, prefixes):
+    return _WORD.sub(lambda word: HIGHLIGHT_START + word.group() + HIGHLIGHT_END
+                     if fold(word.group()).startswith(prefixes) else word.group(), text)
+
+# Helper function to turn typed text into an FTS5 query: every word must
+# start a word of the title or URL ("sqlite" finds "sqlite3")
+def search_query(text):
+    words = re.findall(r"\w+", text)
+    if not words:
+        return None
+    return " ".join(f'"{word}"*' for word in words)
+
+# Helper function to rebuild the history search index of a profile without
+# running the browser (weaver --rebuild-search-index)
+def rebuild_search_index(profile_directory):
+    history = HistoryDatabase(os.path.join(profile_directory, "history.db"))
+    history.rebuild_search_index()
+    history.close()
+
+# Helper function to open a database the way every store of a profile does
+def connect(db_path, check_same_thread=True):
+    # Statements are prepared once and reused from the connection's cache
+    conn = sqlite3.connect(db_path, cached_statements=64, check_same_thread=check_same_thread)
+    conn.execute("PRAGMA journal_mode=WAL")
+    # In WAL mode this only syncs at checkpoints, not on every commit
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA foreign_keys=ON")
+    return conn
+
+# Helper function to deliver results on the worker thread itself, when the
+# storage is used without a main loop (benchmarks, --rebuild-search-index)
+def call_directly(func, *args):
+    func(*args)
+
+class HistoryDatabase:
+    """
+    history.db of a profile, with blocking calls meant for one thread:
+      - one row per URL in urls, one row per (non-coalesced) visit in visits
+      - the schema is migrated to HISTORY_SCHEMA_VERSION on open
+      - urls_fts indexes titles and URLs for search()
+    """
+    def __init__(self, db_path):
+        self._conn = connect(db_path)
+        self._migrate()
+
+    def add_visits(self, visits):
+        # Records (url, title, timestamp) visits in one transaction
+        with self._conn:
+            for url, title, timestamp in visits:
+                self._record_visit(url, title, timestamp)
+
+    def recent(self, limit):
+        return self._conn.execute(
+            "SELECT url, title, last_visit FROM urls ORDER BY last_visit DESC LIMIT ?", (limit,)).fetchall()
+
+    def count(self):
+        return self._conn.execute("SELECT COUNT(*) FROM urls").fetchone()[0]
+
+    def page(self, after, offset, limit):
+        # Keyset pagination walks the last_visit index from the previous
+        # page's last row instead of skipping over offset rows
+        if after is not None:
+            return self._conn.execute(
+                "SELECT id, url, title, last_visit FROM urls WHERE (last_visit, id) < (?, ?) "
+                "ORDER BY last_visit DESC, id DESC LIMIT ?", (after[0], after[1], limit)).fetchall()
+        return self._conn.execute(
+            "SELECT id, url, title, last_visit FROM urls ORDER BY last_visit DESC, id DESC LIMIT ? OFFSET ?",
+            (limit, offset)).fetchall()
+
+    def url_rows(self):
+        # Iterates over every (url, title, visit_count, last_visit)
+        return self._conn.execute("SELECT url, title, visit_count, last_visit FROM urls")
+
+    def search(self, text, limit):
+        query = search_query(text)
+        if query is None:
+            return []
+        # bm25() scores every row it is asked about, so the rowid bound
+        # (read straight off the index) limits it to the URLs added last.
+        # Bounding by last_visit instead needs a urls lookup per match
+        # (3.7x slower on a 1M visit profile), FTS5 can not push it down
+        bound = self._conn.execute(
+            "SELECT rowid FROM urls_fts WHERE urls_fts MATCH ? ORDER BY rowid DESC LIMIT 1 OFFSET ?",
+            (query, SEARCH_RANKED_CANDIDATES)).fetchone()
+        rows = self._conn.execute(
+            "SELECT urls.url, urls.title, urls.last_visit, "
+            "highlight(urls_fts, 0, :start, :end), highlight(urls_fts, 1, :start, :end) "
+            "FROM urls_fts JOIN urls ON urls.id = urls_fts.rowid "
+            "WHERE urls_fts MATCH :query AND urls_fts.rowid >= :bound "
+            "ORDER BY bm25(urls_fts, :title_weight, 1.0) LIMIT :limit",
+            {"start": HIGHLIGHT_START, "end": HIGHLIGHT_END, "query": query, "bound": bound[0] if bound else 0,
+             "title_weight": SEARCH_TITLE_WEIGHT, "limit": limit}).fetchall()
+        slots = limit // 4
+        if bound is None or not slots:
+            return rows
+
+        # The recently visited URLs among the others come after the ranked
+        # ones. Their words are matched here: FTS5 looks up prefix queries
+        # per rowid by merging every matching term, 20-750 ms per 100 URLs
+        prefixes = tuple(fold(word) for word in _WORD.findall(text))
+        recent = []
+        for url, title, last_visit in self._conn.execute(
+                "SELECT url, title, last_visit FROM urls WHERE id < ? ORDER BY last_visit DESC LIMIT ?",
+                (bound[0], SEARCH_RECENT_CANDIDATES)):
+            title = title or ""
+            words = _WORD.findall(fold(title) + " " + fold(url))
+            if all(any(word.startswith(prefix) for word in words) for prefix in prefixes):
+                recent.append((url, title, last_visit, highlight_words(title, prefixes), highlight_words(url, prefixes)))
+                if len(recent) == slots:
+                    break
+        return rows[:limit - len(recent)] + recent
+
+    def rebuild_search_index(self):
+        with self._conn:
+            self._conn.execute("INSERT INTO urls_fts (urls_fts) VALUES ('rebuild')")
+            # Merge the index into one b-tree for the fastest queries
+            self._conn.execute("INSERT INTO urls_fts (urls_fts) VALUES ('optimize')")
+
+    def delete(self, url):
+        # Its visits go with it (ON DELETE CASCADE)
+        with self._conn:
+            self._conn.execute("DELETE FROM urls WHERE url = ?", (url,))
+
+    def clear(self, since=None, domain=None, vacuum=False):
+        # Restricts URL-level statements to the domain and its subdomains
+        host_filter, host_args = "", ()
+        if domain is not None:
+            host_filter, host_args = " AND rev_host >= ? AND rev_host < ?", reverse_host_range(domain)
+
+        with self._conn:
+            if since is None and domain is None:
+                self._conn.execute("DELETE FROM visits")
+                self._conn.execute("DELETE FROM urls")
+            elif since is None:
+                # Visits go with their URLs (ON DELETE CASCADE)
+                self._conn.execute("DELETE FROM urls WHERE 1" + host_filter, host_args)
+            else:
+                if domain is None:
+                    self._conn.execute("DELETE FROM visits WHERE visit_date >= ?", (since,))
+                else:
+                    self._conn.execute(
+                        "DELETE FROM visits WHERE visit_date >= ? AND url_id IN "
+                        "(SELECT id FROM urls WHERE 1" + host_filter + ")", (since, *host_args))
+                # Only URLs visited in the range need fixing up, which the
+                # last_visit index finds without a scan
+                self._conn.execute(
+                    "DELETE FROM urls WHERE last_visit >= ?" + host_filter + " AND NOT EXISTS "
+                    "(SELECT 1 FROM visits WHERE visits.url_id = urls.id)", (since, *host_args))
+                self._conn.execute(
+                    "UPDATE urls SET "
+                    "visit_count = (SELECT COUNT(*) FROM visits WHERE visits.url_id = urls.id), "
+                    "last_visit = (SELECT MAX(visit_date) FROM visits WHERE visits.url_id = urls.id) "
+                    "WHERE last_visit >= ?" + host_filter, (since, *host_args))
+
+        if vacuum:
+            # Give the freed pages back to the file system. The pragma frees
+            # one page per step, execute() would only run the first step
+            self._conn.executescript("PRAGMA incremental_vacuum;")
+
+    def close(self):
+        self._conn.close()
+
+    def _record_visit(self, url, title, timestamp):
+        row = self._conn.execute("SELECT id, last_visit FROM urls WHERE url = ?", (url,)).fetchone()
+        if row is None:
+            cursor = self._conn.execute(
+                "INSERT INTO urls (url, title, visit_count, last_visit, rev_host) VALUES (?, ?, 1, ?, ?)",
+                (url, title, timestamp, reverse_host(url)))
+            self._conn.execute("INSERT INTO visits (url_id, visit_date) VALUES (?, ?)", (cursor.lastrowid, timestamp))
+            return
+
+        url_id, last_visit = row
+        if timestamp - last_visit < VISIT_COALESCE_SECONDS:
+            # Reload or redirect, only refresh the entry
+            self._conn.execute(
+                "UPDATE urls SET title = COALESCE(NULLIF(?, ''), title), last_visit = ? WHERE id = ?",
+                (title, timestamp, url_id))
+        else:
+            self._conn.execute(
+                "UPDATE urls SET title = COALESCE(NULLIF(?, ''), title), visit_count = visit_count + 1, last_visit = ? WHERE id = ?",
+                (title, timestamp, url_id))
+            self._conn.execute("INSERT INTO visits (url_id, visit_date) VALUES (?, ?)", (url_id, timestamp))
+
+    # Schema migrations
+
+    def _migrate(self):
+        version = self._conn.execute("PRAGMA user_version").fetchone()[0]
+        if version < 1:
+            self._migrate_v1()
+        if version < 2:
+            self._migrate_v2()
+        if version < 3:
+            self._migrate_v3()
+
+    def _migrate_v1(self):
+        # Only takes effect on a database without tables, older ones are
+        # vacuumed once in _migrate_v2
+        self._conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+
+        with self._conn:
+            # One row per URL, plus one row per (non-coalesced) visit
+            self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS urls (
+                id INTEGER PRIMARY KEY,
+                url TEXT NOT NULL UNIQUE,
+                title TEXT NOT NULL DEFAULT '',
+                visit_count INTEGER NOT NULL DEFAULT 0,
+                last_visit INTEGER NOT NULL
+            );
+            ''')
+            self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS visits (
+                id INTEGER PRIMARY KEY,
+                url_id INTEGER NOT NULL REFERENCES urls(id) ON DELETE CASCADE,
+                visit_date INTEGER NOT NULL
+            );
+            ''')
+            self._conn.execute("CREATE INDEX IF NOT EXISTS urls_last_visit ON urls(last_visit)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS visits_url_id ON visits(url_id)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS visits_visit_date ON visits(visit_date)")
+
+            # One-shot import of the old flat history table, whose timestamps
+            # are local time strings like "2024-01-31 12:00:00"
+            has_old_history = self._conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'history'").fetchone()
+            if has_old_history:
+                self._conn.execute('''
+                INSERT OR IGNORE INTO urls (url, title, visit_count, last_visit)
+                SELECT url, title, COUNT(*), MAX(visit_date) FROM (
+                    SELECT url, title, CAST(strftime('%s', timestamp, 'utc') AS INTEGER) AS visit_date
+                    FROM history
+                ) GROUP BY url
+                ''')
+                self._conn.execute('''
+                INSERT INTO visits (url_id, visit_date)
+                SELECT urls.id, CAST(strftime('%s', history.timestamp, 'utc') AS INTEGER)
+                FROM history JOIN urls ON urls.url = history.url
+                ''')
+                self._conn.execute("DROP TABLE history")
+
+            self._conn.execute("PRAGMA user_version = 1")
+
+    def _migrate_v2(self):
+        with self._conn:
+            # Reversed host for per-domain lookups, see reverse_host
+            self._conn.execute("ALTER TABLE urls ADD COLUMN rev_host TEXT NOT NULL DEFAULT ''")
+            rows = self._conn.execute("SELECT id, url FROM urls").fetchall()
+            self._conn.executemany("UPDATE urls SET rev_host = ? WHERE id = ?",
+                                      ((reverse_host(url), url_id) for url_id, url in rows))
+            self._conn.execute("CREATE INDEX IF NOT EXISTS urls_rev_host ON urls(rev_host)")
+            self._conn.execute("PRAGMA user_version = 2")
+
+        if self._conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            # Switching to incremental vacuum needs one full VACUUM
+            self._conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            self._conn.execute("VACUUM")
+
+    def _migrate_v3(self):
+        with self._conn:
+            # Full-text index over titles and URLs. It stores no text of its
+            # own (content='urls'), the triggers keep it in sync
+            self._conn.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS urls_fts USING fts5(
+                title, url, content='urls', content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+            );
+            ''')
+            self._conn.execute('''
+            CREATE TRIGGER IF NOT EXISTS urls_fts_insert AFTER INSERT ON urls BEGIN
+                INSERT INTO urls_fts (rowid, title, url) VALUES (new.id, new.title, new.url);
+            END;
+            ''')
+            self._conn.execute('''
+            CREATE TRIGGER IF NOT EXISTS urls_fts_delete AFTER DELETE ON urls BEGIN
+                INSERT INTO urls_fts (urls_fts, rowid, title, url) VALUES ('delete', old.id, old.title, old.url);
+            END;
+            ''')
+            # Visits only bump visit_count and last_visit, which leave the index alone
+            self._conn.execute('''
+            CREATE TRIGGER IF NOT EXISTS urls_fts_update AFTER UPDATE OF title, url ON urls BEGIN
+                INSERT INTO urls_fts (urls_fts, rowid, title, url) VALUES ('delete', old.id, old.title, old.url);
+                INSERT INTO urls_fts (rowid, title, url) VALUES (new.id, new.title, new.url);
+            END;
+            ''')
+            # Index the history recorded so far
+            self._conn.execute("INSERT INTO urls_fts (urls_fts) VALUES ('rebuild')")
+            self._conn.execute("PRAGMA user_version = 3")
+
+class BookmarkDatabase:
+    """
+    bookmarks.db of a profile, with blocking calls meant for one thread:
+      - one row per URL, in the order they were bookmarked
+    """
+    def __init__(self, db_path):
+        self._conn = connect(db_path)
+        with self._conn:
+            self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS bookmarks (
+                id INTEGER PRIMARY KEY,
+                url TEXT NOT NULL,
+                title TEXT NOT NULL
+            );
+            ''')
+            # Older profiles could bookmark a URL twice, keep the first one
+            has_url_index = self._conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'bookmarks_url'").fetchone()
+            if not has_url_index:
+                self._conn.execute("DELETE FROM bookmarks WHERE id NOT IN (SELECT MIN(id) FROM bookmarks GROUP BY url)")
+                self._conn.execute("CREATE UNIQUE INDEX bookmarks_url ON bookmarks(url)")
+
+    def add(self, url, title):
+        with self._conn:
+            # Bookmarking a URL again renames it
+            self._conn.execute(
+                "INSERT INTO bookmarks (url, title) VALUES (?, ?) ON CONFLICT(url) DO UPDATE SET title = excluded.title",
+                (url, title))
+
+    def all(self):
+        return self._conn.execute("SELECT url, title FROM bookmarks ORDER BY id").fetchall()
+
+    def contains(self, url):
+        return self._conn.execute("SELECT 1 FROM bookmarks WHERE url = ?", (url,)).fetchone() is not None
+
+    def delete(self, url):
+        with self._conn:
+            self._conn.execute("DELETE FROM bookmarks WHERE url = ?", (url,))
+
+    def close(self):
+        self._conn.close()
+
+class FaviconCache:
+    """
+    Favicons of the profile, stored per origin in favicons.db:
+      - PNG bytes as WebKit last reported them for a page of the origin
+      - total size is capped, least recently used origins are evicted first
+      - icons of recently used origins also stay decoded in memory
+    """
+    def __init__(self, profile_directory):
+        self._conn = connect(os.path.join(profile_directory, "favicons.db"), check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            # Caches from before version 1 also kept an expiry and validators
+            # nothing read, their icons are carried over
+            old_cache = self._conn.execute("PRAGMA user_version").fetchone()[0] < 1 and self._conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'favicons'").fetchone()
+            if old_cache:
+                self._conn.execute("DROP INDEX IF EXISTS favicons_last_used")
+                self._conn.execute("ALTER TABLE favicons RENAME TO favicons_old")
+            self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS favicons (
+                origin TEXT PRIMARY KEY,
+                data BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                last_used INTEGER NOT NULL
+            );
+            ''')
+            if old_cache:
+                self._conn.execute("INSERT INTO favicons SELECT origin, data, size, last_used FROM favicons_old")
+                self._conn.execute("DROP TABLE favicons_old")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS favicons_last_used ON favicons(last_used)")
+            self._conn.execute("PRAGMA user_version = 1")
+        # origin -> texture, only touched on the main thread
+        self._memory = OrderedDict()
+
+    # Memory (main thread)
+
+    def get_memory(self, origin):
+        texture = self._memory.get(origin)
+        if texture is not None:
+            self._memory.move_to_end(origin)
+        return texture
+
+    def put_memory(self, origin, texture):
+        self._memory[origin] = texture
+        self._memory.move_to_end(origin)
+        while len(self._memory) > FAVICON_MEMORY_ENTRIES:
+            self._memory.popitem(last=False)
+
+    # Disk (any thread)
+
+    def get(self, origin):
+        # Returns the PNG data, or None
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT data FROM favicons WHERE origin = ?", (origin,)).fetchone()
+            if row:
+                self._conn.execute("UPDATE favicons SET last_used = ? WHERE origin = ?", (int(time.time()), origin))
+        return row[0] if row else None
+
+    def put(self, origin, data):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO favicons (origin, data, size, last_used) VALUES (?, ?, ?, ?)",
+                (origin, data, len(data), int(time.time())))
+            self._evict()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _evict(self):
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM favicons").fetchone()[0]
+        if total <= FAVICON_CACHE_MAX_BYTES:
+            return
+        # Drop least recently used origins until a quarter below the cap,
+        # so eviction does not run again on the next insert
+        target = total - FAVICON_CACHE_MAX_BYTES * 3 // 4
+        freed = 0
+        evicted = []
+        for origin, size in self._conn.execute("SELECT origin, size FROM favicons ORDER BY last_used"):
+            evicted.append((origin,))
+            freed += size
+            if freed >= target:
+                break
+        self._conn.executemany("DELETE FROM favicons WHERE origin = ?", evicted)
+
+class StorageService:
+    """
+    Runs the HistoryDatabase and BookmarkDatabase of a profile on a worker
+    thread:
+      - visits are queued and written in batched transactions when idle
+      - query results are handed to callbacks through dispatch(func, *args),
+        GLib.idle_add to get them on the main loop, call_directly otherwise
+      - a query that fails hands None to its callback, which is always called
+    """
+    def __init__(self, profile_directory, dispatch=call_directly):
+        self.history_db = os.path.join(profile_directory, "history.db")
+        self.bookmarks_db = os.path.join(profile_directory, "bookmarks.db")
+        self._dispatch = dispatch
+        # Seconds the worker took to open (and migrate) the databases
+        self.open_time = None
+
+        self._jobs = queue.Queue()
+        self._pending_visits = []
+        self._thread = threading.Thread(target=self._run, name="weaver-storage", daemon=True)
+        self._thread.start()
+
+    # Public API, safe to call from the main thread
+
+    def add_visit(self, url, title):
+        # Queued write, committed together with other visits
+        timestamp = int(time.time())
+        self._jobs.put(("visit", (url, title or "", timestamp), None))
+
+    def get_recent_history(self, limit, callback):
+        self._submit(lambda: self._history.recent(limit), callback)
+
+    def count_history(self, callback):
+        self._submit(lambda: self._history.count(), callback)
+
+    def get_history_page(self, after, offset, limit, callback):
+        # after is the (last_visit, id) key of the previous page's last row,
+        # offset is only used when that key is not known
+        self._submit(lambda: self._history.page(after, offset, limit), callback)
+
+    def load_url_index(self, factory, callback):
+        # Builds factory(rows) over every (url, title, visit_count, last_visit)
+        # on the worker, so a large index is not built on the main thread
+        self._submit(lambda: factory(self._history.url_rows()), callback)
+
+    def search_history(self, text, limit, callback):
+        # Best matches first, as (url, title, last_visit, highlighted title,
+        # highlighted url) with matches between HIGHLIGHT_START and HIGHLIGHT_END
+        self._submit(lambda: self._history.search(text, limit), callback)
+
+    def rebuild_search_index(self, callback=None):
+        self._submit(lambda: self._history.rebuild_search_index(), callback)
+
+    def delete_from_history(self, url, callback=None):
+        self._submit(lambda: self._history.delete(url), callback)
+
+    def clear_history(self, since=None, domain=None, vacuum=False, callback=None):
+        # Removes visits since the given epoch time (all time if None),
+        # optionally only for one domain and its subdomains
+        self._submit(lambda: self._history.clear(since, domain, vacuum), callback)
+
+    def add_bookmark(self, url, title, callback=None):
+        self._submit(lambda: self._bookmarks.add(url, title), callback)
+
+    def get_bookmarks(self, callback):
+        self._submit(lambda: self._bookmarks.all(), callback)
+
+    def delete_bookmark(self, url, callback=None):
+        self._submit(lambda: self._bookmarks.delete(url), callback)
+
+    def get_open_time(self, callback):
+        # Calls callback(open_time) once the databases are open
+        self._submit(lambda: self.open_time, callback)
+
+    def close(self):
+        # Write out queued visits and close the connections
+        self._jobs.put(None)
+        self._thread.join()
+
+    def _submit(self, func, callback):
+        self._jobs.put((func, (), callback))
+
+    # Worker thread
+
+    def _run(self):
+        start = time.perf_counter()
+        self._history = HistoryDatabase(self.history_db)
+        self._bookmarks = BookmarkDatabase(self.bookmarks_db)
+        self.open_time = time.perf_counter() - start
+
+        while True:
+            try:
+                if self._pending_visits:
+                    job = self._jobs.get(timeout=VISIT_FLUSH_DELAY)
+                else:
+                    job = self._jobs.get()
+            except queue.Empty:
+                # Nothing else to do, commit the queued visits
+                self._flush_visits()
+                continue
+
+            if job is None:
+                break
+
+            func, args, callback = job
+            if func == "visit":
+                self._pending_visits.append(args)
+                if len(self._pending_visits) >= VISIT_BATCH_SIZE:
+                    self._flush_visits()
+                continue
+
+            # Reads must see every visit queued before them
+            self._flush_visits()
+            try:
+                result = func(*args)
+            except Exception as e:
+                # Whatever went wrong, the worker keeps going and the caller
+                # is not left waiting
+                print(f"Storage error: {e}")
+                result = None
+            if callback:
+                self._dispatch(self._deliver, callback, result)
+
+        self._flush_visits()
+        self._history.close()
+        self._bookmarks.close()
+
+    def _deliver(self, callback, result):
+        callback(result)
+        # GLib.SOURCE_REMOVE, when dispatched through GLib.idle_add
+        return False
+
+    def _flush_visits(self):
+        if not self._pending_visits:
+            return
+        visits, self._pending_visits = self._pending_visits, []
+        try:
+            self._history.add_visits(visits)
+        except sqlite3.Error as e:
+            print(f"Failed to save {len(visits)} history entries: {e}")
+
+class BookmarkService:
+    """
+    Bookmarks kept in memory on the main thread, loaded once from the
+    StorageService and updated in place on add and delete:
+      - contains(url) is a dict lookup, whatever the number of bookmarks
+      - on_changed() is called whenever the bookmarks change (or first load)
+    """
+    def __init__(self, storage, on_changed):
+        self._storage = storage
+        self._on_changed = on_changed
+        # url -> title, in insertion order
+        self._bookmarks = {}
+        self._storage.get_bookmarks(self._on_loaded)
+
+    def contains(self, url):
+        return url in self._bookmarks
+
+    def items(self):
+        return self._bookmarks.items()
+
+    def add(self, url, title):
+        self._bookmarks[url] = title
+        self._storage.add_bookmark(url, title)
+        self._on_changed()
+
+    def delete(self, url):
+        if self._bookmarks.pop(url, None) is not None:
+            self._storage.delete_bookmark(url)
+            self._on_changed()
+
+    def _on_loaded(self, bookmarks):
+        # Bookmarks added before the load finished come after the stored ones
+        added, self._bookmarks = self._bookmarks, dict(bookmarks or ())
+        self._bookmarks.update(added)
+        self._on_changed()
@@ -0,0 +1,227 @@
+## Weaver [Version 1.0]
+## (c) Twilight Incorporated. All rights reserved.
+
+import os
+import time
+from gi.repository import Adw, Graphene, Gsk, Gtk, Gio, GLib, Pango, WebKit
+
+# Background tabs unused for this long are discarded (0 = never)
+DEFAULT_DISCARD_IDLE_MINUTES = 60
+# Background tabs are discarded, least recently used first, while the
+# system has less memory available than this (0 = never)
+DEFAULT_DISCARD_MIN_AVAILABLE_MB = 512
+# Seconds between checks of idle tabs and available memory
+DISCARD_CHECK_INTERVAL = 30
+# Tabs discarded at most per check when memory is low
+DISCARD_BATCH = 4
+# Tabs used less than this many seconds ago are kept even under memory pressure
+DISCARD_MIN_IDLE = 60
+# Seconds to wait for the web processes to exit before reporting RSS
+RSS_REPORT_DELAY = 3
+# Discarded tabs show their page scaled down to this width (in pixels),
+# full size snapshots take 8-33 MiB each
+SNAPSHOT_WIDTH = 640
+
+# Helper function to read a value in kB from a /proc status file
+def read_proc_kb(path, field):
+    try:
+        with open(path) as status:
+            for line in status:
+                if line.startswith(field):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+# Helper function to list the child processes of a process
+def child_pids(pid):
+    children = []
+    try:
+        for task in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{task}/children") as file:
+                children.extend(int(child) for child in file.read().split())
+    except OSError:
+        pass
+    return children
+
+# Helper function to scale a texture down to width with the renderer of a
+# window (on the GPU), keeping its aspect ratio
+def scale_texture(texture, width, renderer):
+    if texture.get_width() <= width:
+        return texture
+    height = max(1, texture.get_height() * width // texture.get_width())
+    snapshot = Gtk.Snapshot()
+    snapshot.append_scaled_texture(texture, Gsk.ScalingFilter.LINEAR, Graphene.Rect().init(0, 0, width, height))
+    return renderer.render_texture(snapshot.to_node(), None)
+
+# Helper function to add up the RSS of Weaver and its web, network and
+# sandbox processes, in kB
+def process_tree_rss(pid=None):
+    pending = [os.getpid() if pid is None else pid]
+    total = 0
+    while pending:
+        pid = pending.pop()
+        total += read_proc_kb(f"/proc/{pid}/status", "VmRSS:")
+        pending.extend(child_pids(pid))
+    return total
+
+class DiscardedTab(Gtk.Box):
+    """
+    Stands in for the WebView of a discarded tab:
+      - holds the serialized back/forward list and the URL to restore
+      - shows a thumbnail of the page taken before discarding, or the cached
+        title (when memory ran low, there is no thumbnail)
+    """
+    def __init__(self, url, title, session_state, snapshot=None):
+        super().__init__(orientation=Gtk.Orientation.VERTICAL, valign=Gtk.Align.CENTER, spacing=12)
+        self.url = url
+        self.session_state = session_state
+        if snapshot is not None:
+            picture = Gtk.Picture.new_for_paintable(snapshot)
+            picture.set_content_fit(Gtk.ContentFit.COVER)
+            picture.set_vexpand(True)
+            self.set_valign(Gtk.Align.FILL)
+            self.append(picture)
+        else:
+            label = Gtk.Label(label=title or url, ellipsize=Pango.EllipsizeMode.END, wrap=True)
+            label.get_style_context().add_class("title-2")
+            self.append(label)
+
+class TabLifecycleManager:
+    """
+    Discards background tabs to free the memory of their web processes:
+      - tabs unused for idle_minutes, or the least recently used ones while
+        less than min_available_mb is available or the system reports memory
+        pressure, get their WebView replaced by a DiscardedTab
+      - selecting a discarded tab rebuilds its WebView with create_webview(page)
+        and restores its back/forward list
+      - the selected tab, loading tabs, tabs playing audio and tabs not on a
+        web page are never discarded
+    Tab pages hold an Adw.Bin whose child is the WebView or the DiscardedTab.
+    """
+    def __init__(self, tab_view, create_webview, idle_minutes, min_available_mb):
+        self._tab_view = tab_view
+        self._create_webview = create_webview
+        self.set_limits(idle_minutes, min_available_mb)
+        # Tab page -> time.monotonic() of its last selection
+        self._last_active = {}
+        self.discarded_count = 0
+
+        tab_view.connect("page-detached", self.on_page_detached)
+        self._memory_monitor = Gio.MemoryMonitor.dup_default()
+        self._memory_monitor.connect("low-memory-warning", self.on_low_memory_warning)
+        GLib.timeout_add_seconds(DISCARD_CHECK_INTERVAL, self.on_check)
+
+    def set_limits(self, idle_minutes, min_available_mb):
+        self._idle_seconds = idle_minutes * 60
+        self._min_available_kb = min_available_mb * 1024
+
+    def on_page_selected(self, page):
+        # Call when page becomes the selected tab, before using its WebView
+        self._last_active[page] = time.monotonic()
+        placeholder = page.get_child().get_child()
+        if isinstance(placeholder, DiscardedTab):
+            self.restore(page, placeholder)
+
+    def append_discarded(self, url, title, session_state):
+        # Adds a tab that gets its WebView when first selected
+        page = self._tab_view.append(Adw.Bin(child=DiscardedTab(url, title, session_state)))
+        page.set_title(title or url)
+        self.discarded_count += 1
+        return page
+
+    def on_page_detached(self, tab_view, page, position):
+        self._last_active.pop(page, None)
+
+    def on_low_memory_warning(self, monitor, level):
+        print(f"Memory pressure ({level.value_nick}), discarding background tabs")
+        self.discard_tabs(self._candidates(DISCARD_MIN_IDLE), snapshot=False)
+
+    def on_check(self):
+        now = time.monotonic()
+        if self._idle_seconds:
+            self.discard_tabs(self._candidates(self._idle_seconds))
+        if self._min_available_kb and read_proc_kb("/proc/meminfo", "MemAvailable:") < self._min_available_kb:
+            candidates = self._candidates(DISCARD_MIN_IDLE)
+            candidates.sort(key=lambda page: self._last_active.get(page, now))
+            self.discard_tabs(candidates[:DISCARD_BATCH], snapshot=False)
+        return GLib.SOURCE_CONTINUE
+
+    def discard_tabs(self, pages, snapshot=True):
+        if not pages:
+            return
+        rss_before = process_tree_rss()
+        for page in pages:
+            self.discard(page, snapshot)
+        GLib.timeout_add_seconds(RSS_REPORT_DELAY, self._report_rss, len(pages), rss_before)
+
+    def discard(self, page, snapshot=True):
+        # Without snapshot the tab shows its title, when memory is low
+        webview = page.get_child().get_child()
+        if not isinstance(webview, WebKit.WebView):
+            return
+        if not snapshot:
+            self._replace(page, webview, None)
+            return
+        # The snapshot is rendered by the web process, so take it before
+        # letting that go
+        webview.get_snapshot(WebKit.SnapshotRegion.VISIBLE, WebKit.SnapshotOptions.NONE, None,
+                             self._on_snapshot, page)
+
+    def restore(self, page, placeholder):
+        webview = self._create_webview(page)
+        state = WebKit.WebViewSessionState.new(placeholder.session_state)
+        webview.restore_session_state(state)
+        page.get_child().set_child(webview)
+        item = webview.get_back_forward_list().get_current_item()
+        if item:
+            webview.go_to_back_forward_list_item(item)
+        else:
+            webview.load_uri(placeholder.url)
+        self.discarded_count -= 1
+
+    def _candidates(self, min_idle):
+        now = time.monotonic()
+        selected = self._tab_view.get_selected_page()
+        candidates = []
+        for index in range(self._tab_view.get_n_pages()):
+            page = self._tab_view.get_nth_page(index)
+            webview = page.get_child().get_child()
+            if page == selected or not isinstance(webview, WebKit.WebView):
+                continue
+            if webview.is_loading() or webview.is_playing_audio():
+                continue
+            if not (webview.get_uri() or "").startswith(("http://", "https://")):
+                continue
+            if now - self._last_active.setdefault(page, now) >= min_idle:
+                candidates.append(page)
+        return candidates
+
+    def _on_snapshot(self, webview, result, page):
+        try:
+            snapshot = webview.get_snapshot_finish(result)
+        except GLib.Error:
+            snapshot = None
+        # The tab may have been closed, selected or navigated meanwhile
+        if page.get_child() is None or page.get_child().get_child() is not webview:
+            return
+        if page == self._tab_view.get_selected_page() or webview.is_loading():
+            return
+        if snapshot is not None:
+            native = webview.get_native()
+            snapshot = scale_texture(snapshot, SNAPSHOT_WIDTH, native.get_renderer()) if native else None
+        self._replace(page, webview, snapshot)
+
+    def _replace(self, page, webview, snapshot):
+        placeholder = DiscardedTab(webview.get_uri(), page.get_title(),
+                                   webview.get_session_state().serialize(), snapshot)
+        page.get_child().set_child(placeholder)
+        # End the page now rather than whenever the WebView is collected
+        webview.terminate_web_process()
+        self.discarded_count += 1
+
+    def _report_rss(self, count, rss_before):
+        rss_after = process_tree_rss()
+        print(f"Discarded {count} tab(s): RSS {rss_before // 1024} MiB -> {rss_after // 1024} MiB, "
+              f"{self.discarded_count} tab(s) discarded in total")
+        return GLib.SOURCE_REMOVE
@@ -0,0 +1,312 @@
+## Weaver [Version 1.0]
+## (c) Twilight Incorporated. All rights reserved.
+
+import json
+import math
+import os
+import queue
+import sqlite3
+import threading
+import time
+import weakref
+from urllib.parse import urlsplit
+from gi.repository import GLib, WebKit
+from storage import connect
+
+# Navigation metrics of the profile, never sent anywhere
+METRICS_DB = "metrics.db"
+# Metrics older than this are deleted when the database is opened
+METRICS_RETENTION_DAYS = 30
+# Samples are written in one transaction once this many are queued...
+METRICS_BATCH_SIZE = 256
+# ...or once the writer has been idle for this many seconds
+METRICS_FLUSH_DELAY = 5.0
+# Origins listed on weaver://performance, most visited first
+PERFORMANCE_PAGE_ORIGINS = 50
+# Handler durations are counted in buckets 2^(1/4) apart (about 19%), so
+# the handler table stays small however many calls are recorded
+HANDLER_BUCKETS_PER_DOUBLING = 4
+
+# Columns of a navigation, all in milliseconds from its STARTED event
+# except transfer_bytes
+NAVIGATION_METRICS = ("committed_ms", "finished_ms", "response_start_ms", "first_paint_ms",
+                      "first_contentful_paint_ms", "dom_content_loaded_ms", "load_event_ms",
+                      "transfer_bytes", "handler_ms")
+
+# Navigation and Paint Timing of the page, read in an isolated world so the
+# page's own scripts can not change the answer. Times are relative to the
+# navigation start, cross-origin resources without Timing-Allow-Origin
+# count as 0 bytes
+TIMING_SCRIPT = """
+(() => {
+    const navigation = performance.getEntriesByType("navigation")[0];
+    const paint = {};
+    for (const entry of performance.getEntriesByType("paint"))
+        paint[entry.name] = entry.startTime;
+    let bytes = navigation ? navigation.transferSize || 0 : 0;
+    for (const entry of performance.getEntriesByType("resource"))
+        bytes += entry.transferSize || 0;
+    return JSON.stringify({
+        response_start_ms: navigation ? navigation.responseStart : null,
+        dom_content_loaded_ms: navigation ? navigation.domContentLoadedEventEnd : null,
+        load_event_ms: navigation ? navigation.loadEventEnd : null,
+        first_paint_ms: paint["first-paint"],
+        first_contentful_paint_ms: paint["first-contentful-paint"],
+        transfer_bytes: bytes,
+    });
+})()
+"""
+TIMING_WORLD = "weaver-telemetry"
+
+# Helper function to get the origin of a web URL, or None. Only origins
+# are stored, not the pages visited
+def url_origin(url):
+    if not url or not url.startswith(("http://", "https://")):
+        return None
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+# Helper function to get the p-th percentile of a sorted list
+def percentile(values, p):
+    return values[min(len(values) - 1, int(len(values) * p / 100))] if values else None
+
+# Helper function to get the histogram bucket of a duration in seconds
+def duration_bucket(seconds):
+    return math.floor(math.log2(max(seconds, 1e-6) * 1e6) * HANDLER_BUCKETS_PER_DOUBLING)
+
+# Helper function to get the upper bound (in ms) of a histogram bucket
+def bucket_limit_ms(bucket):
+    return 2 ** ((bucket + 1) / HANDLER_BUCKETS_PER_DOUBLING) / 1000
+
+class MetricsDatabase:
+    """
+    metrics.db of a profile, with blocking calls meant for one thread:
+      - one row per navigation, with the origin and its timings
+      - handler durations as per day histograms, not one row per call
+    """
+    def __init__(self, db_path):
+        self._conn = connect(db_path)
+        with self._conn:
+            self._conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS navigations (
+                id INTEGER PRIMARY KEY,
+                time INTEGER NOT NULL,
+                origin TEXT NOT NULL,
+                {", ".join(f"{column} REAL" for column in NAVIGATION_METRICS)}
+            );
+            ''')
+            self._conn.execute("CREATE INDEX IF NOT EXISTS navigations_time ON navigations(time)")
+            self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS handler_timings (
+                day INTEGER NOT NULL,
+                handler TEXT NOT NULL,
+                bucket INTEGER NOT NULL,
+                calls INTEGER NOT NULL,
+                total_ms REAL NOT NULL,
+                PRIMARY KEY (day, handler, bucket)
+            ) WITHOUT ROWID;
+            ''')
+        self.prune(int(time.time()) - METRICS_RETENTION_DAYS * 86400)
+
+    def add(self, navigations, handler_calls):
+        # navigations are dicts with time, origin and NAVIGATION_METRICS keys,
+        # handler_calls (time, handler, seconds) tuples
+        histogram = {}
+        for timestamp, handler, seconds in handler_calls:
+            key = (timestamp // 86400, handler, duration_bucket(seconds))
+            calls, total_ms = histogram.get(key, (0, 0.0))
+            histogram[key] = (calls + 1, total_ms + seconds * 1000)
+        with self._conn:
+            self._conn.executemany(
+                f"INSERT INTO navigations (time, origin, {', '.join(NAVIGATION_METRICS)}) "
+                f"VALUES (:time, :origin, {', '.join(':' + column for column in NAVIGATION_METRICS)})", navigations)
+            self._conn.executemany(
+                "INSERT INTO handler_timings (day, handler, bucket, calls, total_ms) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT DO UPDATE SET calls = calls + excluded.calls, total_ms = total_ms + excluded.total_ms",
+                ((*key, calls, total_ms) for key, (calls, total_ms) in histogram.items()))
+
+    def origin_report(self, since, limit=PERFORMANCE_PAGE_ORIGINS):
+        # [(origin, navigations, {metric: (p50, p90)})] for the most visited
+        # origins, metrics a page did not report are left out of its percentiles
+        origins = self._conn.execute(
+            "SELECT origin, COUNT(*) AS n FROM navigations WHERE time >= ? GROUP BY origin ORDER BY n DESC LIMIT ?",
+            (since, limit)).fetchall()
+        report = []
+        for origin, count in origins:
+            rows = self._conn.execute(
+                f"SELECT {', '.join(NAVIGATION_METRICS)} FROM navigations WHERE origin = ? AND time >= ?",
+                (origin, since)).fetchall()
+            metrics = {}
+            for index, column in enumerate(NAVIGATION_METRICS):
+                values = sorted(row[index] for row in rows if row[index] is not None)
+                metrics[column] = (percentile(values, 50), percentile(values, 90))
+            report.append((origin, count, metrics))
+        return report
+
+    def handler_report(self, since):
+        # [(handler, calls, total ms, p50 ms, p99 ms, max ms)], slowest in
+        # total first. Percentiles are bucket upper bounds
+        buckets = {}
+        for handler, bucket, calls, total_ms in self._conn.execute(
+                "SELECT handler, bucket, SUM(calls), SUM(total_ms) FROM handler_timings WHERE day >= ? "
+                "GROUP BY handler, bucket ORDER BY handler, bucket", (since // 86400,)):
+            buckets.setdefault(handler, []).append((bucket, calls, total_ms))
+        report = []
+        for handler, counts in buckets.items():
+            calls = sum(count for _, count, _ in counts)
+            limits = {}
+            seen = 0
+            for bucket, count, _ in counts:
+                seen += count
+                for p in (50, 99):
+                    if p not in limits and seen >= calls * p / 100:
+                        limits[p] = bucket_limit_ms(bucket)
+            report.append((handler, calls, sum(total for _, _, total in counts), limits[50], limits[99],
+                           bucket_limit_ms(counts[-1][0])))
+        report.sort(key=lambda row: row[2], reverse=True)
+        return report
+
+    def prune(self, before):
+        with self._conn:
+            self._conn.execute("DELETE FROM navigations WHERE time < ?", (before,))
+            self._conn.execute("DELETE FROM handler_timings WHERE day < ?", (before // 86400,))
+
+    def close(self):
+        self._conn.close()
+
+class NavigationMetrics:
+    """
+    Times every main frame navigation of a profile's tabs, and Weaver's own
+    handlers of their signals:
+      - STARTED -> COMMITTED -> FINISHED deltas, then Navigation and Paint
+        Timing and the bytes transferred, asked of the page once FINISHED
+      - handlers wrapped by timed() are counted per call, and per navigation
+        of the WebView they ran for (decide-policy runs before STARTED, so it
+        counts towards the previous navigation of the tab)
+      - samples go through a queue to a writer thread, which commits them to
+        metrics.db in batches
+    """
+    def __init__(self, profile_directory, enabled=True):
+        self.db_path = os.path.join(profile_directory, METRICS_DB)
+        self.enabled = enabled
+        # WebView -> navigation being timed, gone with the WebView
+        self._navigations = weakref.WeakKeyDictionary()
+        self._jobs = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="weaver-metrics", daemon=True)
+        self._thread.start()
+
+    # Main thread
+
+    def timed(self, name, handler):
+        # Wraps a signal handler whose first argument is the WebView
+        def timed_handler(webview, *args):
+            if not self.enabled:
+                return handler(webview, *args)
+            start = time.perf_counter()
+            try:
+                return handler(webview, *args)
+            finally:
+                seconds = time.perf_counter() - start
+                self._jobs.put(("handler", (int(time.time()), name, seconds)))
+                navigation = self._navigations.get(webview)
+                if navigation is not None:
+                    navigation["handler_ms"] += seconds * 1000
+        return timed_handler
+
+    def on_load_changed(self, webview, load_event):
+        # Connect before the timed load-changed handlers, so a navigation
+        # exists by the time they run
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        if load_event == WebKit.LoadEvent.STARTED:
+            self._navigations[webview] = {"start": now, "committed_ms": None, "handler_ms": 0.0}
+            return
+        navigation = self._navigations.get(webview)
+        if navigation is None:
+            return
+        if load_event == WebKit.LoadEvent.COMMITTED:
+            navigation["committed_ms"] = (now - navigation["start"]) * 1000
+        elif load_event == WebKit.LoadEvent.FINISHED:
+            navigation["finished_ms"] = (now - navigation["start"]) * 1000
+            url = webview.get_uri()
+            if url_origin(url) is None:
+                # weaver:// pages, error pages and about:blank
+                del self._navigations[webview]
+                return
+            webview.evaluate_javascript(TIMING_SCRIPT, -1, TIMING_WORLD, None, None,
+                                        self._on_timing, (navigation, url))
+
+    def on_load_failed(self, webview, *args):
+        self._navigations.pop(webview, None)
+        return False
+
+    def get_report(self, since, callback):
+        # Calls callback((origin report, handler report)) on the main thread,
+        # or callback(None) when the metrics could not be read
+        self._jobs.put(("report", (since, callback)))
+
+    def close(self):
+        # Writes out queued samples
+        self._jobs.put(None)
+        self._thread.join()
+
+    def _on_timing(self, webview, result, user_data):
+        navigation, url = user_data
+        if self._navigations.get(webview) is navigation:
+            del self._navigations[webview]
+        timing = {}
+        try:
+            timing = json.loads(webview.evaluate_javascript_finish(result).to_string())
+        except (GLib.Error, ValueError) as e:
+            # The page went away before the script ran, keep the deltas
+            print(f"Failed to read the navigation timing of {url}: {e}")
+        row = {column: timing.get(column) for column in NAVIGATION_METRICS}
+        row.update(committed_ms=navigation["committed_ms"], finished_ms=navigation["finished_ms"],
+                   handler_ms=navigation["handler_ms"], time=int(time.time()), origin=url_origin(url))
+        for column in ("response_start_ms", "dom_content_loaded_ms", "load_event_ms"):
+            # Navigation Timing reports 0 for what has not happened
+            if not row[column]:
+                row[column] = None
+        self._jobs.put(("navigation", row))
+
+    def _deliver(self, callback, result):
+        callback(result)
+        return GLib.SOURCE_REMOVE
+
+    # Writer thread
+
+    def _run(self):
+        database = MetricsDatabase(self.db_path)
+        navigations, handler_calls = [], []
+        while True:
+            try:
+                job = self._jobs.get(timeout=METRICS_FLUSH_DELAY) if navigations or handler_calls else self._jobs.get()
+            except queue.Empty:
+                job = "flush"
+            if job in (None, "flush") or job[0] == "report" or len(navigations) + len(handler_calls) >= METRICS_BATCH_SIZE:
+                # Reports must see every sample queued before them
+                try:
+                    database.add(navigations, handler_calls)
+                except sqlite3.Error as e:
+                    print(f"Failed to save {len(navigations) + len(handler_calls)} navigation metrics: {e}")
+                navigations, handler_calls = [], []
+            if job is None:
+                break
+            if job == "flush":
+                continue
+            kind, args = job
+            if kind == "navigation":
+                navigations.append(args)
+            elif kind == "handler":
+                handler_calls.append(args)
+            elif kind == "report":
+                since, callback = args
+                try:
+                    report = (database.origin_report(since), database.handler_report(since))
+                except Exception as e:
+                    # The page waiting for it is told rather than left loading
+                    print(f"Failed to read the navigation metrics: {e}")
+                    report = None
+                GLib.idle_add(self._deliver, callback, report)
+        database.close()
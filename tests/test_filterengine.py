@@ -0,0 +1,37 @@
+## Weaver [Version 1.0]
+## (c) Twilight Incorporated. All rights reserved.
+
+import os
+import subprocess
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from filterengine import FilterEngine
+
+FILTERS = "||ads.example.com^\n/banner/*$important\n@@||ads.example.com^"
+URL = "https://ads.example.com/banner/x.png"
+
+def test_important_wins_over_exception():
+    engine = FilterEngine.from_lists([FILTERS])
+    blocked, number = engine.match(URL)
+    assert blocked
+    assert engine.filter_pattern(number) == "/banner/*"
+
+def test_exception_unblocks_without_important():
+    engine = FilterEngine.from_lists(["||ads.example.com^\n@@||ads.example.com^"])
+    assert engine.match(URL)[0] is False
+
+def test_match_is_the_same_for_every_hash_seed():
+    # Token order used to follow set iteration, which changes with the seed
+    script = (f"import sys; sys.path.insert(0, {os.path.dirname(os.path.dirname(os.path.abspath(__file__)))!r}); "
+              f"from filterengine import FilterEngine; print(FilterEngine.from_lists([{FILTERS!r}]).match({URL!r}))")
+    answers = {subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True,
+                              env={**os.environ, "PYTHONHASHSEED": str(seed)}).stdout for seed in range(12)}
+    assert len(answers) == 1
+
+def test_important_wins_whatever_its_token():
+    # The plain filter's token comes first in the URL, the important one's later
+    engine = FilterEngine.from_lists(["||ads.example.com^\n||ads.example.com/banner/x.png$important\n@@/banner/*"])
+    blocked, number = engine.match(URL)
+    assert blocked
+    assert engine.filter_pattern(number) == "||ads.example.com/banner/x.png"
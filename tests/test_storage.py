@@ -0,0 +1,23 @@
+## Weaver [Version 1.0]
+## (c) Twilight Incorporated. All rights reserved.
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from storage import HIGHLIGHT_END, HIGHLIGHT_START, SEARCH_RANKED_CANDIDATES, HistoryDatabase
+
+def test_search_finds_old_urls_visited_lately(tmp_path):
+    history = HistoryDatabase(str(tmp_path / "history.db"))
+    now = int(time.time())
+    history.add_visits([("https://old.example.org/", "Old documentation", now - 300 * 86400)])
+    # Enough URLs first visited after it that it is not among the ranked matches
+    history.add_visits([(f"https://site{index}.example.org/docs", f"Documentation {index}", now - 200 * 86400)
+                        for index in range(SEARCH_RANKED_CANDIDATES + 100)])
+    history.add_visits([("https://old.example.org/", "Old documentation", now)])
+
+    rows = [row for row in history.search("docu", 20) if row[0] == "https://old.example.org/"]
+    history.close()
+    assert rows
+    assert rows[0][3] == f"Old {HIGHLIGHT_START}documentation{HIGHLIGHT_END}"
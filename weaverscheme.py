@@ -0,0 +1,245 @@
+## Weaver [Version 1.0]
+## (c) Twilight Incorporated. All rights reserved.
+
+import html
+import os
+import queue
+import string
+import threading
+import time
+from datetime import datetime
+from urllib.parse import urlsplit, parse_qs
+import gi
+from gi.repository import Gio, GLib, Soup, WebKit
+from storage import HIGHLIGHT_START, HIGHLIGHT_END
+
+try:
+    gi.require_version("GioUnix", "2.0")
+    from gi.repository import GioUnix
+    UnixInputStream = GioUnix.InputStream
+except (ValueError, ImportError):
+    # GLib before 2.80 keeps the Unix streams in Gio
+    UnixInputStream = Gio.UnixInputStream
+
+# Pages and assets compiled into weaver.gresource by "make", looked up under
+# this prefix; running from the source tree they are read from data/weaver
+RESOURCE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "weaver.gresource")
+RESOURCE_PREFIX = "/org/twilight/Weaver/pages/"
+DATA_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "weaver")
+
+# weaver://<page> served from a template, "home" is the start page too
+STATIC_PAGES = {"about": "about.html", "start": "start.html", "home": "start.html"}
+# weaver://assets/<name>, with their content types
+ASSETS = {"page.css": "text/css", "weaver-logo.svg": "image/svg+xml"}
+# Pages are cheap to serve again, assets never change within a version
+PAGE_CACHE_CONTROL = "no-cache"
+ASSET_CACHE_CONTROL = "max-age=31536000, immutable"
+# Periods weaver://performance?days= offers, in days
+PERFORMANCE_PERIODS = (1, 7, 30)
+
+# Helper function to turn a search_history() highlight into HTML
+def highlight_to_html(text):
+    return html.escape(text).replace(HIGHLIGHT_START, "<mark>").replace(HIGHLIGHT_END, "</mark>")
+
+# Helper function to format a percentile pair of weaver://performance
+def format_percentiles(values, unit="ms"):
+    p50, p90 = values
+    if p50 is None:
+        return "-"
+    if unit == "bytes":
+        return f"{p50 / 1024:.0f} / {p90 / 1024:.0f} KiB"
+    return f"{p50:.0f} / {p90:.0f}"
+
+class PageTemplates:
+    """
+    Templates and assets of the weaver:// pages:
+      - read once from weaver.gresource (or data/weaver) and kept parsed
+      - pages without per request data are rendered once and kept as bytes
+    """
+    def __init__(self, version, app_name):
+        self._values = {"version": html.escape(version), "app_name": html.escape(app_name)}
+        self._resource = None
+        if os.path.exists(RESOURCE_FILE):
+            try:
+                self._resource = Gio.Resource.load(RESOURCE_FILE)
+            except GLib.Error as e:
+                print(f"Failed to load {RESOURCE_FILE}, reading {DATA_DIRECTORY}: {e.message}")
+        self._templates = {}
+        self._bytes = {}
+
+    def template(self, name):
+        template = self._templates.get(name)
+        if template is None:
+            template = self._templates[name] = string.Template(self._read(name).get_data().decode())
+        return template
+
+    def render(self, name, **values):
+        return self.template(name).substitute(self._values, **values).encode()
+
+    def static(self, name):
+        # GLib.Bytes of an asset, or of a page without per request data
+        data = self._bytes.get(name)
+        if data is None:
+            data = self._read(name) if name in ASSETS else GLib.Bytes.new(self.render(name))
+            self._bytes[name] = data
+        return data
+
+    def _read(self, name):
+        if self._resource is not None:
+            return self._resource.lookup_data(RESOURCE_PREFIX + name, Gio.ResourceLookupFlags.NONE)
+        with open(os.path.join(DATA_DIRECTORY, name), "rb") as file:
+            return GLib.Bytes.new(file.read())
+
+class ResponseWriter:
+    """
+    Streams a response body to WebKit through a pipe:
+      - write() and close() return at once, a thread does the blocking
+        writes so a slow reader never stalls the main loop
+      - the page renders as chunks arrive
+    """
+    def __init__(self):
+        read_fd, self._fd = os.pipe()
+        self.stream = UnixInputStream.new(read_fd, True)
+        self._chunks = queue.Queue()
+        threading.Thread(target=self._run, name="weaver-scheme-writer", daemon=True).start()
+
+    def write(self, chunk):
+        self._chunks.put(chunk)
+
+    def close(self):
+        self._chunks.put(None)
+
+    # Writer thread
+
+    def _run(self):
+        try:
+            while (chunk := self._chunks.get()) is not None:
+                view = memoryview(chunk)
+                while view:
+                    view = view[os.write(self._fd, view):]
+        except OSError:
+            # The page was closed or navigated away before the end
+            pass
+        finally:
+            os.close(self._fd)
+
+class WeaverSchemeHandler:
+    """
+    Serves weaver:// URLs to every WebView, instead of load_html():
+      - the pages keep their real URL through reloads, back/forward and
+        session restore
+      - static pages and assets come from PageTemplates, with cache headers
+      - weaver://history?q= is streamed, its results are written when
+        search_history(webview, query, callback) returns them
+      - weaver://performance?days= is written when
+        performance_report(webview, since, callback) returns the metrics
+    """
+    def __init__(self, version, app_name, search_history, history_limit, performance_report):
+        self.templates = PageTemplates(version, app_name)
+        self._search_history = search_history
+        self._history_limit = history_limit
+        self._performance_report = performance_report
+
+    def register(self, web_context):
+        web_context.register_uri_scheme("weaver", self.on_request)
+        security_manager = web_context.get_security_manager()
+        # Web pages can not load or link to weaver:// pages
+        security_manager.register_uri_scheme_as_local("weaver")
+        security_manager.register_uri_scheme_as_secure("weaver")
+
+    def on_request(self, request):
+        url = urlsplit(request.get_uri())
+        page = url.netloc
+        if page in STATIC_PAGES:
+            self._respond(request, self.templates.static(STATIC_PAGES[page]), "text/html", PAGE_CACHE_CONTROL)
+        elif page == "assets" and url.path.lstrip("/") in ASSETS:
+            name = url.path.lstrip("/")
+            self._respond(request, self.templates.static(name), ASSETS[name], ASSET_CACHE_CONTROL)
+        elif page == "history":
+            query = parse_qs(url.query).get("q", [""])[0]
+            self._stream_history(request, query)
+        elif page == "performance":
+            days = parse_qs(url.query).get("days", [""])[0]
+            self._stream_performance(request, int(days) if days in map(str, PERFORMANCE_PERIODS) else 7)
+        else:
+            self._respond(request, self.templates.static("invalid.html"), "text/html", PAGE_CACHE_CONTROL, 404)
+
+    def _respond(self, request, data, content_type, cache_control, status=200):
+        response = WebKit.URISchemeResponse.new(Gio.MemoryInputStream.new_from_bytes(data), data.get_size())
+        self._finish(request, response, content_type, cache_control, status)
+
+    def _finish(self, request, response, content_type, cache_control, status=200):
+        response.set_content_type(content_type)
+        response.set_status(status, None)
+        headers = Soup.MessageHeaders.new(Soup.MessageHeadersType.RESPONSE)
+        headers.append("Cache-Control", cache_control)
+        response.set_http_headers(headers)
+        request.finish_with_response(response)
+
+    def _stream_history(self, request, query):
+        writer = ResponseWriter()
+        self._finish(request, WebKit.URISchemeResponse.new(writer.stream, -1), "text/html", PAGE_CACHE_CONTROL)
+        # The search form shows while the storage thread looks for results
+        title = f"{query} - History" if query else "History"
+        writer.write(self.templates.render("history-head.html", title=html.escape(title),
+                                           query=html.escape(query, quote=True)))
+        self._search_history(request.get_web_view(), query, self._history_limit,
+                             lambda rows: self._write_history_rows(writer, query, rows))
+
+    def _write_history_rows(self, writer, query, rows):
+        # rows is None when the history could not be read, the page is
+        # closed whatever happens so it never keeps loading
+        try:
+            row_template = self.templates.template("history-row.html")
+            writer.write("".join(row_template.substitute(
+                url=html.escape(url, quote=True),
+                title=highlight_to_html(highlighted_title) or highlight_to_html(highlighted_url),
+                display_url=highlight_to_html(highlighted_url),
+                date=datetime.fromtimestamp(last_visit).strftime("%Y-%m-%d %H:%M"))
+                for url, title, last_visit, highlighted_title, highlighted_url in rows or ()).encode())
+            if rows is None:
+                message = "<p>The history could not be read.</p>"
+            else:
+                message = f"<p>No history matches <strong>{html.escape(query)}</strong>.</p>" if query and not rows else ""
+            writer.write(self.templates.render("history-tail.html", message=message))
+        finally:
+            writer.close()
+
+    def _stream_performance(self, request, days):
+        writer = ResponseWriter()
+        self._finish(request, WebKit.URISchemeResponse.new(writer.stream, -1), "text/html", PAGE_CACHE_CONTROL)
+        self._performance_report(request.get_web_view(), int(time.time()) - days * 86400,
+                                 lambda report: self._write_performance(writer, days, report))
+
+    def _write_performance(self, writer, days, report):
+        # report is None when the metrics could not be read
+        try:
+            self._write_performance_report(writer, days, report)
+        finally:
+            writer.close()
+
+    def _write_performance_report(self, writer, days, report):
+        origins, handlers = report or ([], [])
+        labels = {period: f"Last {period} days" if period > 1 else "Last day" for period in PERFORMANCE_PERIODS}
+        period_links = " · ".join(
+            f"<strong>{label}</strong>" if period == days else f'<a href="weaver://performance?days={period}">{label}</a>'
+            for period, label in labels.items())
+        origin_rows = "\n".join(
+            f"<tr><td>{html.escape(origin)}</td><td>{count}</td>"
+            + "".join(f"<td>{format_percentiles(metrics[column])}</td>" for column in (
+                "committed_ms", "finished_ms", "response_start_ms", "first_paint_ms",
+                "first_contentful_paint_ms", "dom_content_loaded_ms", "load_event_ms"))
+            + f"<td>{format_percentiles(metrics['transfer_bytes'], 'bytes')}</td>"
+            + f"<td>{format_percentiles(metrics['handler_ms'])}</td></tr>"
+            for origin, count, metrics in origins)
+        handler_rows = "\n".join(
+            f"<tr><td>{html.escape(handler)}</td><td>{calls}</td><td>{total_ms:.0f} ms</td>"
+            f"<td>{p50_ms:.2f} ms</td><td>{p99_ms:.2f} ms</td><td>{max_ms:.2f} ms</td></tr>"
+            for handler, calls, total_ms, p50_ms, p99_ms, max_ms in handlers)
+        if report is None:
+            message = "<p>The navigation metrics could not be read.</p>"
+        else:
+            message = "" if origins or handlers else "<p>No page loads recorded in this period.</p>"
+        writer.write(self.templates.render("performance.html", period_links=period_links,
+                                           navigations=sum(count for _, count, _ in origins),
+                                           origin_rows=origin_rows, handler_rows=handler_rows, message=message))